@@ -0,0 +1,244 @@
+# admission.py
+"""
+Admission control for the page endpoints
+Each priority class (continue > generate > voice_demo) has its own concurrency
+limit, queue bound and queue timeout, and all classes share ADMISSION_MAX_CONCURRENT
+slots. A freed slot goes to the highest-priority class with a waiter. Within
+a class, waiters are served round-robin per client (X-Client-ID, else the
+peer address), and each client may only hold a few queue places, so one busy
+classroom can't starve the others. A request that can't be queued, or waits
+past its timeout, gets 503 with Retry-After.
+
+Limits are per worker process.
+"""
+
+import json
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from config import Config
+from deadlines import remaining
+from degradation import get_ladder
+from metrics import ADMISSION_QUEUE, ADMISSION_IN_FLIGHT, ADMISSION_SHED, ADMISSION_WAIT
+
+# Highest priority first
+PRIORITIES = ("continue", "generate", "voice_demo")
+
+ROUTE_CLASSES = {
+    ("POST", "/story/continue"): "continue",
+    ("GET", "/story/generate"): "generate",
+    ("POST", "/story/continue/stream"): "continue",
+    ("GET", "/story/generate/stream"): "generate",
+    ("POST", "/story/batch"): "generate",
+    ("GET", "/api/voice-demo"): "voice_demo"
+}
+
+
+@dataclass
+class ClassLimits:
+    concurrency: int
+    queue: int
+    timeout: float
+
+    @classmethod
+    def parse(cls, spec: str) -> "ClassLimits":
+        """From "concurrency,queue,timeout seconds", e.g. "16,32,5" """
+        concurrency, queue, timeout = (part.strip() for part in spec.split(","))
+        return cls(int(concurrency), int(queue), float(timeout))
+
+
+class Shed(Exception):
+    """Request rejected by admission control"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Priority and per-client fair admission for one event loop"""
+
+    def __init__(self, max_concurrent: int, limits: Dict[str, ClassLimits], max_queued_per_client: int):
+        self.max_concurrent = max_concurrent
+        self.limits = limits
+        self.max_queued_per_client = max_queued_per_client
+        self.running = 0
+        self.running_by_class = {name: 0 for name in limits}
+        # class -> client -> waiting futures; clients rotate to the back after being served
+        self.queues = {name: OrderedDict() for name in limits}
+        self.queued = {name: 0 for name in limits}
+        # Smoothed seconds per request, for Retry-After estimates
+        self.service_time = {name: 1.0 for name in limits}
+
+    def _can_run(self, name: str) -> bool:
+        return self.running < self.max_concurrent and self.running_by_class[name] < self.limits[name].concurrency
+
+    def _start(self, name: str):
+        self.running += 1
+        self.running_by_class[name] += 1
+        ADMISSION_IN_FLIGHT.inc(name)
+
+    def _retry_after(self, name: str) -> int:
+        limits = self.limits[name]
+        backlog = (self.queued[name] + 1) * self.service_time[name] / max(limits.concurrency, 1)
+        return max(1, min(60, math.ceil(backlog)))
+
+    def _shed(self, name: str, reason: str) -> Shed:
+        ADMISSION_SHED.inc(name, reason)
+        return Shed(reason, self._retry_after(name))
+
+    async def acquire(self, name: str, client: str):
+        """
+        Wait for a slot in `name`
+
+        Raises:
+            Shed: queue full for the class or client, or queue timeout expired
+        """
+        if self._can_run(name) and not self.queued[name]:
+            self._start(name)
+            self._observe_wait(name, 0.0)
+            return
+
+        limits = self.limits[name]
+        waiters = self.queues[name].get(client)
+        if self.queued[name] >= limits.queue:
+            raise self._shed(name, "queue_full")
+        if waiters is not None and len(waiters) >= self.max_queued_per_client:
+            raise self._shed(name, "client_queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        if waiters is None:
+            waiters = self.queues[name][client] = deque()
+        waiters.append(future)
+        self.queued[name] += 1
+        ADMISSION_QUEUE.inc(name)
+        start = time.perf_counter()
+        # Never queue past the request's own deadline
+        left = remaining()
+        wait = limits.timeout if left is None else max(0.0, min(limits.timeout, left))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), wait)
+        except asyncio.TimeoutError:
+            if future.done():
+                # Admitted at the last moment; keep the slot
+                self._observe_wait(name, time.perf_counter() - start)
+                return
+            self._remove(name, client, future)
+            self._observe_wait(name, time.perf_counter() - start)
+            raise self._shed(name, "timeout")
+        except asyncio.CancelledError:
+            if future.done():
+                self.release(name, None)
+            else:
+                self._remove(name, client, future)
+            raise
+        self._observe_wait(name, time.perf_counter() - start)
+
+    @staticmethod
+    def _observe_wait(name: str, seconds: float):
+        ADMISSION_WAIT.observe(seconds, name)
+        # Long queues mean pages should get cheaper (see degradation.py)
+        get_ladder().observe("queue", seconds)
+
+    def _remove(self, name: str, client: str, future: asyncio.Future):
+        future.cancel()
+        waiters = self.queues[name].get(client)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self.queued[name] -= 1
+            ADMISSION_QUEUE.dec(name)
+            if not waiters:
+                del self.queues[name][client]
+
+    def release(self, name: str, elapsed: Optional[float]):
+        """Free a slot taken by acquire() and hand it to the next waiter"""
+        self.running -= 1
+        self.running_by_class[name] -= 1
+        ADMISSION_IN_FLIGHT.dec(name)
+        if elapsed is not None:
+            self.service_time[name] = 0.8 * self.service_time[name] + 0.2 * elapsed
+        self._dispatch()
+
+    def _dispatch(self):
+        for name in PRIORITIES:
+            clients = self.queues.get(name)
+            while clients and self._can_run(name):
+                client, waiters = next(iter(clients.items()))
+                future = waiters.popleft()
+                self.queued[name] -= 1
+                ADMISSION_QUEUE.dec(name)
+                if waiters:
+                    clients.move_to_end(client)
+                else:
+                    del clients[client]
+                self._start(name)
+                future.set_result(None)
+
+
+_controller = None
+
+
+def get_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            Config.ADMISSION_MAX_CONCURRENT,
+            {
+                'continue': ClassLimits.parse(Config.ADMISSION_CONTINUE),
+                'generate': ClassLimits.parse(Config.ADMISSION_GENERATE),
+                'voice_demo': ClassLimits.parse(Config.ADMISSION_VOICE_DEMO)
+            },
+            Config.ADMISSION_MAX_QUEUED_PER_CLIENT
+        )
+    return _controller
+
+
+def client_key(scope) -> str:
+    """Who to be fair between: the client ID header, else the peer address"""
+    header = Config.ADMISSION_CLIENT_HEADER.lower().encode("latin-1")
+    for name, value in scope.get("headers") or []:
+        if name == header and value:
+            return "id:" + value.decode("latin-1")[:64]
+    peer: Optional[Tuple[str, int]] = scope.get("client")
+    return "ip:" + (peer[0] if peer else "unknown")
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying admission control to the page endpoints"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        name = ROUTE_CLASSES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        controller = get_controller()
+        try:
+            await controller.acquire(name, client_key(scope))
+        except Shed as e:
+            body = json.dumps({'detail': "The storyteller is very busy right now, please try again shortly", 'reason': e.reason}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(e.retry_after).encode())
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(name, time.perf_counter() - start)
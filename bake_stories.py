@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Bake branching story trees for popular themes
+For each theme and age group, generates the opening, the page behind every
+choice down to --depth, and a happy ending under each page, with narration
+and illustrations, using the same StoryGenerator as the server. Pages are
+generated concurrently under --concurrency and an LLM --rate limit, and the
+bake resumes from its journal if interrupted. See story_tree.py for the format.
+
+    python3 bake_stories.py --themes friendship,space,dinosaurs --ages 3-5,6-8 --depth 3
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import asyncio
+import argparse
+
+from config import Config
+import story_tree
+import usage
+from deadlines import run_in_thread
+from image_service import PROMPT_PREFIX, generate_images
+from voice_service import generate_voice_with_polly
+from services.story_generator import StoryGenerator, ending_prompt
+
+
+class RateLimiter:
+    """At most `rate` acquisitions per second, spaced evenly"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class TreeBaker:
+    """Bakes one (theme, age group) tree, appending finished pages to its journal"""
+
+    def __init__(self, generator: StoryGenerator, theme: str, bucket: str, args, limiter: RateLimiter):
+        self.generator = generator
+        self.theme = theme
+        self.bucket = bucket
+        self.age = story_tree.BUCKET_AGES[bucket]
+        self.args = args
+        self.limiter = limiter
+        self.path = story_tree.tree_path(args.out, theme, bucket)
+        self.journal_path = f"{self.path}.journal"
+        self.media_dir = os.path.join(args.out, "media")
+        self.nodes = story_tree.read_journal(self.journal_path)
+        self.failed = 0
+
+    async def bake(self):
+        resumed = len(self.nodes)
+        os.makedirs(self.media_dir, exist_ok=True)
+        total = story_tree.count_pages(3, self.args.depth, self.args.endings)
+        print(f"🌳 {self.theme} ({self.bucket}): up to {total} pages" + (f", resuming with {resumed} baked" if resumed else ""))
+
+        queue = asyncio.Queue()
+        if story_tree.ROOT not in self.nodes:
+            queue.put_nowait(story_tree.ROOT)
+        for node_id in list(self.nodes):
+            for missing in story_tree.missing_children(self.nodes, node_id, self.args.depth, self.args.endings):
+                queue.put_nowait(missing)
+
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            async def worker():
+                while True:
+                    node_id = await queue.get()
+                    try:
+                        node = await self._bake_page(node_id)
+                    except Exception as e:
+                        self.failed += 1
+                        print(f"⚠️ {self.theme} ({self.bucket}) page {node_id} failed: {e}")
+                    else:
+                        self.nodes[node_id] = node
+                        journal.write(json.dumps(node, separators=(",", ":")) + "\n")
+                        journal.flush()
+                        for child in story_tree.missing_children(self.nodes, node_id, self.args.depth, self.args.endings):
+                            queue.put_nowait(child)
+                    finally:
+                        queue.task_done()
+
+            workers = [asyncio.create_task(worker()) for _ in range(self.args.concurrency)]
+            await queue.join()
+            for task in workers:
+                task.cancel()
+
+        if self.failed:
+            print(f"⚠️ {self.theme} ({self.bucket}): {self.failed} pages failed; run again to resume")
+            return False
+        story_tree.write_tree(self.path, {
+            'format': story_tree.FORMAT_VERSION,
+            'theme': self.theme,
+            'age_bucket': self.bucket,
+            'depth': self.args.depth,
+            'voice': self.args.voice if self.args.media else None,
+            'baked_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'nodes': self.nodes
+        })
+        os.remove(self.journal_path)
+        print(f"✅ {self.theme} ({self.bucket}): {len(self.nodes)} pages -> {self.path}")
+        return True
+
+    async def _bake_page(self, node_id: str) -> dict:
+        parts = node_id.split(".")
+        parent_id = ".".join(parts[:-1])
+        is_ending = parts[-1] == story_tree.ENDING
+        usage.current_page.set(story_tree.depth_of(node_id) + 1)
+
+        await self.limiter.acquire()
+        if node_id == story_tree.ROOT:
+            choice = None
+            result = await self.generator.generate_story(
+                prompt=f"An interactive adventure about {self.theme}",
+                max_length=1000, temperature=0.7, is_continuation=False, age=self.age
+            )
+        elif is_ending:
+            choice = None
+            result = await self.generator.generate_story(
+                prompt=ending_prompt(story_tree.path_context(self.nodes, parent_id)),
+                max_length=1000, temperature=0.7, is_continuation=False, age=self.age
+            )
+            result["choices"] = []
+        else:
+            choice = self.nodes[parent_id]['choices'][int(parts[-1])]
+            result = await self.generator.generate_story(
+                prompt=story_tree.path_context(self.nodes, parent_id),
+                max_length=1000, temperature=0.7, is_continuation=True,
+                previous_choice=choice, age=self.age
+            )
+
+        voice_file, images = "", []
+        if self.args.media:
+            name = f"{story_tree.slug(self.theme)}-{self.bucket}-{node_id}"
+            voice_file, images = await asyncio.gather(
+                run_in_thread(
+                    generate_voice_with_polly, result["story"], voice_id=self.args.voice,
+                    output_file=os.path.join(self.media_dir, f"{name}.mp3")
+                ),
+                run_in_thread(self._illustrate, result["story"], name)
+            )
+            # A page missing its media is baked again on the next run
+            if not voice_file or not images:
+                raise RuntimeError("narration or illustration failed")
+
+        return {
+            'id': node_id,
+            'choice': choice,
+            'ending': is_ending,
+            'story': result["story"],
+            'location': result.get("location", ""),
+            'choices': result.get("choices", []),
+            'voice_file': voice_file or "",
+            'images': images or [],
+            'usage': result.get("usage")
+        }
+
+    def _illustrate(self, story_text: str, name: str):
+        """Titan illustration, moved from MEDIA_DIR (which is pruned) into the tree's media"""
+        # Stable seed per page, so a rebake draws the same picture for the same text;
+        # not cached, since the file is moved away below
+        media_id = hashlib.sha1(name.encode()).hexdigest()[:32]
+        images = generate_images(PROMPT_PREFIX + story_text[:200], media_id, use_cache=False)
+        baked = []
+        for path in images:
+            target = os.path.join(self.media_dir, f"{name}.png")
+            os.replace(path, target)
+            baked.append(target)
+        return baked
+
+
+async def bake(args) -> bool:
+    generator = StoryGenerator()
+    limiter = RateLimiter(args.rate)
+    usage.current_route.set("bake")
+    themes = [t.strip() for t in args.themes.split(",") if t.strip()]
+    buckets = [b.strip() for b in args.ages.split(",") if b.strip()]
+    ok = True
+    for theme in themes:
+        for bucket in buckets:
+            baker = TreeBaker(generator, theme, bucket, args, limiter)
+            if os.path.exists(baker.path) and not os.path.exists(baker.journal_path) and not args.force:
+                print(f"⏭️ {theme} ({bucket}) already baked: {baker.path} (--force to rebake)")
+                continue
+            ok = await baker.bake() and ok
+    total = usage.SUMMARY.snapshot()['total']
+    print(f"💰 {total['calls']} model calls, {total['input_tokens']} input / {total['output_tokens']} output tokens, ~${total['cost_usd']:.2f}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate branching story trees for popular themes")
+    parser.add_argument("--themes", required=True, help="Comma-separated themes, e.g. friendship,space")
+    parser.add_argument("--ages", default="3-5,6-8,9-12", help=f"Comma-separated age groups ({', '.join(story_tree.BUCKET_AGES)})")
+    parser.add_argument("--depth", type=int, default=3, help="Choices deep to bake below the opening")
+    parser.add_argument("--no-endings", dest="endings", action="store_false", help="Don't bake a happy ending under each page")
+    parser.add_argument("--no-media", dest="media", action="store_false", help="Text only: no narration or illustrations")
+    parser.add_argument("--voice", default="Ivy", help="Polly voice for baked narration")
+    parser.add_argument("--concurrency", type=int, default=8, help="Pages generated at once")
+    parser.add_argument("--rate", type=float, default=2.0, help="Story model calls per second (0 = unlimited)")
+    parser.add_argument("--out", default=Config.STORY_TREE_DIR, help="Tree directory; the server reads STORY_TREE_DIR")
+    parser.add_argument("--force", action="store_true", help="Rebake trees that already exist")
+    args = parser.parse_args()
+
+    for bucket in args.ages.split(","):
+        if bucket.strip() not in story_tree.BUCKET_AGES:
+            parser.error(f"Unknown age group {bucket!r}")
+    os.makedirs(args.out, exist_ok=True)
+    try:
+        ok = asyncio.run(bake(args))
+    except KeyboardInterrupt:
+        print("\n⏸️ Interrupted; run the same command again to resume")
+        sys.exit(130)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# batch.py
+"""
+Classroom batches: many story openings scheduled as one job
+POST /story/batch takes one entry per child. Entries asking for the same
+prompt (theme and age) share one story call, and entries that also share a
+voice share its narration. Each child's page moves through the stages on its
+own, so one child's narration and illustration overlap with other children's
+story calls. Every stage is capped by a worker-wide provider limit
+(BATCH_*_CONCURRENCY), shared by all batches running on the worker.
+"""
+
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List
+
+from config import Config
+from deadlines import dropped_stages, reset_dropped
+from metrics import BATCH_COALESCED
+
+
+class Coalescer:
+    """Runs each keyed piece of work once per batch; later callers share its result"""
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def run(self, stage: str, key: Hashable, factory):
+        """
+        Result of factory() for this key, started by the first caller
+
+        Returns (value, stages the shared work dropped, whether it was shared)
+        """
+        task = self._tasks.get((stage, key))
+        shared = task is not None
+        if task is None:
+            task = self._tasks[(stage, key)] = asyncio.ensure_future(_scoped(factory))
+        else:
+            BATCH_COALESCED.inc(stage)
+        # One waiter giving up doesn't cancel work the others still need
+        value, dropped = await asyncio.shield(task)
+        return value, dropped, shared
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+
+async def _scoped(factory):
+    # Stages dropped by shared work are reported to every child that uses it
+    reset_dropped()
+    value = await factory()
+    return value, dropped_stages()
+
+
+class StageLimits:
+    """Concurrent provider calls allowed per stage for batch work on this worker"""
+
+    def __init__(self, limits: Dict[str, int]):
+        self._semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in limits.items()}
+
+    @asynccontextmanager
+    async def slot(self, stage: str):
+        async with self._semaphores[stage]:
+            yield
+
+
+_limits = None
+_limits_lock = threading.Lock()
+
+
+def get_stage_limits() -> StageLimits:
+    global _limits
+    if _limits is None:
+        with _limits_lock:
+            if _limits is None:
+                _limits = StageLimits({
+                    'llm': Config.BATCH_LLM_CONCURRENCY,
+                    'polly': Config.BATCH_POLLY_CONCURRENCY,
+                    'titan': Config.BATCH_TITAN_CONCURRENCY
+                })
+    return _limits
+
+
+def summarize(results: List[Dict]) -> Dict:
+    """Closing line of a batch stream"""
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+    return {'done': True, 'entries': len(results), 'statuses': statuses}
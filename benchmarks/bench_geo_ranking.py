@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the vectorized geo ranking stage
+Run from the project root: python benchmarks/bench_geo_ranking.py
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.geo_ranking import rank_points, rank_businesses
+
+ORIGIN = (47.6062, -122.3321)  # Seattle
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+
+
+def make_points(count: int, rng: np.random.Generator):
+    """Random points within roughly 20km of the origin"""
+    latitudes = ORIGIN[0] + rng.uniform(-0.18, 0.18, count)
+    longitudes = ORIGIN[1] + rng.uniform(-0.27, 0.27, count)
+    return latitudes, longitudes
+
+
+def make_businesses(latitudes, longitudes):
+    """Provider-shaped business dictionaries"""
+    return [
+        {
+            'name': f"Business {i}",
+            'address': f"{i} Main Street",
+            'categories': ["Cafe"],
+            'latitude': float(lat),
+            'longitude': float(lng),
+            'distance': 0
+        }
+        for i, (lat, lng) in enumerate(zip(latitudes, longitudes))
+    ]
+
+
+def best_of(fn, repeat: int) -> float:
+    """Best wall time of `repeat` runs in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark geo ranking")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--radius", type=float, default=5000)
+    parser.add_argument("--max-results", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'points':>8} {'rank_points ms':>16} {'rank_businesses ms':>20} {'kept':>6}")
+    for count in SIZES:
+        latitudes, longitudes = make_points(count, rng)
+        businesses = make_businesses(latitudes, longitudes)
+
+        points_ms = best_of(
+            lambda: rank_points(*ORIGIN, latitudes, longitudes, radius=args.radius,
+                                max_results=args.max_results),
+            args.repeat
+        )
+        businesses_ms = best_of(
+            lambda: rank_businesses(businesses, *ORIGIN, radius=args.radius,
+                                    max_results=args.max_results),
+            args.repeat
+        )
+        kept = len(rank_points(*ORIGIN, latitudes, longitudes, radius=args.radius)[0])
+        print(f"{count:>8} {points_ms:>16.3f} {businesses_ms:>20.3f} {kept:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the illustration cache lookup (image_service.IllustrationCache)
+Fills a BoundedVectorIndex with synthetic illustration prompts, then times a
+lookup (embedding the prompt plus the age-filtered nearest-neighbour search)
+by brute force and with IVF, for lightly reworded copies of cached prompts
+and for new ones. Also reports how often each is found above the threshold,
+the index's memory, and the cost of inserts once it is full and evicting.
+
+Run from the project root: python benchmarks/bench_illustration_cache.py
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_service import embed_text, embed_texts
+from vector_store import BoundedVectorIndex
+
+BUCKETS = ["3-5", "6-8", "9-12"]
+CHARACTERS = ["a shy dragon", "a brave mouse", "two best friends", "a lost robot", "a curious owl", "a little fox",
+              "a kind giant", "a sleepy bear", "a young astronaut", "a singing whale", "a clever rabbit", "a tiny knight"]
+PLACES = ["the enchanted forest", "a floating island", "the bottom of the ocean", "a busy city", "the moon",
+          "a snowy mountain", "a magic library", "a desert oasis", "a candy village", "an old lighthouse"]
+GOALS = ["finds a glowing map", "learns to share", "helps a friend in trouble", "searches for a missing star",
+         "builds a secret treehouse", "discovers a hidden door", "plants a wonderful garden", "solves a riddle"]
+DETAILS = ["under a purple sky", "as the sun rises", "during a thunderstorm", "on a windy afternoon",
+           "while the town sleeps", "with a map drawn in crayon", "to the sound of drums", "in the first snow"]
+SWAPS = {"shy": "timid", "brave": "bold", "little": "small", "kind": "gentle", "finds": "discovers", "busy": "bustling"}
+
+
+def prompt(rng: np.random.Generator) -> str:
+    """An opening like the first 200 characters the app draws from"""
+    return (f"Once upon a time, {rng.choice(CHARACTERS)} from {rng.choice(PLACES)} {rng.choice(GOALS)} "
+            f"{rng.choice(DETAILS)}. Along the way {rng.choice(CHARACTERS)} {rng.choice(GOALS)} "
+            f"near {rng.choice(PLACES)}, story {rng.integers(1_000_000)}.")[:200]
+
+
+def reword(text: str, rng: np.random.Generator) -> str:
+    """The same opening with a word or two changed, as a regenerated page would be"""
+    words = text.split()
+    words = [SWAPS.get(w, w) for w in words]
+    i = int(rng.integers(len(words)))
+    words[i] = "suddenly " + words[i]
+    return " ".join(words)
+
+
+def time_lookups(index, queries, buckets, dim):
+    """Median and p95 lookup latency in milliseconds, and the best match per query"""
+    latencies, best = [], []
+    for text, bucket in zip(queries, buckets):
+        start = time.perf_counter()
+        found = index.search(embed_text(text, dim), k=1, where=lambda m: m['age_bucket'] == bucket)
+        latencies.append((time.perf_counter() - start) * 1000)
+        best.append(found[0] if found else None)
+    return np.percentile(latencies, 50), np.percentile(latencies, 95), best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark illustration cache lookups")
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    index = BoundedVectorIndex(args.entries, dim=args.dim, ivf_threshold=args.entries + 1, nprobe=args.nprobe)
+    texts = [prompt(rng) for _ in range(args.entries)]
+    buckets = [BUCKETS[i % len(BUCKETS)] for i in range(args.entries)]
+    start = time.perf_counter()
+    for begin in range(0, args.entries, 10_000):
+        block = slice(begin, begin + 10_000)
+        index.upsert_batch(
+            [f"p{i}" for i in range(begin, min(begin + 10_000, args.entries))],
+            embed_texts(texts[block], args.dim),
+            [{'age_bucket': b, 'variants': []} for b in buckets[block]]
+        )
+    print(f"filled {len(index):,} prompts in {time.perf_counter() - start:.1f}s, "
+          f"{index._vectors.nbytes / 2**20:.0f} MiB of vectors")
+
+    picks = rng.choice(args.entries, args.queries, replace=False)
+    near = [reword(texts[i], rng) for i in picks]
+    near_buckets = [buckets[i] for i in picks]
+    novel = [prompt(rng) for _ in range(args.queries)]
+    novel_buckets = [BUCKETS[i % len(BUCKETS)] for i in range(args.queries)]
+
+    print(f"{'search':>7} {'queries':>8} {'p50 ms':>7} {'p95 ms':>7} {'found':>6} {'reused':>7}")
+    for name in ("brute", "ivf"):
+        if name == "ivf":
+            build_start = time.perf_counter()
+            index.build_ivf()
+            print(f"ivf build: {time.perf_counter() - build_start:.2f}s, {len(index._lists)} lists")
+        for kind, queries, query_buckets in (("reworded", near, near_buckets), ("new", novel, novel_buckets)):
+            p50, p95, best = time_lookups(index, queries, query_buckets, args.dim)
+            # found: the reworded prompt's own source came back; reused: above the threshold
+            found = sum(1 for b, i in zip(best, picks) if b and b['id'] == f"p{i}") / len(queries)
+            reused = sum(1 for b in best if b and b['score'] >= args.threshold) / len(queries)
+            print(f"{name:>7} {kind:>8} {p50:>7.2f} {p95:>7.2f} {found if kind == 'reworded' else 0:>6.2f} {reused:>7.2f}")
+
+    # Past capacity every insert evicts the oldest prompt and updates its IVF list in place
+    extra = [prompt(rng) for _ in range(1000)]
+    start = time.perf_counter()
+    evicted = 0
+    for i, text in enumerate(extra):
+        evicted += len(index.upsert_batch([f"x{i}"], embed_text(text, args.dim)[None, :], [{'age_bucket': "6-8", 'variants': []}]))
+    per_insert = (time.perf_counter() - start) / len(extra) * 1000
+    print(f"full index: {per_insert:.3f} ms per insert, {evicted} evicted, still {len(index):,} prompts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark for local vector search (brute force vs. IVF)
+Run from the project root: python benchmarks/bench_vector_search.py
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_service import EMBEDDING_DIM, embed_texts
+from vector_store import LocalVectorStore
+
+SIZES = [10_000, 100_000, 1_000_000]
+THEMES = ["kindness", "friendship", "dragons", "space", "ocean", "forest", "music", "courage"]
+
+
+def clustered_vectors(count: int, topics: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Normalised vectors grouped around a few hundred topics, like real book embeddings"""
+    vectors = rng.standard_normal((count, topics.shape[1]), dtype=np.float32)
+    vectors *= 0.6
+    vectors += topics[rng.integers(0, len(topics), count)]
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def time_queries(store, queries, k):
+    """Median and p95 query latency in milliseconds"""
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.search(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def recall(store, queries, exact, k):
+    """Fraction of the exact top-k returned by the current index"""
+    found = 0
+    for query, expected in zip(queries, exact):
+        found += len({hit['id'] for hit in store.search(query, k=k)} & expected)
+    return found / (len(queries) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local vector search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    topics = rng.standard_normal((256, EMBEDDING_DIM), dtype=np.float32)
+    start = time.perf_counter()
+    texts = [f"A story about {THEMES[i % len(THEMES)]} and a brave friend number {i}" for i in range(1000)]
+    embed_texts(texts)
+    print(f"embedding: {1000 / (time.perf_counter() - start):,.0f} texts/s")
+
+    print(f"{'vectors':>9} {'brute p50':>10} {'brute p95':>10} {'ivf p50':>9} {'ivf p95':>9} {'recall':>7} {'build s':>8}")
+    for count in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LocalVectorStore(os.path.join(tmp, "bench"), ivf_threshold=count + 1, nprobe=args.nprobe)
+            # Generated block by block so 1M vectors never need a second full copy in memory
+            for begin in range(0, count, 50_000):
+                block = clustered_vectors(min(50_000, count - begin), topics, rng)
+                store.upsert_batch(
+                    [f"v{i}" for i in range(begin, begin + len(block))],
+                    block,
+                    [{} for _ in range(len(block))]
+                )
+            queries = clustered_vectors(args.queries, topics, rng)
+
+            brute = time_queries(store, queries, args.k)
+            exact = [{hit['id'] for hit in store.search(q, k=args.k)} for q in queries]
+
+            build_start = time.perf_counter()
+            store.build_ivf()
+            build_seconds = time.perf_counter() - build_start
+            ivf = time_queries(store, queries, args.k)
+            ivf_recall = recall(store, queries, exact, args.k)
+            store.close()
+
+        print(f"{count:>9} {brute[0]:>10.2f} {brute[1]:>10.2f} {ivf[0]:>9.2f} {ivf[1]:>9.2f} "
+              f"{ivf_recall:>7.2f} {build_seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Classroom benchmark: one /story/batch call vs a /story/generate call per child
+Runs the real app against the provider fakes. Children pick from a few
+themes, two age groups and two voices, so the batch can share story calls,
+narrations and illustrations between them. Each provider serves a limited
+number of calls at once (--limits, like an account's throughput quota); past
+that, calls queue at the provider. Reports wall time, time to the first and
+median child's page, provider calls and time spent queued at the providers.
+The app is called over raw ASGI so each batch line is timed as it is sent.
+
+Without a provider limit a class of separate calls all run at once, so the
+batch's sharing only saves calls, while its BATCH_*_CONCURRENCY caps and its
+story-then-illustration order (separate pages start drawing from the first
+200 streamed characters) make it slower. Near the limit, the calls it saves
+are what keeps the class from queueing.
+
+Run from the project root:
+    python benchmarks/classroom.py --children 30 --themes 3 --scale 0.1
+    python benchmarks/classroom.py --limits ""   # providers without a cap
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import THEMES, configure_environment, percentile, _ms
+from first_audio import call
+
+AGES = (5, 7)
+VOICES = ("Ivy", "Kevin")
+
+
+def classroom(args):
+    rng = random.Random(args.seed)
+    themes = THEMES[:args.themes]
+    return [
+        {'theme': rng.choice(themes), 'age': rng.choice(AGES), 'voice': rng.choice(VOICES), 'child': f"child-{i}"}
+        for i in range(args.children)
+    ]
+
+
+async def separate(app, entries):
+    """A /story/generate call per child, all at once, like a class of tablets"""
+    start = time.perf_counter()
+    pages = []
+    errors = 0
+
+    async def one(entry):
+        nonlocal errors
+        status, chunks = await call(app, "/story/generate", {k: entry[k] for k in ("theme", "age", "voice")})
+        if status >= 400:
+            errors += 1
+        elif chunks:
+            pages.append(chunks[-1][0])
+
+    await asyncio.gather(*(one(entry) for entry in entries))
+    return time.perf_counter() - start, pages, errors
+
+
+async def batched(app, entries):
+    """One /story/batch call, timing each child's line as it is sent"""
+    start = time.perf_counter()
+    status, chunks = await call(app, "/story/batch", method="POST", json_body={'entries': entries})
+    if status >= 400:
+        raise RuntimeError(f"/story/batch returned {status}")
+    pages, summary, buffer = [], {}, b""
+    for at, body in chunks:
+        buffer += body
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if result.get('done'):
+                summary = result
+            elif result['status'] == "ok":
+                pages.append(at)
+    errors = sum(count for status, count in summary.get('statuses', {}).items() if status != "ok")
+    return time.perf_counter() - start, pages, errors
+
+
+def parse_limits(spec: str):
+    """"llm=8,titan=4" -> {'llm': 8, 'titan': 4}"""
+    limits = {}
+    for part in spec.split(","):
+        kind, _, value = part.strip().partition("=")
+        if kind and value:
+            limits[kind.strip()] = int(value)
+    return limits
+
+
+async def run(args):
+    import main
+    from config import Config
+    from fakes import FakeProfile, install_fakes
+
+    entries = classroom(args)
+    results = {}
+    for name, mode in (("separate", separate), ("batch", batched)):
+        profile = FakeProfile(scale=args.scale, seed=args.seed, limits=parse_limits(args.limits))
+        install_fakes(profile, regions={"us-east-1", "us-east-2", Config.AWS_REGION})
+        elapsed, pages, errors = await mode(main.app, entries)
+        results[name] = {
+            'elapsed_s': round(elapsed, 3),
+            'first_page_ms': _ms(min(pages) if pages else None),
+            'median_page_ms': _ms(percentile(pages, 50)),
+            'errors': errors,
+            'provider_calls': dict(profile.calls),
+            'provider_queued_s': {kind: round(seconds, 2) for kind, seconds in profile.queued.items()}
+        }
+    return {
+        'children': len(entries),
+        'distinct_prompts': len({(e['theme'], e['age']) for e in entries}),
+        'limits': args.limits,
+        'modes': results
+    }
+
+
+def print_report(result):
+    print(f"\n🏫 {result['children']} children, {result['distinct_prompts']} distinct prompts, "
+          f"provider limits: {result['limits'] or 'none'}")
+    print(f"{'mode':<10}{'wall s':>9}{'first ms':>10}{'median ms':>11}{'errors':>8}"
+          f"{'llm':>6}{'polly':>7}{'titan':>7}{'queued s':>10}")
+    for name, mode in result['modes'].items():
+        calls = mode['provider_calls']
+        queued = sum(mode['provider_queued_s'].values())
+        print(
+            f"{name:<10}{mode['elapsed_s']:>9}{str(mode['first_page_ms']):>10}{str(mode['median_page_ms']):>11}"
+            f"{mode['errors']:>8}{calls.get('llm', 0):>6}{calls.get('polly', 0):>7}{calls.get('titan', 0):>7}"
+            f"{queued:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a classroom batch with per-child story calls")
+    parser.add_argument("--children", type=int, default=30)
+    parser.add_argument("--themes", type=int, default=3, help=f"Distinct themes the class picks from (max {len(THEMES)})")
+    parser.add_argument("--scale", type=float, default=0.1, help="Multiply provider latencies (1.0 = production-like)")
+    parser.add_argument("--limits", default="llm=8,polly=8,titan=4",
+                        help="Concurrent calls each provider serves, e.g. llm=8,titan=4 (\"\" for no cap)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="Write results as JSON")
+    args = parser.parse_args()
+    args.trace_rate, args.google = 0.0, False
+
+    os.chdir(ROOT)
+    work_dir = os.path.join(ROOT, "data", f"classroom-{os.getpid()}")
+    configure_environment(work_dir, args)
+    # Measure live generation, not baked trees
+    os.environ['STORY_TREES_ENABLED'] = "false"
+    os.environ['BATCH_MAX_ENTRIES'] = str(max(args.children, 40))
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(result)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Results saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
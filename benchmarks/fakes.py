@@ -0,0 +1,321 @@
+"""
+In-process stand-ins for Bedrock, Polly, Titan, AWS Location, Google Places and Pinecone
+Used by the load test to run the real app offline. Each fake sleeps for a
+log-normally distributed latency and can be told to throttle or fail a
+fraction of calls. With `limits`, a provider serves at most that many calls
+at once and later ones wait for a free slot, like an account's throughput
+quota.
+
+    profile = FakeProfile(scale=0.1, throttle_rate=0.02, limits={'titan': 4})
+    install_fakes(profile)   # before the first request
+"""
+
+import io
+import json
+import time
+import base64
+import random
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+from botocore.exceptions import ClientError
+
+import clients
+from services import google_location_service
+
+# (median seconds, log-normal sigma) per provider, roughly what production sees
+DEFAULT_LATENCY = {
+    'llm': (2.5, 0.35),
+    'polly': (0.6, 0.3),
+    'titan': (3.0, 0.3),
+    'location': (0.25, 0.4),
+    'google': (0.3, 0.4),
+    'pinecone': (0.1, 0.3),
+    'probe': (0.05, 0.3)
+}
+
+_STORY_SENTENCES = [
+    "The little fox found a glowing map under the old oak tree.",
+    "Together they crossed the bridge where the river sang softly.",
+    "A friendly baker waved from the door of the corner bakery.",
+    "Clouds shaped like dragons drifted over the sleepy town.",
+    "Everyone cheered when the lost kite floated back home."
+]
+_PLACES = ["Sunny Side Cafe", "Maple Street Library", "Riverside Park", "Corner Bakery", "Little Owl Bookshop"]
+_PNG = base64.b64encode(b"\x89PNG\r\n\x1a\n" + bytes(2048)).decode()
+
+
+@dataclass
+class FakeProfile:
+    """Latency and fault settings shared by all fakes"""
+    latency: Dict[str, Tuple[float, float]] = field(default_factory=lambda: dict(DEFAULT_LATENCY))
+    scale: float = 1.0  # multiply every latency, e.g. 0.05 for quick runs
+    throttle_rate: float = 0.0
+    failure_rate: float = 0.0
+    seed: int = 0
+    limits: Dict[str, int] = field(default_factory=dict)  # concurrent calls each provider serves
+    calls: Dict[str, int] = field(default_factory=dict)
+    queued: Dict[str, float] = field(default_factory=dict)  # seconds calls waited for a slot
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+        self._slots = {kind: threading.Semaphore(limit) for kind, limit in self.limits.items()}
+
+    def call(self, kind: str, operation: str):
+        """Sleep like the provider would, then maybe throttle or fail"""
+        with self.slot(kind):
+            delay, roll = self.sample(kind)
+            time.sleep(delay)
+        self.fail(roll, operation)
+
+    @contextmanager
+    def slot(self, kind: str):
+        """Hold one of the provider's concurrent call slots, if it has a limit"""
+        self.acquire(kind)
+        try:
+            yield
+        finally:
+            self.release(kind)
+
+    def acquire(self, kind: str):
+        semaphore = self._slots.get(kind)
+        if semaphore is None:
+            return
+        start = time.perf_counter()
+        semaphore.acquire()
+        with self._lock:
+            self.queued[kind] = self.queued.get(kind, 0.0) + time.perf_counter() - start
+
+    def release(self, kind: str):
+        semaphore = self._slots.get(kind)
+        if semaphore is not None:
+            semaphore.release()
+
+    def sample(self, kind: str) -> Tuple[float, float]:
+        """Count a call and draw its latency and fault roll"""
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            median, sigma = self.latency[kind]
+            delay = median * self.scale * self._rng.lognormvariate(0, sigma)
+            roll = self._rng.random()
+        return delay, roll
+
+    def fail(self, roll: float, operation: str):
+        if roll < self.throttle_rate:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, operation)
+        if roll < self.throttle_rate + self.failure_rate:
+            raise ClientError({'Error': {'Code': 'ServiceUnavailableException', 'Message': 'Injected failure'}}, operation)
+
+
+class _Body:
+    def __init__(self, payload: Dict):
+        self._data = json.dumps(payload).encode()
+
+    def read(self) -> bytes:
+        return self._data
+
+
+class FakeBedrockRuntime:
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+
+    def invoke_model(self, modelId: str, body: str, **kwargs):
+        if "titan-image" in modelId:
+            self.profile.call('titan', 'InvokeModel')
+            return {'body': _Body({'images': [_PNG]})}
+
+        self.profile.call('llm', 'InvokeModel')
+        text, tokens = _story(body)
+        return {'body': _Body({'content': [{'type': 'text', 'text': text}], 'usage': tokens})}
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str, **kwargs):
+        # The slot is held until the stream has been read or closed
+        self.profile.acquire('llm')
+        delay, roll = self.profile.sample('llm')
+        try:
+            # Throttling and failures come back before the stream starts
+            self.profile.fail(roll, 'InvokeModelWithResponseStream')
+        except ClientError:
+            self.profile.release('llm')
+            raise
+        text, tokens = _story(body)
+        return {'body': _EventStream(text, tokens, delay, lambda: self.profile.release('llm'))}
+
+
+def _story(body: str):
+    """A three-paragraph page in the format the prompt asks for, and its token usage"""
+    request = json.loads(body)
+    rng = random.Random(len(body))
+    story = "\n\n".join(" ".join(rng.choice(_STORY_SENTENCES) for _ in range(2)) for _ in range(3))
+    text = (
+        f"STORY: {story}\n\nLOCATION: {rng.choice(_PLACES)}\n\n"
+        "CHOICES:\n1. Follow the map\n2. Ask the baker for help\n3. Fly the kite"
+    )
+    prompt_tokens = len(request['messages'][0]['content']) // 4
+    return text, {'input_tokens': prompt_tokens, 'output_tokens': len(text) // 4}
+
+
+class _EventStream:
+    """Bedrock response stream: the first token after a tenth of the latency, the rest spread evenly"""
+    CHUNK_CHARS = 16
+
+    def __init__(self, text: str, tokens: Dict, delay: float, on_done=None):
+        self.text = text
+        self.tokens = tokens
+        self.delay = delay
+        self.closed = False
+        self._on_done = on_done
+        self._done_lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            pieces = [self.text[i:i + self.CHUNK_CHARS] for i in range(0, len(self.text), self.CHUNK_CHARS)]
+            time.sleep(self.delay * 0.1)
+            yield _event({'type': 'message_start', 'message': {'usage': {'input_tokens': self.tokens['input_tokens'], 'output_tokens': 1}}})
+            for piece in pieces:
+                if self.closed:
+                    return
+                time.sleep(self.delay * 0.9 / len(pieces))
+                yield _event({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': piece}})
+            yield _event({'type': 'message_delta', 'usage': {'output_tokens': self.tokens['output_tokens']}})
+            yield _event({'type': 'message_stop'})
+        finally:
+            self._done()
+
+    def close(self):
+        self.closed = True
+        self._done()
+
+    def _done(self):
+        # Reader and closer may both get here; release the slot once
+        with self._done_lock:
+            on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done()
+
+
+def _event(payload: Dict) -> Dict:
+    return {'chunk': {'bytes': json.dumps(payload).encode()}}
+
+
+class FakeBedrock:
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+
+    def list_foundation_models(self, **kwargs):
+        self.profile.call('probe', 'ListFoundationModels')
+        return {'modelSummaries': []}
+
+
+class FakePolly:
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+
+    def synthesize_speech(self, Text: str, **kwargs):
+        self.profile.call('polly', 'SynthesizeSpeech')
+        # Roughly 1 KB of MP3 per 10 characters of text
+        return {'AudioStream': io.BytesIO(bytes(len(Text) * 100))}
+
+
+class FakeLocation:
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+
+    def _results(self, longitude: float, latitude: float, count: int):
+        rng = random.Random(int(latitude * 1000) ^ int(longitude * 1000))
+        results = []
+        for i in range(count):
+            lat = latitude + rng.uniform(-0.02, 0.02)
+            lon = longitude + rng.uniform(-0.02, 0.02)
+            results.append({
+                'Place': {
+                    'Label': f"{_PLACES[i % len(_PLACES)]} {i // len(_PLACES) or ''}".strip(),
+                    'Address': f"{100 + i} Main St",
+                    'Categories': ['PointOfInterestType'],
+                    'Geometry': {'Point': [lon, lat]}
+                },
+                'Distance': rng.uniform(50, 3000)
+            })
+        return results
+
+    def search_place_index_for_position(self, Position, MaxResults=10, **kwargs):
+        self.profile.call('location', 'SearchPlaceIndexForPosition')
+        return {'Results': self._results(Position[0], Position[1], MaxResults)}
+
+    def search_place_index_for_text(self, Text, BiasPosition=None, MaxResults=10, **kwargs):
+        self.profile.call('location', 'SearchPlaceIndexForText')
+        longitude, latitude = BiasPosition or (-122.33, 47.61)
+        return {'Results': self._results(longitude, latitude, MaxResults)}
+
+    def list_place_indexes(self, **kwargs):
+        self.profile.call('probe', 'ListPlaceIndexes')
+        return {'Entries': [{'IndexName': 'HackathonPlaceIndex'}]}
+
+
+class _GoogleResponse:
+    status_code = 200
+
+    def __init__(self, payload: Dict):
+        self._payload = payload
+
+    def json(self) -> Dict:
+        return self._payload
+
+
+def _fake_google_get(profile: FakeProfile):
+    def http_get(url: str, params: Dict):
+        profile.call('google', 'PlacesRequest')
+        if url.endswith("/details/json"):
+            return _GoogleResponse({'status': 'OK', 'result': {'formatted_phone_number': '555-0100'}})
+        rng = random.Random(hash(json.dumps(params, sort_keys=True, default=str)))
+        lat, lon = 47.61, -122.33
+        if 'location' in params:
+            lat, lon = (float(v) for v in str(params['location']).split(","))
+        results = [{
+            'name': name,
+            'vicinity': f"{200 + i} Pine St",
+            'formatted_address': f"{200 + i} Pine St",
+            'types': ['establishment'],
+            'geometry': {'location': {'lat': lat + rng.uniform(-0.02, 0.02), 'lng': lon + rng.uniform(-0.02, 0.02)}},
+            'place_id': f"fake-{i}"
+        } for i, name in enumerate(_PLACES)]
+        return _GoogleResponse({'status': 'OK', 'results': results})
+    return http_get
+
+
+class FakePineconeIndex:
+    def __init__(self, profile: FakeProfile):
+        self.profile = profile
+        self.vectors = {}
+
+    def upsert(self, vectors):
+        self.profile.call('pinecone', 'Upsert')
+        for record in vectors:
+            self.vectors[record['id']] = record
+
+
+class FakePinecone:
+    def __init__(self, profile: FakeProfile):
+        self.index = FakePineconeIndex(profile)
+
+    def list_indexes(self):
+        class _Index:
+            name = "bridgetales-users"
+        return [_Index()]
+
+    def Index(self, name: str):
+        return self.index
+
+
+def install_fakes(profile: FakeProfile, regions=("us-east-1", "us-east-2")):
+    """Put fakes in the client cache (see clients.py) and behind the Google Places HTTP call"""
+    for region in regions:
+        clients._clients[("aws", "bedrock-runtime", region)] = FakeBedrockRuntime(profile)
+        clients._clients[("aws", "bedrock", region)] = FakeBedrock(profile)
+        clients._clients[("aws", "polly", region)] = FakePolly(profile)
+        clients._clients[("aws", "location", region)] = FakeLocation(profile)
+    clients._clients[("pinecone",)] = FakePinecone(profile)
+    google_location_service._http_get = _fake_google_get(profile)
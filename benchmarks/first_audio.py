@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Time to first audio: whole-page narration vs narration pipelined per paragraph
+Runs the real app against the provider fakes and requests the same openings
+from /story/generate (narration starts once the whole story is written and
+synthesized) and /story/generate/stream (each paragraph is synthesized as
+soon as the model finishes it). The app is called over raw ASGI so every
+streamed line is timestamped as it is sent.
+
+Run from the project root:
+    python benchmarks/first_audio.py --pages 20 --concurrency 4 --scale 0.5
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import THEMES, configure_environment, percentile, _ms
+
+
+async def call(app, path: str, params: dict = None, method: str = "GET", json_body=None):
+    """
+    Request path over raw ASGI; returns (status, [(seconds since the request, body chunk)])
+
+    httpx's in-process transport hands over a streamed body only once it is
+    complete, so streams are timed here as the app sends them.
+    """
+    body = json.dumps(json_body).encode() if json_body is not None else b""
+    headers = [(b"host", b"bench")]
+    if body:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        'type': "http", 'http_version': "1.1", 'method': method, 'scheme': "http",
+        'path': path, 'raw_path': path.encode(), 'query_string': urlencode(params or {}).encode(),
+        'headers': headers, 'client': ("127.0.0.1", 1), 'server': ("bench", 80)
+    }
+    start = time.perf_counter()
+    status, chunks = [0], []
+    finished = asyncio.Event()
+    request = [{'type': "http.request", 'body': body, 'more_body': False}]
+
+    async def receive():
+        if request:
+            return request.pop()
+        await finished.wait()
+        return {'type': "http.disconnect"}
+
+    async def send(message):
+        if message['type'] == "http.response.start":
+            status[0] = message['status']
+        elif message['type'] == "http.response.body":
+            chunks.append((time.perf_counter() - start, message.get('body', b"")))
+            if not message.get('more_body'):
+                finished.set()
+
+    await app(scope, receive, send)
+    return status[0], chunks
+
+
+async def whole(app, params):
+    status, chunks = await call(app, "/story/generate", params)
+    page = json.loads(b"".join(body for _, body in chunks)) if status == 200 else {}
+    elapsed = chunks[-1][0] if chunks else None
+    return (elapsed if page.get('voice_file') else None), elapsed
+
+
+async def pipelined(app, params):
+    status, chunks = await call(app, "/story/generate/stream", params)
+    first_audio, buffer = None, b""
+    for at, body in chunks:
+        buffer += body
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            event = json.loads(line)
+            if first_audio is None and event['type'] == "audio" and event['voice_file']:
+                first_audio = at
+    return first_audio, chunks[-1][0] if chunks else None
+
+
+async def run(args):
+    import main
+    from config import Config
+    from fakes import FakeProfile, install_fakes
+
+    install_fakes(FakeProfile(scale=args.scale, seed=args.seed), regions={"us-east-1", "us-east-2", Config.AWS_REGION})
+    app = main.app
+    results = {}
+    for name, mode in (("whole", whole), ("pipelined", pipelined)):
+        first, total = [], []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i):
+            async with semaphore:
+                audio, elapsed = await mode(app, {'theme': THEMES[i % len(THEMES)], 'age': 7, 'voice': "Ivy"})
+            if audio is not None:
+                first.append(audio)
+            if elapsed is not None:
+                total.append(elapsed)
+
+        await asyncio.gather(*(one(i) for i in range(args.pages)))
+        results[name] = {
+            'pages': args.pages,
+            'narrated': len(first),
+            'first_audio_p50_ms': _ms(percentile(first, 50)),
+            'first_audio_p95_ms': _ms(percentile(first, 95)),
+            'page_p50_ms': _ms(percentile(total, 50)),
+            'page_p95_ms': _ms(percentile(total, 95))
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare time to first audio with and without pipelined narration")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--scale", type=float, default=0.5, help="Multiply provider latencies (1.0 = production-like)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    args.trace_rate, args.google = 0.0, False
+
+    os.chdir(ROOT)
+    work_dir = os.path.join(ROOT, "data", f"first-audio-{os.getpid()}")
+    configure_environment(work_dir, args)
+    # Measure live generation, not baked trees or the load ladder
+    os.environ['STORY_TREES_ENABLED'] = "false"
+    os.environ['DEGRADATION_ENABLED'] = "false"
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n{'mode':<11}{'narrated':>9}{'first audio p50':>17}{'p95':>9}{'page p50':>10}{'p95':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<11}{r['narrated']:>9}{str(r['first_audio_p50_ms']):>17}{str(r['first_audio_p95_ms']):>9}"
+            f"{str(r['page_p50_ms']):>10}{str(r['page_p95_ms']):>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the real app against in-process provider fakes
+Each virtual reader runs full sessions: generate -> continue x N -> ending
+-> save-book. Reports throughput, p50/p95/p99 per route and event-loop lag,
+and can gate on a saved baseline.
+
+Run from the project root:
+    python benchmarks/loadtest.py --concurrency 20 --sessions 100 --scale 0.05
+    python benchmarks/loadtest.py ... --save baseline.json
+    python benchmarks/loadtest.py ... --baseline baseline.json --max-regression 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ROUTES = ("generate", "continue", "ending", "save-book")
+THEMES = ["kindness", "friendship", "dragons", "space", "ocean", "forest", "music", "courage"]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def configure_environment(work_dir: str, args):
+    """Point every store at a scratch directory; must run before the app is imported"""
+    os.environ.update({
+        'BOOK_STORE_PATH': os.path.join(work_dir, "books.seg"),
+        'VECTOR_STORE_PATH': os.path.join(work_dir, "vectors"),
+        'PINECONE_WRITE_LOG': os.path.join(work_dir, "pinecone_writes.log"),
+        'MEDIA_DIR': os.path.relpath(os.path.join(work_dir, "media"), ROOT),
+        'TRACE_PATH': os.path.join(work_dir, "traces", "spans"),
+        'TRACE_SAMPLE_RATE': str(args.trace_rate),
+        'STATE_BACKEND': "memory",
+        'STARTUP_WARM_TIMEOUT': "0",
+        'LOCATION_MULTI_PROVIDER': "true" if args.google else "false",
+        # pinecone_service needs a key before it asks the (fake) client for the index
+        'PINECONE_API_KEY': "fake-key"
+    })
+    if args.google:
+        os.environ['GOOGLE_PLACES_API_KEY'] = "fake-key"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+        self.shed = {route: 0 for route in ROUTES}
+        self.loop_lag = []
+        self.quality = {}
+
+    async def timed(self, route: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            ok = response.status_code < 400 and not (
+                route == "save-book" and response.json().get('status') != 'success'
+            )
+        except Exception:
+            response, ok = None, False
+        self.latencies[route].append(time.perf_counter() - start)
+        if not ok:
+            self.errors[route] += 1
+            if response is not None and response.status_code == 503:
+                self.shed[route] += 1
+            return None
+        body = response.json()
+        if route != "save-book":
+            quality = body.get('quality', "full")
+            self.quality[quality] = self.quality.get(quality, 0) + 1
+        return body
+
+
+async def reading_session(client, recorder: Recorder, rng: random.Random, args, reader_id: str = ""):
+    """One reader: a new story, a few choices, a happy ending, then saving the book"""
+    # Each reader is its own client for admission-control fairness
+    headers = {'X-Client-ID': reader_id} if reader_id else {}
+    theme = rng.choice(THEMES)
+    profile = {
+        'voice': rng.choice(["Ivy", "Joanna", "Matthew"]),
+        'age': rng.randint(4, 12),
+        'latitude': 47.61 + rng.uniform(-0.05, 0.05),
+        'longitude': -122.33 + rng.uniform(-0.05, 0.05)
+    }
+    page = await recorder.timed("generate", client.get("/story/generate", params={'theme': theme, **profile}, headers=headers))
+    if page is None:
+        return
+    pages = [page]
+    context = page['story']
+
+    for step in range(args.pages + 1):
+        if args.think:
+            await asyncio.sleep(rng.uniform(0, 2 * args.think))
+        ending = step == args.pages
+        choice = rng.choice(page['choices']) if page.get('choices') else "Keep going"
+        route = "ending" if ending else "continue"
+        page = await recorder.timed(route, client.post("/story/continue", json={
+            'theme': theme, 'choice': choice, 'story_context': context, 'is_ending': ending,
+            'page_index': len(pages) + 1, **profile
+        }, headers=headers))
+        if page is None:
+            return
+        pages.append(page)
+        context = f"{context}\n\nThe reader chose: {choice}\n\n{page['story']}"
+
+    book = {
+        'id': f"{int(time.time() * 1000)}-{rng.randrange(1 << 30)}",
+        'userName': f"reader{rng.randrange(500)}",
+        'theme': theme,
+        'pages': [{'story': p['story'], 'image': (p.get('images') or [''])[0], 'usage': p.get('usage')} for p in pages],
+        'completedAt': time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+    await recorder.timed("save-book", client.post("/api/save-book", json=book))
+
+
+async def monitor_loop_lag(recorder: Recorder, stop: asyncio.Event, interval: float = 0.01):
+    """How late the event loop wakes a 10 ms sleeper; high values mean blocking calls on the loop"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        recorder.loop_lag.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def run(args):
+    import httpx
+    import main
+    from config import Config
+    from fakes import FakeProfile, install_fakes
+
+    profile = FakeProfile(
+        scale=args.scale, throttle_rate=args.throttle_rate, failure_rate=args.failure_rate, seed=args.seed
+    )
+    install_fakes(profile, regions={"us-east-1", "us-east-2", Config.AWS_REGION})
+
+    recorder = Recorder()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(recorder, stop))
+    remaining = [args.sessions]
+
+    async def reader(index: int):
+        rng = random.Random(args.seed * 1000 + index)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            await reading_session(client, recorder, rng, args, f"reader-{index}")
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(reader(i) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+
+    # Let queued vector writes flush before the scratch directory goes away
+    import pinecone_service
+    if pinecone_service._buffer is not None:
+        pinecone_service._buffer.close()
+
+    requests = sum(len(values) for values in recorder.latencies.values())
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ("save", "baseline")},
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 2),
+        'sessions_per_s': round(args.sessions / elapsed, 3),
+        'routes': {
+            route: {
+                'count': len(values),
+                'errors': recorder.errors[route],
+                'shed': recorder.shed[route],
+                'p50_ms': _ms(percentile(values, 50)),
+                'p95_ms': _ms(percentile(values, 95)),
+                'p99_ms': _ms(percentile(values, 99))
+            }
+            for route, values in recorder.latencies.items()
+        },
+        'loop_lag_ms': {
+            'p50': _ms(percentile(recorder.loop_lag, 50)),
+            'p99': _ms(percentile(recorder.loop_lag, 99)),
+            'max': _ms(max(recorder.loop_lag, default=None))
+        },
+        'page_quality': recorder.quality,
+        'provider_calls': dict(profile.calls)
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_report(result):
+    print(f"\n{'route':<10} {'count':>6} {'errors':>7} {'shed':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, stats in result['routes'].items():
+        print(f"{route:<10} {stats['count']:>6} {stats['errors']:>7} {stats['shed']:>5} "
+              f"{_fmt(stats['p50_ms'])} {_fmt(stats['p95_ms'])} {_fmt(stats['p99_ms'])}")
+    lag = result['loop_lag_ms']
+    print(f"\nthroughput: {result['throughput_rps']} req/s, {result['sessions_per_s']} sessions/s "
+          f"over {result['elapsed_s']}s")
+    print(f"event-loop lag: p50 {lag['p50']} ms, p99 {lag['p99']} ms, max {lag['max']} ms")
+    print(f"page quality: {result['page_quality']}")
+    print(f"provider calls: {result['provider_calls']}")
+
+
+def _fmt(value):
+    return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+
+
+def check_gate(result, args) -> bool:
+    """Compare against limits and the baseline; returns False on a regression"""
+    passed = True
+    for route, stats in result['routes'].items():
+        if stats['count'] and stats['errors'] / stats['count'] > args.max_error_rate:
+            print(f"❌ {route}: error rate {stats['errors'] / stats['count']:.1%} > {args.max_error_rate:.1%}")
+            passed = False
+    if args.max_loop_lag_ms is not None and (result['loop_lag_ms']['p99'] or 0) > args.max_loop_lag_ms:
+        print(f"❌ event-loop lag p99 {result['loop_lag_ms']['p99']} ms > {args.max_loop_lag_ms} ms")
+        passed = False
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        for route, stats in result['routes'].items():
+            before = baseline['routes'].get(route, {}).get('p95_ms')
+            if before and stats['p95_ms'] and stats['p95_ms'] > before * (1 + args.max_regression):
+                print(f"❌ {route}: p95 {stats['p95_ms']} ms vs baseline {before} ms "
+                      f"(> {args.max_regression:.0%} slower)")
+                passed = False
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test BridgeTales against local provider fakes")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent readers")
+    parser.add_argument("--sessions", type=int, default=50, help="Reading sessions in total")
+    parser.add_argument("--pages", type=int, default=3, help="Choices per session before the ending")
+    parser.add_argument("--think", type=float, default=0.0, help="Mean reader think time between pages (s)")
+    parser.add_argument("--scale", type=float, default=0.1, help="Multiply provider latencies (1.0 = production-like)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--google", action="store_true", help="Also race the Google Places fake")
+    parser.add_argument("--trace-rate", type=float, default=0.0, help="TRACE_SAMPLE_RATE during the run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="Write results as JSON (e.g. a new baseline)")
+    parser.add_argument("--baseline", help="Baseline JSON to compare p95 against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 slowdown vs baseline")
+    parser.add_argument("--max-error-rate", type=float, default=0.05)
+    parser.add_argument("--max-loop-lag-ms", type=float, help="Fail when event-loop lag p99 exceeds this")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch data directory")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    work_dir = os.path.join(ROOT, "data", f"loadtest-{os.getpid()}")
+    configure_environment(work_dir, args)
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(result)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Results saved to {args.save}")
+    if not check_gate(result, args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded traffic pattern against the app, offline
+Record first with the real providers (CASSETTE_MODE=record, see cassette.py),
+then re-issue the captured API requests at their original arrival times
+while provider calls are answered from the cassette with their recorded
+latencies. Reports p50/p95/p99 per route; compare runs before and after a
+change with --save / --baseline, as with loadtest.py.
+
+Run from the project root:
+    python benchmarks/replay.py data/cassettes/session
+    python benchmarks/replay.py data/cassettes/session --speed 4 --latency-scale 0.25
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import configure_environment, percentile, _ms, _fmt
+
+
+def route_of(path: str, body) -> str:
+    # Pipelined pages (/story/.../stream) are reported apart from whole ones
+    suffix = "-stream" if path.endswith("/stream") else ""
+    path = path[:-len("/stream")] if suffix else path
+    if path == "/story/continue":
+        try:
+            return ("ending" if json.loads(body).get('is_ending') else "continue") + suffix
+        except (TypeError, ValueError, AttributeError):
+            return "continue" + suffix
+    return (path.rsplit("/", 1)[-1] or path) + suffix
+
+
+async def run(args):
+    import httpx
+    import main
+    import cassette
+    import clients
+    from fakes import FakeProfile, FakePinecone
+
+    # Pinecone isn't part of the cassette; keep its writes local and instant
+    clients._clients[("pinecone",)] = FakePinecone(FakeProfile(scale=0))
+    recording = cassette.get_cassette()
+    leaked = set()
+    for entry in cassette.read_entries(f"{args.cassette}.jsonl.gz"):
+        leaked |= cassette.secret_fields_in(entry.get('request'))
+    if leaked:
+        print(f"⚠️ {args.cassette}.jsonl.gz contains {', '.join(sorted(leaked))} fields (recorded before "
+              f"scrubbing covered nested params); re-record it before sharing")
+    requests = list(cassette.read_entries(f"{args.cassette}.requests.jsonl.gz"))[:args.limit or None]
+    if not requests:
+        sys.exit(f"No recorded requests in {args.cassette}.requests.jsonl.gz")
+    first = requests[0]['t']
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    async def issue(client, entry, start):
+        delay = (entry['t'] - first) / args.speed - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        body = recording._decode(entry['body']) if entry.get('body') else None
+        route = route_of(entry['path'], body)
+        url = entry['path'] + (f"?{entry['query']}" if entry['query'] else "")
+        sent = time.perf_counter()
+        try:
+            response = await client.request(entry['method'], url, content=body, headers=entry.get('headers') or {})
+            if response.status_code >= 400:
+                errors[route] += 1
+        except Exception:
+            errors[route] += 1
+        latencies[route].append(time.perf_counter() - sent)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(issue(client, entry, start) for entry in requests))
+        elapsed = time.perf_counter() - start
+
+    import pinecone_service
+    if pinecone_service._buffer is not None:
+        pinecone_service._buffer.close()
+
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ("save", "baseline")},
+        'elapsed_s': round(elapsed, 3),
+        'requests': len(requests),
+        'routes': {
+            route: {
+                'count': len(values),
+                'errors': errors[route],
+                'p50_ms': _ms(percentile(values, 50)),
+                'p95_ms': _ms(percentile(values, 95)),
+                'p99_ms': _ms(percentile(values, 99))
+            }
+            for route, values in sorted(latencies.items())
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded BridgeTales traffic from a cassette")
+    parser.add_argument("cassette", help="Cassette path as recorded (CASSETTE_PATH, without extensions)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival-time speed-up (2 = twice as fast)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply recorded provider latencies")
+    parser.add_argument("--strict", action="store_true", help="Fail provider calls with no exact recorded match")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N requests")
+    parser.add_argument("--google", action="store_true", help="Recording included Google Places")
+    parser.add_argument("--save", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Earlier --save output to compare p95 against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch data directory")
+    args = parser.parse_args()
+    args.trace_rate = 0.0
+
+    os.chdir(ROOT)
+    work_dir = os.path.join(ROOT, "data", f"replay-{os.getpid()}")
+    configure_environment(work_dir, args)
+    os.environ.update({
+        'CASSETTE_MODE': "replay",
+        'CASSETTE_PATH': os.path.abspath(args.cassette),
+        'CASSETTE_LATENCY_SCALE': str(args.latency_scale),
+        'CASSETTE_STRICT': "true" if args.strict else "false",
+        'WEB_CONCURRENCY': "1",
+        # Fallback providers must not be reached during a replay
+        'OPENAI_API_KEY': ""
+    })
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n{'route':<14} {'count':>6} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, stats in result['routes'].items():
+        print(f"{route:<14} {stats['count']:>6} {stats['errors']:>7} "
+              f"{_fmt(stats['p50_ms'])} {_fmt(stats['p95_ms'])} {_fmt(stats['p99_ms'])}")
+    print(f"\n{result['requests']} requests replayed in {result['elapsed_s']}s")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Results saved to {args.save}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressed = False
+        for route, stats in result['routes'].items():
+            before = baseline['routes'].get(route, {}).get('p95_ms')
+            if before and stats['p95_ms'] and stats['p95_ms'] > before * (1 + args.max_regression):
+                print(f"❌ {route}: p95 {stats['p95_ms']} ms vs baseline {before} ms")
+                regressed = True
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Cold-start report for the API server
+Breaks import time down per package (python -X importtime) and times each
+provider client initializer. Exits non-zero when importing the app takes
+longer than the budget, so it can gate CI.
+
+Run from the project root: python benchmarks/startup_report.py --budget 1.5
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_PARTY = ("main", "config", "clients", "services", "shared_state", "media_store",
+               "book_store", "vector_store", "embedding_service", "voice_service",
+               "image_service", "pinecone_service")
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# Imports the app, then builds every request-path client the way the startup hook does
+_INIT_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+import clients
+clients._warm(main.story_generator.aws_region)
+print(json.dumps({'import': imported, 'clients': clients.init_timings()}))
+"""
+
+
+def run_python(args):
+    env = dict(os.environ, STARTUP_WARM_TIMEOUT="0")
+    return subprocess.run([sys.executable] + args, cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def import_breakdown():
+    """Self time per top-level package and cumulative time per first-party module, in ms"""
+    result = run_python(["-X", "importtime", "-c", "import main"])
+    if result.returncode != 0:
+        sys.exit(f"❌ Importing main failed:\n{result.stderr[-2000:]}")
+
+    packages, first_party = {}, {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, name = int(match.group(1)), int(match.group(2)), match.group(4)
+        top = name.split(".")[0]
+        packages[top] = packages.get(top, 0) + self_us / 1000
+        if top in FIRST_PARTY:
+            first_party[name] = cumulative_us / 1000
+    return packages, first_party
+
+
+def cold_start(repeat):
+    """Fastest of `repeat` fresh-process imports, plus client initializer timings"""
+    runs = []
+    for _ in range(repeat):
+        result = run_python(["-c", _INIT_SNIPPET])
+        if result.returncode != 0:
+            sys.exit(f"❌ Cold start failed:\n{result.stderr[-2000:]}")
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return min(runs, key=lambda run: run['import'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report and check API cold-start time")
+    parser.add_argument("--budget", type=float, default=1.5, help="Max seconds to import the app")
+    parser.add_argument("--repeat", type=int, default=3, help="Cold starts to take the fastest of")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list")
+    args = parser.parse_args()
+
+    packages, first_party = import_breakdown()
+    print("📦 Import self time by package (ms)")
+    for name, ms in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {name:<34} {ms:>8.1f}")
+
+    print("\n🏠 First-party modules, cumulative (ms)")
+    for name, ms in sorted(first_party.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<34} {ms:>8.1f}")
+
+    run = cold_start(args.repeat)
+    print("\n🔧 Client initializers (ms)")
+    for name, seconds in sorted(run['clients'].items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<34} {seconds * 1000:>8.1f}")
+
+    print(f"\n⏱️ import main: {run['import']:.3f}s (budget {args.budget:.3f}s)")
+    if run['import'] > args.budget:
+        print("❌ Cold start is over budget")
+        sys.exit(1)
+    print("✅ Cold start within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+# book_store.py
+"""
+Append-only archive of completed books
+Each save appends one zlib-compressed record to a segment file; an
+in-memory index by book ID, user and theme makes library listings
+O(page size) and reopening a book a single sequential read through mmap
+
+Several worker processes can share one segment: appends and compaction
+take an exclusive file lock, and every reader catches up on records other
+processes appended (or reloads after another process compacted)
+"""
+
+import os
+import json
+import mmap
+import zlib
+import bisect
+import struct
+import atexit
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: single worker only
+    fcntl = None
+
+# magic, crc32 of payload, payload length
+_HEADER = struct.Struct("<4sII")
+_MAGIC = b"BTB1"
+
+
+class BookStore:
+    """Segment file of compressed book records plus in-memory indexes"""
+
+    def __init__(self, path: str, compact_ratio: float = 0.5, compact_min_bytes: int = 1 << 20):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+
+        self._lock = threading.RLock()
+        self._offsets = {}  # book_id -> (offset, record length)
+        self._summaries = {}  # book_id -> listing summary
+        self._by_user = {}  # user -> [(seq, book_id, offset)] in save order
+        self._by_theme = {}  # theme -> [(seq, book_id, offset)] in save order
+        self._seq = 0  # highest save sequence number seen
+        self._size = 0
+        self._garbage = 0
+        self._map = None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self._file = open(path, "r+b")
+        with self._file_lock():
+            self._load(repair=True)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on the segment across processes"""
+        if fcntl is None:
+            yield
+            return
+        while True:
+            locked = self._file
+            fcntl.flock(locked.fileno(), fcntl.LOCK_EX)
+            # Another process may have compacted (replaced) the file while we waited
+            if not os.path.exists(self.path) or os.stat(self.path).st_ino == os.fstat(locked.fileno()).st_ino:
+                break
+            fcntl.flock(locked.fileno(), fcntl.LOCK_UN)
+            self._catch_up()
+        try:
+            yield
+        finally:
+            # compact() closes the locked file, which releases the lock by itself
+            if not locked.closed:
+                fcntl.flock(locked.fileno(), fcntl.LOCK_UN)
+
+    # Loading and mapping
+    def _load(self, repair: bool = False):
+        self._offsets.clear()
+        self._summaries.clear()
+        self._by_user.clear()
+        self._by_theme.clear()
+        self._seq = 0
+        self._size = 0
+        self._garbage = 0
+        self._remap()
+        self._scan_from(0, repair)
+
+    def _catch_up(self):
+        """Pick up records appended, or a compaction done, by another process"""
+        try:
+            on_disk = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if on_disk.st_ino != os.fstat(self._file.fileno()).st_ino:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+            self._file = open(self.path, "r+b")
+            self._load()
+        elif on_disk.st_size > self._size:
+            self._remap()
+            self._scan_from(self._size)
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        size = os.fstat(self._file.fileno()).st_size
+        if size:
+            self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+
+    def _scan_from(self, offset: int, repair: bool = False):
+        """Index every complete record from `offset`; with `repair`, truncate a torn tail"""
+        end = len(self._map) if self._map is not None else 0
+        while offset + _HEADER.size <= end:
+            magic, crc, length = _HEADER.unpack_from(self._map, offset)
+            payload_end = offset + _HEADER.size + length
+            if magic != _MAGIC or payload_end > end:
+                break
+            payload = self._map[offset + _HEADER.size:payload_end]
+            if zlib.crc32(payload) != crc:
+                break
+            self._index_record(json.loads(zlib.decompress(payload)), offset, payload_end - offset)
+            offset = payload_end
+
+        # Without the repair flag an incomplete tail may be another process mid-append
+        if repair and offset < end:
+            print(f"⚠️ Truncating {end - offset} bytes of incomplete book records in {self.path}")
+            self._file.truncate(offset)
+            self._remap()
+        self._size = offset
+
+    def _index_record(self, record: Dict, offset: int, length: int):
+        book_id = record['id']
+        # Records written before sequence numbers are numbered by position
+        seq = record.get('seq') or self._seq + 1
+        self._seq = max(self._seq, seq)
+        previous = self._offsets.get(book_id)
+        if previous is not None:
+            self._garbage += previous[1]
+        self._offsets[book_id] = (offset, length)
+        self._summaries[book_id] = {
+            'id': book_id,
+            'user_name': record.get('user_name', ''),
+            'theme': record.get('theme', ''),
+            'pages_count': record.get('pages_count', 0),
+            'completed_at': record.get('completed_at'),
+            'saved_at': record.get('saved_at')
+        }
+        self._by_user.setdefault(record.get('user_name', ''), []).append((seq, book_id, offset))
+        self._by_theme.setdefault(record.get('theme', ''), []).append((seq, book_id, offset))
+
+    # Writes
+    def save(self, book_data: Dict) -> str:
+        """Append a completed book; saving the same ID again supersedes it"""
+        book_id = str(book_data['id'])
+        record = {
+            'id': book_id,
+            'user_name': book_data.get('userName', ''),
+            'theme': book_data.get('theme', ''),
+            'pages_count': len(book_data.get('pages', [])),
+            'completed_at': book_data.get('completedAt'),
+            'saved_at': datetime.now().isoformat(),
+            'book': book_data
+        }
+
+        with self._lock, self._file_lock():
+            self._catch_up()
+            # Numbered under the file lock, so unique across processes and kept through compaction
+            record['seq'] = self._seq + 1
+            payload = zlib.compress(json.dumps(record, separators=(",", ":")).encode("utf-8"), 6)
+            data = _HEADER.pack(_MAGIC, zlib.crc32(payload), len(payload)) + payload
+            offset = self._size
+            self._file.seek(offset)
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self._index_record(record, offset, len(data))
+            self._maybe_compact()
+        return book_id
+
+    def _maybe_compact(self):
+        if self._size >= self.compact_min_bytes and self._garbage / self._size >= self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the segment with only the latest record of each book"""
+        with self._lock, self._file_lock():
+            self._catch_up()
+            self._remap()
+            live = sorted(self._offsets.values())
+            tmp_path = f"{self.path}.compact"
+            with open(tmp_path, "wb") as out:
+                for offset, length in live:
+                    out.write(self._map[offset:offset + length])
+                out.flush()
+                os.fsync(out.fileno())
+
+            reclaimed = self._garbage
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            os.replace(tmp_path, self.path)
+            # Still holding the lock on the old file; other processes reload on their next catch-up
+            old_file = self._file
+            self._file = open(self.path, "r+b")
+            self._load()
+            old_file.close()
+            print(f"🗜️ Compacted book store, reclaimed {reclaimed} bytes")
+
+    # Reads
+    def get(self, book_id: str) -> Optional[Dict]:
+        """Full book as it was saved, or None"""
+        with self._lock:
+            self._catch_up()
+            location = self._offsets.get(str(book_id))
+            if location is None:
+                return None
+            offset, length = location
+            if self._map is None or offset + length > len(self._map):
+                self._remap()
+            payload = self._map[offset + _HEADER.size:offset + length]
+        return json.loads(zlib.decompress(payload))['book']
+
+    def list_books(
+        self,
+        user_name: Optional[str] = None,
+        theme: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Dict:
+        """
+        Newest-first page of book summaries for a user or theme
+
+        Args:
+            user_name: Reader whose library to list
+            theme: List books of this theme instead
+            cursor: Opaque cursor from a previous page (a save sequence
+                number, so it stays valid across compaction)
+            limit: Page size
+
+        Returns:
+            Dictionary with 'books' and 'next_cursor' (None on the last page)
+
+        Raises:
+            ValueError: The cursor is malformed or out of range
+        """
+        with self._lock:
+            self._catch_up()
+            entries = self._by_user.get(user_name, []) if user_name is not None else self._by_theme.get(theme, [])
+            if cursor:
+                before = int(cursor)
+                if not 0 < before <= self._seq + 1:
+                    raise ValueError(f"Cursor out of range: {cursor}")
+                position = bisect.bisect_left(entries, before, key=lambda entry: entry[0])
+            else:
+                position = len(entries)
+            books = []
+            while position > 0 and len(books) < limit:
+                position -= 1
+                seq, book_id, offset = entries[position]
+                # Skip entries superseded by a later save of the same book
+                if self._offsets[book_id][0] == offset:
+                    books.append(dict(self._summaries[book_id]))
+        # Books saved before the last one looked at
+        return {'books': books, 'next_cursor': str(entries[position][0]) if position > 0 else None}
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_book_store() -> BookStore:
+    """Process-wide book store, opened on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BookStore(Config.BOOK_STORE_PATH)
+                atexit.register(_store.close)
+    return _store
@@ -0,0 +1,390 @@
+# cassette.py
+"""
+Record/replay of provider traffic
+With CASSETTE_MODE=record every boto3 call made through clients.py (Bedrock,
+Titan, Polly, AWS Location) and every Google Places request is written to a
+gzip JSON-lines cassette, with its real latency. Large payloads (images,
+audio) are stored once each, by SHA-256, next to it. Incoming API requests
+are captured too, with their arrival times, so benchmarks/replay.py can
+reproduce the whole traffic pattern.
+
+With CASSETTE_MODE=replay the same calls are answered from the cassette
+after sleeping the recorded latency times CASSETTE_LATENCY_SCALE; no
+provider is contacted.
+"""
+
+import io
+import os
+import json
+import gzip
+import time
+import base64
+import hashlib
+import threading
+from collections import defaultdict, deque
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+
+# Payloads at least this large go to the blob directory instead of the cassette
+BLOB_MIN_BYTES = 4096
+
+# Request fields that change on every call and must not affect matching
+_VOLATILE_FIELDS = {"seed"}
+# Never written to disk, at any depth (Google Places sends its API key as params.key)
+_SECRET_FIELDS = {"key"}
+
+
+class CassetteMiss(RuntimeError):
+    """Replay found no recorded response for a request"""
+
+
+class Cassette:
+    """One cassette: `<path>.jsonl.gz` (provider calls), `<path>.requests.jsonl.gz` (API requests), `<path>.blobs/`"""
+
+    def __init__(self, path: str, mode: str, latency_scale: float = 1.0, strict: bool = False):
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self.blob_dir = f"{path}.blobs"
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+        if mode == "record":
+            os.makedirs(self.blob_dir, exist_ok=True)
+            # Appending adds a gzip member; readers see one continuous stream
+            self._calls = gzip.open(f"{path}.jsonl.gz", "at", encoding="utf-8")
+            self._requests = gzip.open(f"{path}.requests.jsonl.gz", "at", encoding="utf-8")
+        else:
+            self._by_key = defaultdict(deque)
+            self._by_op = defaultdict(list)
+            self._op_cursor = defaultdict(int)
+            for entry in read_entries(f"{path}.jsonl.gz"):
+                self._by_key[entry['key']].append(entry)
+                self._by_op[entry['op']].append(entry)
+            print(f"📼 Replaying {sum(len(v) for v in self._by_op.values())} provider calls from {path}")
+
+    # Encoding
+    def _encode(self, value: Any) -> Any:
+        if isinstance(value, (bytes, bytearray)):
+            data = bytes(value)
+            if len(data) < BLOB_MIN_BYTES:
+                return {'$b64': base64.b64encode(data).decode()}
+            digest = hashlib.sha256(data).hexdigest()
+            blob_path = os.path.join(self.blob_dir, digest)
+            if not os.path.exists(blob_path):
+                tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, blob_path)
+            return {'$blob': digest}
+        if isinstance(value, dict):
+            return {k: self._encode(v) for k, v in value.items() if k != "ResponseMetadata"}
+        if isinstance(value, (list, tuple)):
+            return [self._encode(v) for v in value]
+        if hasattr(value, "read"):
+            return {'$stream': self._encode(value.read())}
+        if hasattr(value, "__iter__") and hasattr(value, "close"):
+            # Event streams (Bedrock response streams) are recorded whole and replayed at once
+            return {'$events': [self._encode(event) for event in value]}
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            return value
+        return str(value)
+
+    def _decode(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            if '$b64' in value:
+                return base64.b64decode(value['$b64'])
+            if '$blob' in value:
+                with open(os.path.join(self.blob_dir, value['$blob']), "rb") as f:
+                    return f.read()
+            if '$stream' in value:
+                return io.BytesIO(self._decode(value['$stream']))
+            if '$events' in value:
+                return _RecordedEvents(self._decode(value['$events']))
+            return {k: self._decode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._decode(v) for v in value]
+        return value
+
+    # Provider calls
+    def call(self, op: str, request: Dict, perform: Optional[Callable[[], Any]]) -> Any:
+        """Record `perform()` or replay its recorded result"""
+        key = request_key(op, request)
+        if self.mode == "replay":
+            return self._replay(op, key)
+
+        start = time.perf_counter()
+        error = None
+        try:
+            response = perform()
+            # Streams are consumed here so the caller gets the same bytes we store
+            encoded = self._encode(response)
+            response = self._decode(encoded) if _has_stream(encoded) else response
+        except Exception as e:
+            error, encoded = e, None
+        entry = {
+            'op': op,
+            'key': key,
+            't': round(time.monotonic() - self._started, 4),
+            'latency': round(time.perf_counter() - start, 4),
+            'request': self._encode(_scrub(request)),
+            'response': encoded,
+            'error': _encode_error(error) if error else None
+        }
+        with self._lock:
+            self._calls.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        if error:
+            raise error
+        return response
+
+    def _replay(self, op: str, key: str) -> Any:
+        with self._lock:
+            matches = self._by_key.get(key)
+            if matches:
+                entry = matches[0]
+                # Repeated identical requests get the recorded responses in order, the last one sticks
+                if len(matches) > 1:
+                    matches.popleft()
+            elif not self.strict and self._by_op.get(op):
+                entries = self._by_op[op]
+                entry = entries[self._op_cursor[op] % len(entries)]
+                self._op_cursor[op] += 1
+            else:
+                raise CassetteMiss(f"No recorded {op} call matches this request")
+        if self.latency_scale > 0:
+            time.sleep(entry['latency'] * self.latency_scale)
+        if entry.get('error'):
+            raise _decode_error(entry['error'])
+        return self._decode(entry['response'])
+
+    # Incoming API requests
+    def record_request(self, method: str, path: str, query: str, body: bytes, headers: Dict[str, str]):
+        entry = {
+            't': round(time.monotonic() - self._started, 4),
+            'method': method,
+            'path': path,
+            'query': query,
+            'headers': headers,
+            'body': self._encode(body) if body else None
+        }
+        with self._lock:
+            self._requests.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self):
+        if self.mode == "record":
+            with self._lock:
+                self._calls.close()
+                self._requests.close()
+
+
+def read_entries(path: str):
+    """Entries of a cassette file, tolerating a torn final line"""
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+        except (EOFError, OSError):
+            # Recording process was killed mid-write
+            return
+
+
+def request_key(op: str, request: Dict) -> str:
+    """Stable hash of an operation and its parameters, ignoring per-call noise"""
+    return hashlib.sha256(f"{op}\n{json.dumps(_normalise(request), sort_keys=True, default=str)}".encode()).hexdigest()[:32]
+
+
+def _without(value: Any, fields: set, decode: bool) -> Any:
+    """
+    Value with `fields` dropped from every dict inside it, JSON strings included
+
+    With decode, JSON strings come back parsed; otherwise they stay strings
+    (re-serialised only if something was dropped).
+    """
+    if isinstance(value, str) and value[:1] in "{[":
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return value
+        stripped = _without(parsed, fields, decode)
+        if decode:
+            return stripped
+        return value if stripped == parsed else json.dumps(stripped)
+    if isinstance(value, dict):
+        return {k: _without(v, fields, decode) for k, v in value.items() if k not in fields}
+    if isinstance(value, (list, tuple)):
+        return [_without(v, fields, decode) for v in value]
+    return value
+
+
+def _normalise(value: Any) -> Any:
+    return _without(value, _VOLATILE_FIELDS | _SECRET_FIELDS, decode=True)
+
+
+def _scrub(request: Dict) -> Dict:
+    return _without(request, _SECRET_FIELDS, decode=False)
+
+
+def secret_fields_in(value: Any) -> set:
+    """Secret field names present anywhere in a recorded value (cassettes from before scrubbing was recursive)"""
+    if isinstance(value, str) and value[:1] in "{[":
+        try:
+            return secret_fields_in(json.loads(value))
+        except ValueError:
+            return set()
+    if isinstance(value, dict):
+        found = _SECRET_FIELDS & set(value)
+        for v in value.values():
+            found |= secret_fields_in(v)
+        return found
+    if isinstance(value, (list, tuple)):
+        return set().union(*(secret_fields_in(v) for v in value)) if value else set()
+    return set()
+
+
+def _has_stream(encoded: Any) -> bool:
+    if isinstance(encoded, dict):
+        return '$stream' in encoded or '$events' in encoded or any(_has_stream(v) for v in encoded.values())
+    if isinstance(encoded, list):
+        return any(_has_stream(v) for v in encoded)
+    return False
+
+
+def _encode_error(error: Exception) -> Dict:
+    data = {'type': type(error).__name__, 'message': str(error)}
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and 'Error' in response:
+        data['code'] = response['Error'].get('Code')
+        data['operation'] = getattr(error, "operation_name", "")
+    return data
+
+
+def _decode_error(data: Dict) -> Exception:
+    if data.get('type') == "ClientError":
+        from botocore.exceptions import ClientError
+        return ClientError({'Error': {'Code': data.get('code'), 'Message': data['message']}}, data.get('operation', ""))
+    return RuntimeError(f"{data['type']}: {data['message']}")
+
+
+class _RecordedEvents(list):
+    """Replayed event stream"""
+
+    def close(self):
+        pass
+
+
+class _ClientProxy:
+    """Wraps a boto3 client; every method call goes through the cassette"""
+
+    def __init__(self, service: str, client, cassette: Cassette):
+        self._service = service
+        self._client = client
+        self._cassette = cassette
+
+    def __getattr__(self, name: str):
+        def method(**kwargs):
+            perform = (lambda: getattr(self._client, name)(**kwargs)) if self._client is not None else None
+            return self._cassette.call(f"{self._service}.{name}", kwargs, perform)
+        return method
+
+
+def wrap_client(service: str, build: Callable[[], Any]):
+    """A cassette-backed client; in replay mode the real client is never built"""
+    cassette = get_cassette()
+    return _ClientProxy(service, build() if cassette.mode == "record" else None, cassette)
+
+
+class _RecordedResponse:
+    def __init__(self, status_code: int, payload: Any):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self) -> Any:
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"Recorded HTTP {self.status_code}")
+
+
+def wrap_http_get(http_get: Callable, op: str):
+    """Cassette-backed version of a requests.get-style function returning JSON"""
+    def get(url: str, params: Dict):
+        def perform():
+            response = http_get(url, params)
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = None
+            return {'status_code': response.status_code, 'json': payload}
+        result = get_cassette().call(op, {'url': url, 'params': params}, perform)
+        return _RecordedResponse(result['status_code'], result['json'])
+    return get
+
+
+class CassetteMiddleware:
+    """ASGI middleware capturing incoming requests (record mode only)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(("/story", "/location", "/api")):
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        headers = {
+            k.decode("latin-1"): v.decode("latin-1")
+            for k, v in scope.get("headers") or []
+            if k in (b"content-type", b"idempotency-key", b"x-deadline-ms")
+        }
+        get_cassette().record_request(
+            scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"), body, headers
+        )
+
+        sent = [False]
+
+        async def replay_receive():
+            if not sent[0]:
+                sent[0] = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return Config.CASSETTE_MODE in ("record", "replay")
+
+
+def get_cassette() -> Cassette:
+    """Process-wide cassette for CASSETTE_MODE / CASSETTE_PATH"""
+    global _cassette
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                import atexit
+                path = Config.CASSETTE_PATH if Config.WORKERS <= 1 else f"{Config.CASSETTE_PATH}.{os.getpid()}"
+                _cassette = Cassette(
+                    path, Config.CASSETTE_MODE,
+                    latency_scale=Config.CASSETTE_LATENCY_SCALE, strict=Config.CASSETTE_STRICT
+                )
+                atexit.register(_cassette.close)
+    return _cassette
@@ -0,0 +1,133 @@
+# clients.py
+"""
+Lazily constructed provider clients
+boto3, openai and Pinecone are imported, and their clients built, on first
+use or by warm_clients() at startup (bounded by a timeout). Importing the
+app stays fast and a bad credential can't crash worker boot.
+"""
+
+import time
+import asyncio
+import threading
+from typing import Any, Dict, Optional
+
+from config import Config
+
+_clients = {}
+_lock = threading.Lock()
+_timings = {}  # initializer name -> seconds
+
+
+def _build(key, name: str, factory):
+    """Construct and cache a client once per process, recording how long it took"""
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                start = time.perf_counter()
+                try:
+                    client = factory()
+                finally:
+                    _timings[name] = time.perf_counter() - start
+                _clients[key] = client
+    return client
+
+
+def get_aws_client(service: str, region: Optional[str] = None):
+    """
+    Cached boto3 client for an AWS service
+
+    Args:
+        service: boto3 service name, e.g. 'bedrock-runtime' or 'polly'
+        region: AWS region (default: AWS_REGION)
+
+    Raises whatever boto3 raises if the client can't be constructed; the
+    next call tries again.
+    """
+    region = region or Config.AWS_REGION
+
+    def factory():
+        import boto3
+        from botocore.config import Config as BotoConfig
+        # Bounded sockets and retries, so an abandoned call can't hold a thread for long
+        return boto3.client(service, region_name=region, config=BotoConfig(
+            connect_timeout=Config.PROVIDER_CONNECT_TIMEOUT,
+            read_timeout=Config.PROVIDER_READ_TIMEOUT,
+            retries={'max_attempts': 2, 'mode': 'standard'}
+        ))
+
+    if Config.CASSETTE_MODE in ("record", "replay"):
+        import cassette
+        return _build(("aws", service, region), f"boto3.{service}", lambda: cassette.wrap_client(service, factory))
+    return _build(("aws", service, region), f"boto3.{service}", factory)
+
+
+def get_openai():
+    """The openai module with the API key set, or None when no key is configured"""
+    if not Config.OPENAI_API_KEY:
+        return None
+
+    def factory():
+        import openai
+        openai.api_key = Config.OPENAI_API_KEY
+        return openai
+
+    return _build(("openai",), "openai", factory)
+
+
+def get_pinecone(api_key: str):
+    """Cached Pinecone client"""
+    def factory():
+        from pinecone import Pinecone
+        return Pinecone(api_key=api_key)
+
+    return _build(("pinecone",), "pinecone", factory)
+
+
+def init_timings() -> Dict[str, float]:
+    """Seconds spent constructing each client so far"""
+    return dict(_timings)
+
+
+def _warm(region: str) -> Dict[str, Any]:
+    results = {}
+    for service, service_region in (
+        ("bedrock-runtime", region),
+        ("polly", Config.AWS_REGION),
+        ("location", Config.AWS_REGION)
+    ):
+        try:
+            get_aws_client(service, service_region)
+            results[service] = True
+        except Exception as e:
+            print(f"⚠️ Could not initialise {service} client: {e}")
+            results[service] = False
+    try:
+        results["openai"] = get_openai() is not None
+    except Exception as e:
+        print(f"⚠️ Could not initialise OpenAI client: {e}")
+        results["openai"] = False
+    return results
+
+
+async def warm_clients(timeout: float, region: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build the request-path clients ahead of the first request
+
+    Args:
+        timeout: Seconds to wait; anything still initialising finishes in the background
+        region: Bedrock region (default: AWS_REGION)
+
+    Returns:
+        Per-client success flags, or {'timed_out': True}
+    """
+    start = time.perf_counter()
+    task = asyncio.ensure_future(asyncio.to_thread(_warm, region or Config.AWS_REGION))
+    try:
+        results = await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        print(f"⚠️ Client warm-up still running after {timeout}s; continuing startup")
+        return {'timed_out': True}
+    print(f"🔥 Provider clients ready in {time.perf_counter() - start:.2f}s")
+    return results
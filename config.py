@@ -21,6 +21,141 @@ class Config:
     # Gemini Configuration (for image generation)
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
     
+    # Location Service Configuration
+    # Query AWS Location and Google Places concurrently and merge by distance
+    LOCATION_MULTI_PROVIDER = os.getenv("LOCATION_MULTI_PROVIDER", "false").lower() == "true"
+    # Seconds to wait for providers before returning whatever has arrived
+    LOCATION_RACE_TIMEOUT = float(os.getenv("LOCATION_RACE_TIMEOUT", "2.5"))
+    # How long a provider health check result is trusted (seconds)
+    LOCATION_AVAILABILITY_TTL = float(os.getenv("LOCATION_AVAILABILITY_TTL", "300"))
+    # How long a failed provider is skipped before being tried again (seconds)
+    LOCATION_RETRY_AFTER = float(os.getenv("LOCATION_RETRY_AFTER", "30"))
+    # Business names kept for matching story locations to real places
+    NAME_INDEX_CAPACITY = int(os.getenv("NAME_INDEX_CAPACITY", "5000"))
+    NAME_INDEX_MIN_SIMILARITY = float(os.getenv("NAME_INDEX_MIN_SIMILARITY", "0.45"))
+    # Extra seconds a page waits for its business prefetch after narration/illustration
+    BUSINESS_PREFETCH_TIMEOUT = float(os.getenv("BUSINESS_PREFETCH_TIMEOUT", "1.0"))
+    
+    # Pinecone write-behind buffer
+    PINECONE_WRITE_LOG = os.getenv("PINECONE_WRITE_LOG", "data/pinecone_writes.log")
+    PINECONE_BATCH_SIZE = int(os.getenv("PINECONE_BATCH_SIZE", "50"))
+    PINECONE_FLUSH_INTERVAL_MS = int(os.getenv("PINECONE_FLUSH_INTERVAL_MS", "500"))
+    
+    # Local vector store (book/profile similarity without Pinecone)
+    VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "data/vectors")
+    # Append-only archive of full completed books
+    BOOK_STORE_PATH = os.getenv("BOOK_STORE_PATH", "data/books.seg")
+    
+    # Multi-worker state
+    # memory (single worker), sqlite (all workers on one box) or redis
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+    STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "data/state.sqlite3")
+    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+    
+    # Generated audio and illustrations
+    MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+    MEDIA_RETENTION_HOURS = float(os.getenv("MEDIA_RETENTION_HOURS", "24"))
+    
+    # Reuse of illustrations for near-identical prompts (see image_service.IllustrationCache), per worker
+    ILLUSTRATION_CACHE_ENABLED = os.getenv("ILLUSTRATION_CACHE_ENABLED", "false").lower() == "true"
+    ILLUSTRATION_CACHE_MAX_ENTRIES = int(os.getenv("ILLUSTRATION_CACHE_MAX_ENTRIES", "20000"))
+    # Prompt embedding size; memory is MAX_ENTRIES x DIM x 4 bytes
+    ILLUSTRATION_CACHE_DIM = int(os.getenv("ILLUSTRATION_CACHE_DIM", "256"))
+    # Cosine similarity a cached prompt needs to be reused, per age group ("3-5:0.85,..."), else the default
+    ILLUSTRATION_CACHE_THRESHOLD = float(os.getenv("ILLUSTRATION_CACHE_THRESHOLD", "0.9"))
+    ILLUSTRATION_CACHE_THRESHOLDS = os.getenv("ILLUSTRATION_CACHE_THRESHOLDS", "3-5:0.85,6-8:0.88")
+    # Different pictures (Titan seeds) drawn for a prompt before reuse picks among them by page seed
+    ILLUSTRATION_CACHE_VARIANTS = int(os.getenv("ILLUSTRATION_CACHE_VARIANTS", "1"))
+    
+    # Prometheus metrics at /metrics
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    
+    # Request tracing: fraction of requests traced (X-Trace: 1 with the admin token forces one)
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+    TRACE_PATH = os.getenv("TRACE_PATH", "data/traces/spans")
+    TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 << 20)))
+    
+    # Opt-in profiling (cProfile per request, tracemalloc admin endpoints)
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+    # Required by /admin and /debug/trace endpoints and X-Profile/X-Trace requests; admin features are off when unset
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+    
+    # Request time budgets in seconds; clients may send X-Deadline-Ms (up to DEADLINE_MAX)
+    DEADLINE_GENERATE = float(os.getenv("DEADLINE_GENERATE", "25"))
+    DEADLINE_CONTINUE = float(os.getenv("DEADLINE_CONTINUE", "25"))
+    DEADLINE_VOICE_DEMO = float(os.getenv("DEADLINE_VOICE_DEMO", "8"))
+    DEADLINE_LOCATION = float(os.getenv("DEADLINE_LOCATION", "8"))
+    DEADLINE_BATCH = float(os.getenv("DEADLINE_BATCH", "90"))
+    DEADLINE_MAX = float(os.getenv("DEADLINE_MAX", "60"))
+    # Socket timeouts for every provider client (seconds)
+    PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "3"))
+    PROVIDER_READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", "30"))
+    # Threads per worker for blocking provider calls
+    PROVIDER_THREADS = int(os.getenv("PROVIDER_THREADS", "64"))
+    
+    # Bedrock models for story text; the lite model is used when the service is under load
+    BEDROCK_MODEL_ID = os.getenv("BEDROCK_MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+    BEDROCK_LITE_MODEL_ID = os.getenv("BEDROCK_LITE_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+    
+    # Page quality ladder (see degradation.py), per worker
+    DEGRADATION_ENABLED = os.getenv("DEGRADATION_ENABLED", "true").lower() == "true"
+    DEGRADE_MAX_LLM_IN_FLIGHT = int(os.getenv("DEGRADE_MAX_LLM_IN_FLIGHT", "24"))
+    # Smoothed stage latency (seconds) that counts as overloaded
+    DEGRADE_LLM_TARGET = float(os.getenv("DEGRADE_LLM_TARGET", "8"))
+    DEGRADE_TITAN_TARGET = float(os.getenv("DEGRADE_TITAN_TARGET", "10"))
+    DEGRADE_POLLY_TARGET = float(os.getenv("DEGRADE_POLLY_TARGET", "4"))
+    DEGRADE_QUEUE_TARGET = float(os.getenv("DEGRADE_QUEUE_TARGET", "2"))
+    # Step down above DEGRADE_HIGH; step up after DEGRADE_HOLD_SECONDS below DEGRADE_LOW
+    DEGRADE_HIGH = float(os.getenv("DEGRADE_HIGH", "1.0"))
+    DEGRADE_LOW = float(os.getenv("DEGRADE_LOW", "0.6"))
+    DEGRADE_HOLD_SECONDS = float(os.getenv("DEGRADE_HOLD_SECONDS", "15"))
+    
+    # Admission control for /story/continue, /story/generate and /api/voice-demo (per worker)
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    # Slots shared by all classes
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+    # Per class: "concurrency,queue length,queue timeout seconds"
+    ADMISSION_CONTINUE = os.getenv("ADMISSION_CONTINUE", "32,64,15")
+    ADMISSION_GENERATE = os.getenv("ADMISSION_GENERATE", "24,48,10")
+    ADMISSION_VOICE_DEMO = os.getenv("ADMISSION_VOICE_DEMO", "4,8,2")
+    # Fairness: requests are grouped by this header (else client address), each with a few queue places
+    ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "X-Client-ID")
+    ADMISSION_MAX_QUEUED_PER_CLIENT = int(os.getenv("ADMISSION_MAX_QUEUED_PER_CLIENT", "8"))
+    
+    # Classroom batches (/story/batch): entries per call and provider calls per stage, per worker
+    BATCH_MAX_ENTRIES = int(os.getenv("BATCH_MAX_ENTRIES", "40"))
+    BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+    BATCH_POLLY_CONCURRENCY = int(os.getenv("BATCH_POLLY_CONCURRENCY", "8"))
+    BATCH_TITAN_CONCURRENCY = int(os.getenv("BATCH_TITAN_CONCURRENCY", "4"))
+    
+    # Pipelined pages (/story/generate/stream, /story/continue/stream): paragraphs shorter
+    # than this are narrated together with the next one, to save Polly round trips
+    NARRATION_SEGMENT_MIN_CHARS = int(os.getenv("NARRATION_SEGMENT_MIN_CHARS", "120"))
+    
+    # Pre-baked story trees for popular themes (see story_tree.py and bake_stories.py)
+    STORY_TREES_ENABLED = os.getenv("STORY_TREES_ENABLED", "true").lower() == "true"
+    STORY_TREE_DIR = os.getenv("STORY_TREE_DIR", "data/story_trees")
+    
+    # Idempotency-Key for /story/continue and /api/save-book (see idempotency.py)
+    IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+    # Seconds a response is kept for retries, and how many are kept per worker
+    IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "900"))
+    IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "5000"))
+    
+    # Provider traffic capture (see cassette.py): off, record or replay
+    CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+    CASSETTE_PATH = os.getenv("CASSETTE_PATH", "data/cassettes/session")
+    # Replay sleeps recorded latency x this (0 = no delay)
+    CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "1.0"))
+    # Strict replay fails unmatched calls instead of serving another recording of the same operation
+    CASSETTE_STRICT = os.getenv("CASSETTE_STRICT", "false").lower() == "true"
+    
+    # Seconds startup waits for provider clients to initialise (0 disables warm-up)
+    STARTUP_WARM_TIMEOUT = float(os.getenv("STARTUP_WARM_TIMEOUT", "5"))
+    
     # Application Configuration
     ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -0,0 +1,194 @@
+# deadlines.py
+"""
+Per-request time budgets
+DeadlineMiddleware gives each API request a deadline: the route's budget
+(DEADLINE_* in config), or the client's X-Deadline-Ms up to DEADLINE_MAX.
+The deadline lives in a context variable, so provider calls, to_thread work
+and prefetch tasks started by the request all see it:
+
+- run_in_thread() runs a blocking provider call for at most the remaining time
+- timeout() caps a socket timeout by the remaining time
+- start_stage() says whether an optional page stage still has time to run,
+  and records it in the request's dropped stages if not
+"""
+
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from config import Config
+from metrics import DROPPED_STAGES, CANCELLED_WORK, RECLAIMED_SECONDS
+
+# Below this much remaining time an optional stage isn't started (seconds)
+STAGE_MIN_SECONDS = {
+    'illustration': 2.0,
+    'narration': 0.5,
+    'businesses': 0.1
+}
+
+_deadline = contextvars.ContextVar("deadline", default=None)  # time.monotonic() value
+_dropped = contextvars.ContextVar("dropped_stages", default=None)
+
+# Smoothed seconds each function run through run_in_thread takes, to estimate
+# the thread time saved when a queued call is dropped
+_typical_runtime = {}
+
+# Provider calls wait on the network, so they get a pool sized for I/O rather
+# than asyncio's default (CPU count + 4 threads)
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.PROVIDER_THREADS, thread_name_prefix="provider")
+    return _executor
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out"""
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None when it has no deadline"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def timeout(cap: float) -> float:
+    """`cap` limited to the remaining budget; raises DeadlineExceeded when none is left"""
+    left = remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(cap, left)
+
+
+def drop_stage(stage: str, reason: str = "deadline"):
+    """Record that a stage was skipped or abandoned (for the deadline, or `reason`)"""
+    DROPPED_STAGES.inc(stage, reason)
+    dropped = _dropped.get()
+    if dropped is not None and stage not in dropped:
+        dropped.append(stage)
+
+
+def add_dropped(stages: List[str]):
+    """Add stages already dropped (and counted) by work this request shared"""
+    dropped = _dropped.get()
+    if dropped is not None:
+        dropped.extend(stage for stage in stages if stage not in dropped)
+
+
+def dropped_stages() -> List[str]:
+    return list(_dropped.get() or [])
+
+
+def reset_dropped():
+    """Start a separate dropped-stage list for the current task (e.g. one child of a batch)"""
+    _dropped.set([])
+
+
+def start_stage(stage: str) -> bool:
+    """Whether an optional stage has time to run; drops it otherwise"""
+    left = remaining()
+    if left is None or left >= STAGE_MIN_SECONDS.get(stage, 0.0):
+        return True
+    drop_stage(stage)
+    return False
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """
+    asyncio.to_thread on the provider pool, bounded by the request deadline
+
+    The call is skipped if the deadline passes while it waits for a worker
+    thread, and dropped from the queue if the caller is cancelled. If it
+    overruns, the caller gets DeadlineExceeded while the thread finishes
+    within the client's socket timeouts.
+    """
+    name = getattr(func, '__qualname__', 'call')
+
+    def guarded():
+        if expired():
+            raise DeadlineExceeded("Request deadline exceeded before the call started")
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            previous = _typical_runtime.get(name)
+            _typical_runtime[name] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    # Like to_thread, the call sees this context (deadline, trace span, metrics labels)
+    context = contextvars.copy_context()
+    job = _get_executor().submit(context.run, guarded)
+    call = asyncio.wrap_future(job)
+    try:
+        if left is None:
+            return await call
+        return await asyncio.wait_for(call, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"{name} overran the request deadline")
+    finally:
+        # Given up on (deadline, or the client left) before a thread picked it up
+        if job.cancelled():
+            CANCELLED_WORK.inc("thread_pool", "dequeued")
+            RECLAIMED_SECONDS.inc("thread_pool", amount=_typical_runtime.get(name, 0.0))
+
+
+def budget_for(path: str) -> Optional[float]:
+    """Default budget in seconds for a route, or None for routes without one"""
+    if path in ("/story/generate", "/story/generate/stream"):
+        return Config.DEADLINE_GENERATE
+    if path in ("/story/continue", "/story/continue/stream"):
+        return Config.DEADLINE_CONTINUE
+    if path == "/story/batch":
+        return Config.DEADLINE_BATCH
+    if path == "/api/voice-demo":
+        return Config.DEADLINE_VOICE_DEMO
+    if path.startswith("/location/"):
+        return Config.DEADLINE_LOCATION
+    return None
+
+
+class DeadlineMiddleware:
+    """ASGI middleware setting each API request's deadline"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        budget = budget_for(scope["path"]) if scope["type"] == "http" else None
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+
+        requested = dict(scope.get("headers") or []).get(b"x-deadline-ms")
+        if requested:
+            try:
+                budget = min(max(int(requested) / 1000, 0.1), Config.DEADLINE_MAX)
+            except ValueError:
+                pass
+
+        deadline_token = _deadline.set(time.monotonic() + budget)
+        dropped_token = _dropped.set([])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(deadline_token)
+            _dropped.reset(dropped_token)
@@ -0,0 +1,188 @@
+# degradation.py
+"""
+Load-driven quality ladder for story pages
+Under load, every reader gets a cheaper page quickly. Without it, some
+readers get full pages and the rest time out. The ladder watches provider
+calls through metrics.observe_stage, and admission control's queue:
+- Bedrock calls in flight, against DEGRADE_MAX_LLM_IN_FLIGHT
+- smoothed latency of each stage, and of queueing, against its target
+
+It steps down one tier while the worst of those ratios is above
+DEGRADE_HIGH. It steps back up one tier at a time once the ratio has stayed
+below DEGRADE_LOW for DEGRADE_HOLD_SECONDS.
+
+Tiers, from best to cheapest:
+    full             Claude Sonnet, illustration, narration
+    lite_model       lower-cost model for the story text
+    no_illustration  ...and no Titan illustration
+    no_narration     ...and no Polly narration (text only)
+    cached_only      new stories reuse a recent opening for the theme; no model call when one exists
+"""
+
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from config import Config
+from metrics import DEGRADATION_TIER, DEGRADATION_TIER_SECONDS, DEGRADATION_CHANGES, add_stage_listener, age_bucket
+
+TIERS = ("full", "lite_model", "no_illustration", "no_narration", "cached_only")
+FULL, LITE_MODEL, NO_ILLUSTRATION, NO_NARRATION, CACHED_ONLY = range(len(TIERS))
+
+# Stage latency samples older than this no longer say anything about current load (seconds)
+STALE_AFTER = 30.0
+# Recent openings kept per theme and age group for the cached_only tier
+OPENINGS_PER_KEY = 8
+OPENING_KEYS = 256
+
+
+class DegradationLadder:
+    """Chooses the page tier for one worker from provider load"""
+
+    def __init__(self, max_llm_in_flight: int, latency_targets: Dict[str, float],
+                 high: float = 1.0, low: float = 0.6, hold_seconds: float = 15.0, step_seconds: float = 2.0,
+                 enabled: bool = True):
+        self.enabled = enabled
+        self.max_llm_in_flight = max_llm_in_flight
+        self.latency_targets = latency_targets
+        self.high = high
+        self.low = low
+        self.hold_seconds = hold_seconds
+        self.step_seconds = step_seconds
+        self.level = FULL
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._latency = {}  # stage -> (smoothed seconds, last sample time)
+        self._changed_at = time.monotonic()
+        self._calm_since = None
+        self._accounted_at = time.monotonic()
+        self._openings = OrderedDict()  # (theme, age bucket) -> deque of results
+        DEGRADATION_TIER.inc(amount=0)
+
+    # Inputs
+    def on_stage(self, stage: str, elapsed: Optional[float]):
+        """metrics.observe_stage listener: elapsed is None when a call starts"""
+        with self._lock:
+            if elapsed is None:
+                self._in_flight[stage] = self._in_flight.get(stage, 0) + 1
+                return
+            self._in_flight[stage] = self._in_flight.get(stage, 0) - 1
+        self.observe(stage, elapsed)
+
+    def observe(self, stage: str, seconds: float):
+        """Add a latency sample for a stage (or "queue" for admission wait)"""
+        with self._lock:
+            previous = self._latency.get(stage)
+            smoothed = seconds if previous is None else 0.8 * previous[0] + 0.2 * seconds
+            self._latency[stage] = (smoothed, time.monotonic())
+
+    def pressure(self) -> float:
+        """Worst of in-flight and latency ratios; 1.0 means at the limit"""
+        now = time.monotonic()
+        with self._lock:
+            ratios = [self._in_flight.get("llm", 0) / max(self.max_llm_in_flight, 1)]
+            for stage, target in self.latency_targets.items():
+                sample = self._latency.get(stage)
+                if sample is not None and now - sample[1] < STALE_AFTER:
+                    ratios.append(sample[0] / target)
+        return max(ratios)
+
+    # Tier selection
+    def tier(self) -> int:
+        """Current tier, re-evaluated with hysteresis (always full when disabled)"""
+        if not self.enabled:
+            return FULL
+        now = time.monotonic()
+        pressure = self.pressure()
+        with self._lock:
+            DEGRADATION_TIER_SECONDS.inc(TIERS[self.level], amount=now - self._accounted_at)
+            self._accounted_at = now
+
+            if pressure >= self.high:
+                self._calm_since = None
+                if self.level < CACHED_ONLY and now - self._changed_at >= self.step_seconds:
+                    self._move(self.level + 1, now, pressure)
+            elif pressure <= self.low:
+                if self._calm_since is None:
+                    self._calm_since = now
+                if self.level > FULL and now - max(self._calm_since, self._changed_at) >= self.hold_seconds:
+                    self._move(self.level - 1, now, pressure)
+            else:
+                self._calm_since = None
+            return self.level
+
+    def _move(self, level: int, now: float, pressure: float):
+        direction = "down" if level > self.level else "up"
+        print(f"🎚️ Page quality {direction}: {TIERS[self.level]} -> {TIERS[level]} (pressure {pressure:.2f})")
+        DEGRADATION_CHANGES.inc(direction)
+        DEGRADATION_TIER.inc(amount=level - self.level)
+        self.level = level
+        self._changed_at = now
+
+    # What each tier means
+    @staticmethod
+    def model_for(level: int) -> Optional[str]:
+        """Bedrock model for the story text (None = the default model)"""
+        return Config.BEDROCK_LITE_MODEL_ID if level >= LITE_MODEL else None
+
+    @staticmethod
+    def skipped_stages(level: int) -> List[str]:
+        skipped = []
+        if level >= NO_ILLUSTRATION:
+            skipped.append("illustration")
+        if level >= NO_NARRATION:
+            skipped.append("narration")
+        return skipped
+
+    # Warm openings for cached_only
+    def remember_opening(self, theme: str, age: Optional[int], result: Dict):
+        if not self.enabled:
+            return
+        key = (theme.strip().lower(), age_bucket(age))
+        with self._lock:
+            openings = self._openings.get(key)
+            if openings is None:
+                openings = self._openings[key] = deque(maxlen=OPENINGS_PER_KEY)
+                if len(self._openings) > OPENING_KEYS:
+                    self._openings.popitem(last=False)
+            else:
+                self._openings.move_to_end(key)
+            openings.append(dict(result))
+
+    def cached_opening(self, theme: str, age: Optional[int]) -> Optional[Dict]:
+        """A recent opening for this theme and age group, rotating through those kept"""
+        key = (theme.strip().lower(), age_bucket(age))
+        with self._lock:
+            openings = self._openings.get(key)
+            if not openings:
+                return None
+            openings.rotate(-1)
+            return dict(openings[0])
+
+
+_ladder = None
+_ladder_lock = threading.Lock()
+
+
+def get_ladder() -> DegradationLadder:
+    global _ladder
+    if _ladder is None:
+        with _ladder_lock:
+            if _ladder is None:
+                _ladder = DegradationLadder(
+                    Config.DEGRADE_MAX_LLM_IN_FLIGHT,
+                    {
+                        'llm': Config.DEGRADE_LLM_TARGET,
+                        'titan': Config.DEGRADE_TITAN_TARGET,
+                        'polly': Config.DEGRADE_POLLY_TARGET,
+                        'queue': Config.DEGRADE_QUEUE_TARGET
+                    },
+                    high=Config.DEGRADE_HIGH,
+                    low=Config.DEGRADE_LOW,
+                    hold_seconds=Config.DEGRADE_HOLD_SECONDS,
+                    enabled=Config.DEGRADATION_ENABLED
+                )
+                if _ladder.enabled:
+                    add_stage_listener(_ladder.on_stage)
+    return _ladder
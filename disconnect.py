@@ -0,0 +1,188 @@
+# disconnect.py
+"""
+Stop provider work for readers who have gone away
+When a client disconnects from a story or location request (the tab was
+closed, or the reader tapped back), the request's handler is cancelled:
+- queued requests leave the admission queue
+- provider calls waiting for a worker thread are dropped from the pool's queue
+  (deadlines.run_in_thread)
+- provider calls that haven't started yet are skipped (a stage guard in
+  metrics.observe_stage), and Polly audio streams stop being read
+- calls already running in a thread are abandoned; their result is dropped
+
+A request that other requests are waiting on (a retry attached to it through
+its Idempotency-Key) keeps running and is only cancelled once those waiters
+have gone too.
+
+Cancelled work is counted in bridgetales_cancelled_work_total, and the
+estimated time that wasn't spent (the typical duration of each skipped or
+dropped call) in bridgetales_reclaimed_seconds_total.
+"""
+
+import asyncio
+import threading
+import contextvars
+from typing import Optional
+
+from deadlines import budget_for
+from metrics import CLIENT_DISCONNECTS, CANCELLED_WORK, RECLAIMED_SECONDS, add_stage_guard, add_stage_listener
+
+_request = contextvars.ContextVar("disconnect_request", default=None)
+
+# Smoothed latency per stage, to estimate what a skipped call would have cost (seconds)
+_typical = {}
+
+
+class RequestCancelled(asyncio.CancelledError):
+    """The client went away; raised where provider work would have started"""
+
+
+class RequestState:
+    """Disconnect tracking for one request"""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.task = None
+        self.response_done = False
+        self.client_gone = False
+        self.cancelled = False
+        self.waiters = 0  # other requests waiting on this one's response
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def attach(self):
+        """Another request waits on this one's response, so keep it running"""
+        self.waiters += 1
+
+    def detach(self):
+        self.waiters -= 1
+        if self.client_gone and not self.waiters:
+            self._cancel()
+
+    def client_left(self):
+        if self.response_done or self.task is None or self.task.done():
+            return
+        self.client_gone = True
+        if self.waiters:
+            CLIENT_DISCONNECTS.inc(self.route, "shared")
+            return
+        self._cancel()
+
+    def _cancel(self):
+        if self.cancelled or self.task.done():
+            return
+        self.cancelled = True
+        CLIENT_DISCONNECTS.inc(self.route, "cancelled")
+        with self._lock:
+            running = dict(self._in_flight)
+        for stage, count in running.items():
+            if count > 0:
+                CANCELLED_WORK.inc(stage, "abandoned", amount=count)
+        self.task.cancel()
+
+    def stage_started(self, stage: str, started: bool):
+        with self._lock:
+            self._in_flight[stage] = self._in_flight.get(stage, 0) + (1 if started else -1)
+
+
+def current() -> Optional[RequestState]:
+    return _request.get()
+
+
+def cancelled() -> bool:
+    """Whether the current request was cancelled because its client went away"""
+    state = _request.get()
+    return state is not None and state.cancelled
+
+
+def _guard(stage: str):
+    """metrics stage guard: don't start provider calls for a cancelled request"""
+    if cancelled():
+        CANCELLED_WORK.inc(stage, "skipped")
+        RECLAIMED_SECONDS.inc(stage, amount=_typical.get(stage, 0.0))
+        raise RequestCancelled(f"{stage} skipped, the client disconnected")
+
+
+def _on_stage(stage: str, elapsed: Optional[float]):
+    state = _request.get()
+    if state is not None:
+        state.stage_started(stage, elapsed is None)
+    if elapsed is not None:
+        previous = _typical.get(stage)
+        _typical[stage] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+
+
+add_stage_guard(_guard)
+add_stage_listener(_on_stage)
+
+
+def read_stream(stream, chunk_size: int = 64 << 10) -> bytes:
+    """Read a provider response stream, stopping early if the client goes away"""
+    chunks = []
+    while True:
+        if cancelled():
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+            raise RequestCancelled("Stream abandoned, the client disconnected")
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+class DisconnectMiddleware:
+    """ASGI middleware cancelling a provider-backed request when its client disconnects"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or budget_for(scope["path"]) is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = RequestState(scope["path"] if not scope["path"].startswith("/location/") else "/location")
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                state.response_done = True
+            await send(message)
+
+        # One reader of the client's messages, so a disconnect is seen while the handler runs
+        messages = asyncio.Queue()
+
+        async def pump():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    state.client_left()
+                    return
+
+        token = _request.set(state)
+        try:
+            # The handler task copies this context, so everything it starts sees the state
+            state.task = asyncio.ensure_future(self.app(scope, messages.get, send_wrapper))
+        finally:
+            _request.reset(token)
+        reader = asyncio.ensure_future(pump())
+        try:
+            await asyncio.wait({state.task})
+        finally:
+            reader.cancel()
+            if not state.task.done():
+                state.task.cancel()
+
+        if state.task.cancelled() and state.cancelled:
+            print(f"🔌 Client left {scope['path']}, provider work cancelled")
+            if not started:
+                # Nobody reads this; it lets metrics and traces record the request as 499
+                await send({"type": "http.response.start", "status": 499, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+            return
+        state.task.result()
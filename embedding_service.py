@@ -0,0 +1,81 @@
+# embedding_service.py
+"""
+CPU-only text embeddings for books, profiles and prompts
+Uses a signed hashing vectorizer over word unigrams and bigrams, so there is
+no model download, no vocabulary to fit and results are stable across
+processes and restarts
+"""
+
+import re
+import zlib
+import numpy as np
+from typing import List, Dict
+
+# Matches the Pinecone index dimension
+EMBEDDING_DIM = 384
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+# Common words that would otherwise dominate short summaries
+_STOP_WORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i in is it its "
+    "of on or she so that the their then there they this to was were with you".split()
+)
+
+
+def _features(text: str) -> List[str]:
+    tokens = [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOP_WORDS]
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def embed_texts(texts: List[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Encode a batch of texts
+
+    Args:
+        texts: Texts to encode
+        dim: Output dimension
+
+    Returns:
+        (len(texts), dim) float32 array of L2-normalised vectors
+        (all-zero rows for texts without any usable words)
+    """
+    rows, cols, signs = [], [], []
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            rows.append(row)
+            cols.append(h % dim)
+            # Use a high bit for the sign so collisions tend to cancel out
+            signs.append(1.0 if h & 0x80000000 else -1.0)
+
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    if rows:
+        np.add.at(matrix, (np.asarray(rows), np.asarray(cols)), np.asarray(signs, dtype=np.float32))
+        # Sublinear term frequency keeps repeated words from swamping the vector
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def embed_text(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Encode a single text"""
+    return embed_texts([text], dim)[0]
+
+
+def book_text(book_data: Dict) -> str:
+    """Text that represents a book: theme (weighted) plus its page stories"""
+    theme = book_data.get('theme', '')
+    pages = book_data.get('pages', [])
+    stories = " ".join(
+        page.get('story', '')[:600] if isinstance(page, dict) else str(page)[:600]
+        for page in pages
+    )
+    return f"{theme}. {theme}. {theme}. {stories}"
+
+
+def profile_text(profile_data: Dict) -> str:
+    """Text that represents a reader profile"""
+    return f"reader {profile_data.get('name', '')} age {profile_data.get('age', '')} voice {profile_data.get('voice', '')}"
@@ -9,6 +9,7 @@ let currentPageIndex = 0; // Current page being viewed
 let userLocation = null; // Store user's location
 let currentLocation = ""; // Current story location for payment
 let userProfile = null; // User profile data
+let storyId = null; // Random ID of the story being read, for idempotency keys
 
 // Auth Management
 function updateAuthUI() {
@@ -156,6 +157,7 @@ async function generateStory() {
     // Reset story pages for new story
     storyPages = [];
     currentPageIndex = 0;
+    storyId = randomId();
 
     // Hide previous content
     hideError();
@@ -168,16 +170,19 @@ async function generateStory() {
         // Get voice preference and age if user has a profile
         const voiceParam = userProfile ? `&voice=${userProfile.voice}` : '';
         const ageParam = userProfile ? `&age=${userProfile.age}` : '';
+        // Send location if we have it so the server can prefetch related businesses
+        const locationParam = userLocation ? `&latitude=${userLocation.latitude}&longitude=${userLocation.longitude}` : '';
         
-        // Call the API
-        const response = await fetch(`${API_BASE_URL}/story/generate?theme=${encodeURIComponent(theme)}${voiceParam}${ageParam}`);
+        // Call the API; narration starts playing while the story is still being written
+        stopNarration();
+        const response = await fetch(`${API_BASE_URL}/story/generate/stream?theme=${encodeURIComponent(theme)}${voiceParam}${ageParam}${locationParam}`);
         
         if (!response.ok) {
             const errorData = await response.json();
             throw new Error(errorData.detail || 'Failed to generate story');
         }
 
-        const data = await response.json();
+        const data = await readPageStream(response);
         currentStoryData = data;
         currentLocation = data.location || "this location";
         
@@ -187,7 +192,8 @@ async function generateStory() {
             images: data.images || [],
             choices: data.choices || [],
             theme: data.theme,
-            location: data.location || ""
+            location: data.location || "",
+            usage: data.usage || null
         });
         
         currentPageIndex = storyPages.length - 1;
@@ -203,8 +209,99 @@ async function generateStory() {
     }
 }
 
+// Narration segments of the page being written, played one after another as they arrive
+let narrationQueue = [];
+
+function playNextSegment() {
+    if (currentAudio || narrationQueue.length === 0) return;
+    currentAudio = new Audio(narrationQueue.shift());
+    currentAudio.addEventListener('ended', () => {
+        currentAudio = null;
+        playNextSegment();
+    });
+    currentAudio.play().catch(() => {
+        currentAudio = null;
+    });
+}
+
+function stopNarration() {
+    narrationQueue = [];
+    if (currentAudio) {
+        currentAudio.pause();
+        currentAudio = null;
+    }
+}
+
+// Read a pipelined page (JSON lines): play each narration segment when it's ready, return the page
+async function readPageStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let page = null;
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (!line) continue;
+            
+            const event = JSON.parse(line);
+            if (event.type === 'audio' && event.voice_file) {
+                narrationQueue.push(`${API_BASE_URL}/${event.voice_file}`);
+                playNextSegment();
+            } else if (event.type === 'page') {
+                page = event.page;
+            } else if (event.type === 'error') {
+                throw new Error(event.detail);
+            }
+        }
+    }
+    
+    if (!page) {
+        throw new Error('The story stopped before the page was finished');
+    }
+    return page;
+}
+
+function randomId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Short ASCII hash (FNV-1a), so any choice text fits in a header
+function hashText(text) {
+    let hash = 0x811c9dc5;
+    for (let i = 0; i < text.length; i++) {
+        hash ^= text.charCodeAt(i);
+        hash = Math.imul(hash, 0x01000193);
+    }
+    return (hash >>> 0).toString(36);
+}
+
+// Same key for the same page of the same story, so a double tap or a retry
+// gets the page already being written instead of writing it twice
+function pageIdempotencyKey(pageIndex, choiceText, isEnding) {
+    return `${storyId}-${pageIndex}-${isEnding ? 'end' : hashText(choiceText)}`;
+}
+
+// Page requests in flight by idempotency key
+const pendingPages = new Map();
+
 // Continue story with chosen option
 async function continueStory(choiceText, isEnding = false) {
+    const pageIndex = storyPages.length + 1;
+    const key = pageIdempotencyKey(pageIndex, choiceText, isEnding);
+    // A second tap on the same choice waits for the first instead of asking again
+    if (pendingPages.has(key)) return;
+    pendingPages.set(key, true);
+
     // Show loading state
     showLoading();
     hideStory();
@@ -214,10 +311,12 @@ async function continueStory(choiceText, isEnding = false) {
         const storyContext = storyPages.map(p => p.story).join('\n\n');
         
         // Call the continue API
-        const response = await fetch(`${API_BASE_URL}/story/continue`, {
+        stopNarration();
+        const request = {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Idempotency-Key': key
             },
             body: JSON.stringify({
                 theme: currentStoryData.theme,
@@ -225,16 +324,26 @@ async function continueStory(choiceText, isEnding = false) {
                 story_context: storyContext,
                 is_ending: isEnding,
                 voice: userProfile ? userProfile.voice : 'Ivy',
-                age: userProfile ? userProfile.age : null
+                age: userProfile ? userProfile.age : null,
+                latitude: userLocation ? userLocation.latitude : null,
+                longitude: userLocation ? userLocation.longitude : null,
+                page_index: pageIndex
             })
-        });
+        };
+        let response;
+        try {
+            response = await fetch(`${API_BASE_URL}/story/continue/stream`, request);
+        } catch (networkError) {
+            // Retried once with the same key: if the first attempt reached the server, we get its page
+            response = await fetch(`${API_BASE_URL}/story/continue/stream`, request);
+        }
         
         if (!response.ok) {
             const errorData = await response.json();
             throw new Error(errorData.detail || 'Failed to continue story');
         }
 
-        const data = await response.json();
+        const data = await readPageStream(response);
         currentStoryData = data;
         currentLocation = data.location || currentLocation;
         
@@ -244,7 +353,8 @@ async function continueStory(choiceText, isEnding = false) {
             images: data.images || [],
             choices: data.choices || [],
             theme: data.theme,
-            location: data.location || ""
+            location: data.location || "",
+            usage: data.usage || null
         });
         
         currentPageIndex = storyPages.length - 1;
@@ -262,6 +372,8 @@ async function continueStory(choiceText, isEnding = false) {
         hideLoading();
         showError(`Error: ${error.message}. Please try again.`);
         console.error('Error continuing story:', error);
+    } finally {
+        pendingPages.delete(key);
     }
 }
 
@@ -292,7 +404,7 @@ async function saveFinishedBook() {
     try {
         await fetch(`${API_BASE_URL}/api/save-book`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': `book-${book.id}` },
             body: JSON.stringify(book)
         });
     } catch (error) {
@@ -371,6 +483,7 @@ function displayCurrentPage() {
 function previousPage() {
     if (currentPageIndex > 0) {
         // Stop current audio
+        stopNarration();
         const audioElement = document.getElementById('audioElement');
         if (audioElement) {
             audioElement.pause();
@@ -386,6 +499,7 @@ function previousPage() {
 function nextPage() {
     if (currentPageIndex < storyPages.length - 1) {
         // Stop current audio
+        stopNarration();
         const audioElement = document.getElementById('audioElement');
         if (audioElement) {
             audioElement.pause();
@@ -847,6 +961,8 @@ function toggleAudio() {
     const playIcon = document.getElementById('playIcon');
 
     if (audioElement.paused) {
+        // The player has the whole page; stop the segments still playing from the stream
+        stopNarration();
         audioElement.play();
         playIcon.textContent = '⏸';
     } else {
@@ -1077,6 +1193,12 @@ async function findNearbyBusinesses(contextType = 'general') {
     locationBtn.disabled = true;
 
     try {
+        // Businesses prefetched by the server with this page - no extra round trip
+        if (currentStoryData.businesses && currentStoryData.businesses.length > 0) {
+            displayBusinesses(currentStoryData.businesses);
+            return;
+        }
+
         // Get story context from all pages
         const storyContext = storyPages.map(p => p.story).join('\n\n');
         
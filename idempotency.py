@@ -0,0 +1,297 @@
+# idempotency.py
+"""
+Idempotency-Key support for the page-writing POSTs
+A client that retries /story/continue or /api/save-book with the same
+Idempotency-Key gets the original response back instead of a new Bedrock,
+Polly and Titan run (and possibly a different story). A retry that arrives
+while the original is still running waits for it and gets its response.
+
+Responses are kept for IDEMPOTENCY_TTL seconds in a bounded in-process store
+(oldest first out past IDEMPOTENCY_MAX_ENTRIES). With a shared STATE_BACKEND
+they are also written to shared state, and a key being served by another
+worker is waited on there, so a retry can land on any worker.
+
+Server errors (5xx), responses cut short (a stream whose client left) and
+responses the handler marked as failed after sending a 200 (a page stream
+ending in an error line sets request.state.page_failed) aren't kept, so the
+client may retry them. Reusing a key with a different
+request body is rejected with 422.
+"""
+
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import Config
+import disconnect
+from deadlines import remaining
+from metrics import IDEMPOTENCY_REQUESTS
+from shared_state import get_state, get_json, set_json
+
+ROUTES = {
+    ("POST", "/story/continue"): "continue",
+    ("POST", "/story/continue/stream"): "continue",
+    ("POST", "/api/save-book"): "save-book"
+}
+
+MAX_KEY_LENGTH = 255
+# How often a worker checks shared state for a response another worker is writing (seconds)
+POLL_INTERVAL = 0.2
+# Response headers worth replaying; content-length is recomputed
+REPLAY_HEADERS = (b"content-type",)
+
+
+def _failed(scope) -> bool:
+    """The handler set request.state.page_failed (Request.state lives in scope["state"])"""
+    return bool((scope.get("state") or {}).get("page_failed"))
+
+
+class StoredResponse:
+    __slots__ = ("status", "headers", "body", "fingerprint", "expires_at")
+
+    def __init__(self, status: int, headers, body: bytes, fingerprint: str, expires_at: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+
+    def to_dict(self) -> Dict:
+        return {
+            'status': self.status,
+            'headers': [[k.decode("latin-1"), v.decode("latin-1")] for k, v in self.headers],
+            'body': base64.b64encode(self.body).decode("ascii"),
+            'fingerprint': self.fingerprint,
+            'expires_at': self.expires_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "StoredResponse":
+        return cls(
+            data['status'],
+            [(k.encode("latin-1"), v.encode("latin-1")) for k, v in data['headers']],
+            base64.b64decode(data['body']),
+            data['fingerprint'],
+            data['expires_at']
+        )
+
+
+class IdempotencyStore:
+    """Completed responses by key, bounded by count and expiring after a TTL"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            stored = self._responses.get(key)
+            if stored is not None and stored.expires_at <= time.time():
+                del self._responses[key]
+                return None
+            return stored
+
+    def put(self, key: str, stored: StoredResponse):
+        with self._lock:
+            self._responses[key] = stored
+            self._responses.move_to_end(key)
+            now = time.time()
+            # Entries are added in expiry order, so expired ones are at the front
+            while self._responses:
+                oldest = next(iter(self._responses.values()))
+                if len(self._responses) <= self.max_entries and oldest.expires_at > now:
+                    break
+                self._responses.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware replaying, or attaching to, requests with a repeated Idempotency-Key"""
+
+    def __init__(self, app):
+        self.app = app
+        self.store = IdempotencyStore(Config.IDEMPOTENCY_MAX_ENTRIES, Config.IDEMPOTENCY_TTL)
+        # key -> (future resolved with the StoredResponse, disconnect state) of the request running it
+        self.in_flight = {}
+        self.shared = Config.STATE_BACKEND.lower() != "memory"
+
+    async def __call__(self, scope, receive, send):
+        route = ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        raw_key = dict(scope.get("headers") or []).get(b"idempotency-key") if route else None
+        if not raw_key:
+            await self.app(scope, receive, send)
+            return
+        if len(raw_key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, {'detail': f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"})
+            return
+
+        body = await _read_body(receive)
+        if body is None:
+            return  # client went away
+        key = f"{scope['path']}:{raw_key.decode('latin-1')}"
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        stored = self.store.get(key)
+        if stored is None and self.shared:
+            stored = await self._shared_response(key)
+        if stored is not None:
+            await self._replay(route, stored, fingerprint, send, "replayed")
+            return
+
+        running = self.in_flight.get(key)
+        if running is not None:
+            future, original = running
+            # The original keeps running for us even if its own client leaves
+            if original is not None:
+                original.attach()
+            try:
+                stored = await asyncio.wait_for(asyncio.shield(future), remaining())
+            except asyncio.TimeoutError:
+                IDEMPOTENCY_REQUESTS.inc(route, "timeout")
+                await _send_json(send, 504, {'detail': "The original request is still running, please try again"})
+                return
+            finally:
+                if original is not None:
+                    original.detach()
+            await self._replay(route, stored, fingerprint, send, "attached")
+            return
+
+        if self.shared and not await self._claim(key, fingerprint):
+            stored = await self._wait_for_other_worker(key)
+            if stored is None:
+                IDEMPOTENCY_REQUESTS.inc(route, "conflict")
+                await _send_json(send, 409, {'detail': "A request with this Idempotency-Key is still running"},
+                                 [(b"retry-after", b"1")])
+                return
+            await self._replay(route, stored, fingerprint, send, "attached")
+            return
+
+        IDEMPOTENCY_REQUESTS.inc(route, "new")
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = (future, disconnect.current())
+        status = [500]
+        headers = []
+        chunks = []
+        complete = False
+        client_gone = False
+
+        async def capture(message):
+            nonlocal client_gone, complete
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers.extend((k, v) for k, v in message.get("headers") or [] if k.lower() in REPLAY_HEADERS)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                complete = not message.get("more_body")
+            if client_gone:
+                return
+            try:
+                await send(message)
+            except OSError:
+                # The client gave up (and will likely retry); keep the response for the retry
+                client_gone = True
+
+        try:
+            await self.app(scope, _replay_body(body, receive), capture)
+        finally:
+            if not complete:
+                status[0], chunks = max(status[0], 500), []
+            stored = StoredResponse(status[0], headers, b"".join(chunks), fingerprint, time.time() + self.store.ttl)
+            keep = stored.status < 500 and not _failed(scope)
+            del self.in_flight[key]
+            future.set_result(stored)
+            if keep:
+                self.store.put(key, stored)
+            if self.shared:
+                await self._publish(key, stored, keep)
+
+    async def _replay(self, route: str, stored: StoredResponse, fingerprint: str, send, outcome: str):
+        if stored.fingerprint != fingerprint:
+            IDEMPOTENCY_REQUESTS.inc(route, "mismatch")
+            await _send_json(send, 422, {'detail': "Idempotency-Key was already used with a different request"})
+            return
+        IDEMPOTENCY_REQUESTS.inc(route, outcome)
+        headers = list(stored.headers) + [
+            (b"content-length", str(len(stored.body)).encode()),
+            (b"idempotent-replayed", b"true")
+        ]
+        await send({"type": "http.response.start", "status": stored.status, "headers": headers})
+        await send({"type": "http.response.body", "body": stored.body})
+
+    # Shared state, so retries can land on any worker
+    async def _shared_response(self, key: str) -> Optional[StoredResponse]:
+        data = await asyncio.to_thread(get_json, f"idempotency:response:{key}")
+        return StoredResponse.from_dict(data) if data else None
+
+    async def _claim(self, key: str, fingerprint: str) -> bool:
+        try:
+            return await asyncio.to_thread(
+                get_state().set_if_absent, f"idempotency:claim:{key}", fingerprint, Config.DEADLINE_MAX
+            )
+        except Exception as e:
+            print(f"⚠️ Idempotency claim failed, running the request anyway: {e}")
+            return True
+
+    async def _wait_for_other_worker(self, key: str) -> Optional[StoredResponse]:
+        left = remaining()
+        give_up = time.monotonic() + (Config.DEADLINE_MAX if left is None else max(left, 0.0))
+        while time.monotonic() < give_up:
+            await asyncio.sleep(POLL_INTERVAL)
+            stored = await self._shared_response(key)
+            if stored is not None:
+                return stored
+        return None
+
+    async def _publish(self, key: str, stored: StoredResponse, keep: bool):
+        def write():
+            if keep:
+                set_json(f"idempotency:response:{key}", stored.to_dict(), ttl=self.store.ttl)
+            try:
+                get_state().delete(f"idempotency:claim:{key}")
+            except Exception as e:
+                print(f"⚠️ Idempotency claim release failed for {key}: {e}")
+        await asyncio.to_thread(write)
+
+
+async def _read_body(receive) -> Optional[bytes]:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _replay_body(body: bytes, receive):
+    """receive() for the app: the buffered body, then whatever the client sends next"""
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+async def _send_json(send, status: int, payload: Dict, extra_headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + list(extra_headers)
+    })
+    await send({"type": "http.response.body", "body": body})
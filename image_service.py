@@ -1,25 +1,169 @@
-from dotenv import load_dotenv
 import os
-import boto3
 import json
 import base64
+import shutil
+import threading
+from typing import Dict, List, Optional, Tuple
 
-# 👇 Add this line at the top of image_service.py
-load_dotenv()
+from config import Config
+from clients import get_aws_client
+from embedding_service import embed_text
+from metrics import (
+    observe_stage, current_age, age_bucket,
+    ILLUSTRATION_CACHE_LOOKUPS, ILLUSTRATION_CACHE_SIMILARITY, ILLUSTRATION_CACHE_ENTRIES
+)
+from tracing import span
+from media_store import media_path, seed_for, new_media_id
+from vector_store import BoundedVectorIndex
 
-def generate_images(prompt: str, page_number: int = 0):
-    """Generate images using Amazon Titan Image Generator
+PROMPT_PREFIX = "Children's storybook illustration based on this story: "
+
+
+class IllustrationCache:
+    """
+    Reuses illustrations drawn for near-identical prompts
+
+    Prompts are embedded locally (embedding_service) into a fixed-size
+    in-memory index, so a lookup costs no provider call. A prompt close enough
+    to a cached one, for the reader's age group, gets a copy of its picture.
+    With VARIANTS > 1 the first few close prompts are still drawn (with their
+    own seed) and kept alongside, and later ones pick among them by page seed.
+    """
+
+    def __init__(self, capacity: int, dim: int, threshold: float, thresholds: str = "", variants: int = 1):
+        self.index = BoundedVectorIndex(capacity, dim=dim, ivf_threshold=min(10000, capacity))
+        self.threshold = threshold
+        self.thresholds = _parse_thresholds(thresholds)
+        self.variants = max(1, variants)
+        self._lock = threading.Lock()  # guards the variant lists in entry metadata
+
+    def threshold_for(self, bucket: str) -> float:
+        return self.thresholds.get(bucket, self.threshold)
+
+    def lookup(self, prompt: str, page_id: str) -> Tuple[Optional[List[str]], Optional[Dict]]:
+        """
+        Cached illustration for this prompt, copied to the page's own file
+
+        Returns (images, None) on a hit, or (None, key) when the caller should
+        draw it and hand the key to add()
+        """
+        bucket = age_bucket(current_age.get())
+        vector = embed_text(_prompt_text(prompt), self.index.dim)
+        key = {'vector': vector, 'age_bucket': bucket, 'entry': None}
+        if not vector.any():
+            ILLUSTRATION_CACHE_LOOKUPS.inc(bucket, "miss")
+            return None, key
+
+        found = self.index.search(vector, k=1, where=lambda m: m['age_bucket'] == bucket)
+        if not found:
+            ILLUSTRATION_CACHE_LOOKUPS.inc(bucket, "miss")
+            return None, key
+        best = found[0]
+        ILLUSTRATION_CACHE_SIMILARITY.observe(best['score'], bucket)
+        if best['score'] < self.threshold_for(bucket):
+            ILLUSTRATION_CACHE_LOOKUPS.inc(bucket, "miss")
+            return None, key
+
+        key['entry'] = best['id']
+        with self._lock:
+            variants = best['metadata']['variants']
+            if len(variants) < self.variants:
+                ILLUSTRATION_CACHE_LOOKUPS.inc(bucket, "variant")
+                return None, key
+            source = variants[seed_for(page_id) % len(variants)]
+
+        target = media_path("illustration", page_id, "png")
+        try:
+            shutil.copyfile(source, target)
+        except OSError:
+            # Pruned from MEDIA_DIR since it was cached; draw it again
+            with self._lock:
+                if source in variants:
+                    variants.remove(source)
+            ILLUSTRATION_CACHE_LOOKUPS.inc(bucket, "stale")
+            return None, key
+
+        with self._lock:
+            # The fresh copy outlives the original under MEDIA_RETENTION_HOURS
+            if source in variants:
+                variants[variants.index(source)] = target
+        ILLUSTRATION_CACHE_LOOKUPS.inc(bucket, "hit")
+        print(f"♻️ Reused a cached illustration for page {page_id} (similarity {best['score']:.2f})")
+        return [target], None
+
+    def add(self, key: Dict, path: str):
+        """Cache a freshly drawn illustration under the key from lookup()"""
+        with self._lock:
+            entry = self.index.get(key['entry']) if key['entry'] else None
+            if entry is not None:
+                variants = entry[1]['variants']
+                if len(variants) < self.variants:
+                    variants.append(path)
+                return
+        evicted = self.index.upsert_batch(
+            [new_media_id()], key['vector'][None, :], [{'age_bucket': key['age_bucket'], 'variants': [path]}]
+        )
+        ILLUSTRATION_CACHE_ENTRIES.inc(amount=1 - len(evicted))
+
+
+def _prompt_text(prompt: str) -> str:
+    # The shared prefix would only make every prompt look alike
+    return prompt[len(PROMPT_PREFIX):] if prompt.startswith(PROMPT_PREFIX) else prompt
+
+
+def _parse_thresholds(spec: str) -> Dict[str, float]:
+    """"3-5:0.85,6-8:0.88" -> {'3-5': 0.85, '6-8': 0.88}"""
+    thresholds = {}
+    for part in spec.split(","):
+        bucket, _, value = part.strip().partition(":")
+        if bucket and value:
+            thresholds[bucket.strip()] = float(value)
+    return thresholds
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_illustration_cache() -> IllustrationCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = IllustrationCache(
+                    Config.ILLUSTRATION_CACHE_MAX_ENTRIES,
+                    Config.ILLUSTRATION_CACHE_DIM,
+                    Config.ILLUSTRATION_CACHE_THRESHOLD,
+                    Config.ILLUSTRATION_CACHE_THRESHOLDS,
+                    Config.ILLUSTRATION_CACHE_VARIANTS
+                )
+    return _cache
+
+
+def generate_images(prompt: str, page_id: str, use_cache: bool = True):
+    """Generate images using Amazon Titan Image Generator, or reuse a cached one (ILLUSTRATION_CACHE_ENABLED)
     
     Args:
         prompt: Text description for the image
-        page_number: Unique identifier for this story page
+        page_id: Unique identifier for this story page (see media_store.new_media_id)
+        use_cache: False for callers that move the file out of MEDIA_DIR
+            (a cached path must stay where it was written)
     """
+    key = None
+    if use_cache and Config.ILLUSTRATION_CACHE_ENABLED:
+        cached, key = get_illustration_cache().lookup(prompt, page_id)
+        if cached:
+            return cached
+    images = _draw(prompt, page_id)
+    if key is not None and images:
+        get_illustration_cache().add(key, images[0])
+    return images
+
+
+def _draw(prompt: str, page_id: str):
     try:
-        print(f"🎨 Generating image for page {page_number} with Amazon Titan...")
-        client = boto3.client(
-            "bedrock-runtime",
-            region_name=os.getenv("AWS_REGION", "us-east-1")
-        )
+        print(f"🎨 Generating image for page {page_id} with Amazon Titan...")
+        client = get_aws_client("bedrock-runtime", os.getenv("AWS_REGION", "us-east-1"))
 
         # Titan Image Generator request format
         body = json.dumps({
@@ -33,24 +177,24 @@ def generate_images(prompt: str, page_number: int = 0):
                 "cfgScale": 8.0,
                 "height": 512,
                 "width": 512,
-                "seed": page_number  # Use page number as seed for unique images
+                "seed": seed_for(page_id)  # Derived from the page ID for unique images
             }
         })
 
         # Use Amazon Titan Image Generator
-        response = client.invoke_model(
-            modelId="amazon.titan-image-generator-v1",
-            body=body
-        )
-
-        result = json.loads(response["body"].read())
+        with observe_stage("titan", provider="bedrock", model="amazon.titan-image-generator-v1"):
+            response = client.invoke_model(
+                modelId="amazon.titan-image-generator-v1",
+                body=body
+            )
+            result = json.loads(response["body"].read())
         
         # Titan returns images in base64
         image_base64 = result["images"][0]
 
         # Use unique filename for each page
-        output_path = f"illustration_page_{page_number}.png"
-        with open(output_path, "wb") as f:
+        output_path = media_path("illustration", page_id, "png")
+        with span("media.write", kind="illustration"), open(output_path, "wb") as f:
             f.write(base64.b64decode(image_base64))
 
         print(f"✅ Image saved: {output_path}")
@@ -1,17 +1,33 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Optional, List
 import os
 import json
+import time
 import asyncio
 from datetime import datetime
 from voice_service import generate_voice_with_polly
-from image_service import generate_images
+from image_service import PROMPT_PREFIX, generate_images
+from embedding_service import embed_text, book_text, profile_text
+from vector_store import get_vector_store, similar_books, reader_themes
+from book_store import get_book_store
+from story_tree import get_story_trees
+from media_store import new_media_id, media_path
+from clients import warm_clients
+import metrics
+import tracing
+import deadlines
+import disconnect
+import degradation
+import usage
+import batch
+from deadlines import DeadlineExceeded, run_in_thread
 # Import our story generation service and config
-from services.story_generator import StoryGenerator
+from services.story_generator import StoryGenerator, ending_prompt
 from services.location_service import LocationService
 from config import Config
 
@@ -21,6 +37,18 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Bounded, prioritised queues in front of the page endpoints (see admission.py);
+# added before CORS so 503 responses still carry CORS headers
+if Config.ADMISSION_ENABLED:
+    import admission
+    app.add_middleware(admission.AdmissionMiddleware)
+
+# Retries with a repeated Idempotency-Key get the original response (see idempotency.py);
+# outside admission so replays don't take a slot, inside deadlines so waiting is bounded
+if Config.IDEMPOTENCY_ENABLED:
+    import idempotency
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -30,17 +58,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
+# Per-route time budgets propagated to every provider call (see deadlines.py);
+# outside admission control so queueing time counts against the budget
+app.add_middleware(deadlines.DeadlineMiddleware)
+
+# Cancel provider work for clients that have gone away (see disconnect.py)
+app.add_middleware(disconnect.DisconnectMiddleware)
+
+# Profiling hooks are only installed when enabled, so they cost nothing otherwise
+if Config.PROFILING_ENABLED:
+    import profiling
+    app.add_middleware(profiling.ProfilingMiddleware)
+    app.include_router(profiling.router)
+
+# Request counts and latency per route (see metrics.py)
+if Config.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Request IDs for every request, spans for sampled ones (see tracing.py)
+app.add_middleware(tracing.TracingMiddleware)
+
+# Capture incoming requests alongside provider calls for benchmarks/replay.py
+if Config.CASSETTE_MODE == "record":
+    import cassette
+    app.add_middleware(cassette.CassetteMiddleware)
+
+# Initialize services (provider clients are created lazily, see clients.py)
 story_generator = StoryGenerator()
 location_service = LocationService()
 
-# Track page counter for unique images
-page_counter = 0
+@app.on_event("startup")
+async def warm_provider_clients():
+    """Build provider clients before the first request; a slow or broken provider doesn't block boot"""
+    if Config.STARTUP_WARM_TIMEOUT > 0:
+        await warm_clients(Config.STARTUP_WARM_TIMEOUT, region=story_generator.aws_region)
 
 # Mount static files and frontend
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
 
+# Generated audio and illustrations, one file per page (see media_store)
+os.makedirs(Config.MEDIA_DIR, exist_ok=True)
+app.mount(f"/{Config.MEDIA_DIR}", StaticFiles(directory=Config.MEDIA_DIR), name="media")
+
+# Narration and illustrations of pre-baked story trees (see story_tree.py)
+if Config.STORY_TREES_ENABLED:
+    os.makedirs(f"{Config.STORY_TREE_DIR}/media", exist_ok=True)
+    app.mount(f"/{Config.STORY_TREE_DIR}/media", StaticFiles(directory=f"{Config.STORY_TREE_DIR}/media"), name="story_tree_media")
+
 # Request/Response Models
+class BusinessResponse(BaseModel):
+    name: str
+    address: str
+    phone: Optional[str] = ""
+    website: Optional[str] = ""
+    categories: List[str] = []
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    distance: Optional[float] = None
+    match_score: Optional[float] = None
+
 class StoryResponse(BaseModel):
     theme: str
     story: str
@@ -48,6 +124,10 @@ class StoryResponse(BaseModel):
     images: List[str] = []
     location: str = ""
     choices: List[str] = []
+    businesses: List[BusinessResponse] = []  # Prefetched when the request carries a position
+    dropped_stages: List[str] = []  # Stages left out for the deadline or load, e.g. "illustration"
+    quality: str = "full"  # Page quality tier under load (see degradation.TIERS)
+    usage: Optional[dict] = None  # Tokens and estimated cost of the page's model call (see usage.py)
     
 class ProfileData(BaseModel):
     name: str
@@ -61,11 +141,24 @@ class ContinueRequest(BaseModel):
     is_ending: bool = False  # Flag to generate a happy ending
     voice: str = "Ivy"  # User's voice preference
     age: int = None  # User's age for age-appropriate content
+    latitude: Optional[float] = None  # User's position, to prefetch related businesses
+    longitude: Optional[float] = None
+    page_index: Optional[int] = None  # Number of the page being written (the opening is 1)
+
+class BatchEntry(BaseModel):
+    theme: str
+    age: Optional[int] = None
+    voice: str = "Ivy"
+    child: Optional[str] = None  # Name or ID echoed back with the child's result
+
+class BatchRequest(BaseModel):
+    entries: List[BatchEntry]
 
 class HealthResponse(BaseModel):
     status: str
     timestamp: datetime
     services: dict
+    location_providers: dict = {}
 
 class LocationRequest(BaseModel):
     latitude: float
@@ -78,16 +171,367 @@ class StoryLocationRequest(BaseModel):
     latitude: float
     longitude: float
     max_results: Optional[int] = 5
+    radius: Optional[int] = 5000
 
-class BusinessResponse(BaseModel):
-    name: str
-    address: str
-    phone: Optional[str] = ""
-    website: Optional[str] = ""
-    categories: List[str] = []
-    latitude: Optional[float] = None
-    longitude: Optional[float] = None
-    distance: Optional[float] = None
+class LocationResolveRequest(BaseModel):
+    location: str
+    latitude: float
+    longitude: float
+    radius: Optional[int] = 5000
+
+# Prefetches still running after their page was returned; referenced so they finish
+background_tasks = set()
+
+# The illustration is drawn from the start of the story, so it can begin while the rest is written
+ILLUSTRATION_PROMPT_CHARS = 200
+
+async def _find_page_businesses(
+    story_context: str,
+    location: str,
+    latitude: float,
+    longitude: float,
+    max_results: int = 5
+) -> List[dict]:
+    """Story-related businesses for a page, with the story's own LOCATION matched first"""
+    match, related = await asyncio.gather(
+        location_service.resolve_story_location(location, latitude, longitude),
+        location_service.find_story_related_businesses(
+            story_context, latitude, longitude, max_results=max_results
+        )
+    )
+    businesses = [match] if match else []
+    businesses += [b for b in related if not match or b.get('name') != match.get('name')]
+    return businesses[:max_results]
+
+async def _collect_prefetch(task: Optional[asyncio.Task]) -> List[dict]:
+    """Wait briefly for a business prefetch; leave it running if it isn't ready"""
+    if task is None:
+        return []
+    if not deadlines.start_stage("businesses"):
+        task.cancel()
+        return []
+    try:
+        return await asyncio.wait_for(
+            asyncio.shield(task), timeout=deadlines.timeout(Config.BUSINESS_PREFETCH_TIMEOUT)
+        )
+    except asyncio.TimeoutError:
+        print("⏱️ Business prefetch not ready, returning page without businesses")
+        deadlines.drop_stage("businesses")
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    except Exception as e:
+        print(f"⚠️ Business prefetch failed: {e}")
+    return []
+
+async def _narrate(story_text: str, voice: str, page_id: str) -> str:
+    """Generate voice narration with AWS Polly off the event loop"""
+    if not deadlines.start_stage("narration"):
+        return ""
+    try:
+        result_file = await run_in_thread(
+            generate_voice_with_polly, story_text, voice_id=voice,
+            output_file=media_path("audio", page_id, "mp3")
+        )
+        return result_file or ""
+    except DeadlineExceeded:
+        print("⏱️ Narration didn't finish within the request deadline")
+        deadlines.drop_stage("narration")
+        return ""
+    except Exception as e:
+        print(f"⚠️ Voice generation failed: {e}")
+        return ""
+
+async def _illustrate(story_text: str, page_id: str) -> List[str]:
+    """Generate an illustration with Bedrock Titan (unique per page) off the event loop"""
+    if not deadlines.start_stage("illustration"):
+        return []
+    try:
+        image_prompt = PROMPT_PREFIX + story_text[:ILLUSTRATION_PROMPT_CHARS]
+        return await run_in_thread(generate_images, image_prompt, page_id)
+    except DeadlineExceeded:
+        print("⏱️ Illustration didn't finish within the request deadline")
+        deadlines.drop_stage("illustration")
+        return []
+    except Exception as e:
+        print(f"⚠️ Image generation failed: {e}")
+        return []
+
+async def _skipped(value):
+    return value
+
+async def _write_story(stream, page_id: str, illustrate: bool = True):
+    """
+    Run a StoryGenerator.stream_story() iterator to its result
+    
+    The page's illustration is started from the story's first
+    ILLUSTRATION_PROMPT_CHARS, while the model is still writing the rest.
+    Returns (result, illustration task or None).
+    """
+    illustration = preview = None
+    try:
+        async for kind, value in stream:
+            if kind == "preview" and illustrate:
+                preview = value
+                illustration = asyncio.ensure_future(_illustrate(value, page_id))
+            elif kind == "result":
+                return value, _checked_illustration(illustration, preview, value["story"])
+    except BaseException:
+        if illustration is not None:
+            illustration.cancel()
+        raise
+
+def _checked_illustration(illustration: Optional[asyncio.Task], preview: Optional[str], story_text: str):
+    """
+    The early illustration, or a fresh one if its prompt isn't the final story's start
+    
+    The preview is the raw STORY section as it streamed in; parsing the
+    finished response can still change its first characters (whitespace,
+    a repaired marker). The redraw gets its own media ID, so the cancelled
+    call can't overwrite its file.
+    """
+    if illustration is None or preview == story_text[:ILLUSTRATION_PROMPT_CHARS]:
+        return illustration
+    illustration.cancel()
+    metrics.EARLY_ILLUSTRATION_REDRAWS.inc()
+    print("🎨 Story start changed after parsing; redrawing the illustration from the final text")
+    return asyncio.ensure_future(_illustrate(story_text, new_media_id()))
+
+async def _build_page(
+    theme: str,
+    result: dict,
+    voice: str,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    story_context: str = "",
+    tier: int = degradation.FULL,
+    baked: bool = False,
+    page_id: Optional[str] = None,
+    illustration: Optional[asyncio.Task] = None
+) -> StoryResponse:
+    """
+    Narrate and illustrate a generated page
+    
+    When the user's position is known, the story-related business lookup is
+    started as soon as the story is parsed and runs alongside narration and
+    illustration, so the client doesn't need a second round trip. Stages that
+    don't fit in the request deadline, or that the load tier turns off, are
+    left out and listed in dropped_stages. A baked page (see story_tree.py)
+    reuses its stored media; only narration in another voice is generated.
+    An illustration already started for the page (see _write_story) is
+    awaited instead of drawing another.
+    """
+    story_text = result["story"]
+    location = result.get("location", "")
+    page_id = page_id or new_media_id()
+    
+    prefetch = None
+    if latitude is not None and longitude is not None:
+        business_context = f"{story_context}\n\n{story_text}" if story_context else story_text
+        prefetch = asyncio.create_task(
+            _find_page_businesses(business_context, location, latitude, longitude)
+        )
+    
+    skipped = degradation.DegradationLadder.skipped_stages(tier)
+    voice_file, images = "", []
+    if baked:
+        # Stored media costs nothing to serve, whatever the tier
+        images = result.get("images", [])
+        if result.get("voice") == voice:
+            voice_file = result.get("voice_file", "")
+            skipped = []
+        else:
+            skipped = [stage for stage in skipped if stage == "narration"]
+    for stage in skipped:
+        deadlines.drop_stage(stage, reason="load")
+    
+    narrate = "narration" not in skipped and not voice_file
+    illustrate = "illustration" not in skipped and not baked
+    if illustration is not None:
+        drawing = illustration
+    elif illustrate:
+        drawing = _illustrate(story_text, page_id)
+    else:
+        drawing = _skipped(images)
+    try:
+        with tracing.span("page.media", page_id=page_id, tier=degradation.TIERS[tier], baked=baked,
+                          early_illustration=illustration is not None):
+            voice_file, images = await asyncio.gather(
+                _narrate(story_text, voice, page_id) if narrate else _skipped(voice_file),
+                drawing
+            )
+    except asyncio.CancelledError:
+        # The reader left (see disconnect.py); their businesses and picture aren't needed either
+        if prefetch is not None:
+            prefetch.cancel()
+        if illustration is not None:
+            illustration.cancel()
+        raise
+    with tracing.span("page.businesses"):
+        businesses = await _collect_prefetch(prefetch)
+    
+    return StoryResponse(
+        theme=theme,
+        story=story_text,
+        voice_file=voice_file,
+        images=images,
+        location=location,
+        choices=result.get("choices", []),
+        businesses=[BusinessResponse(**business) for business in businesses],
+        dropped_stages=deadlines.dropped_stages(),
+        quality=degradation.TIERS[tier],
+        usage=None if baked else result.get("usage")
+    )
+
+def _join_audio(paths: List[str], output_file: str) -> str:
+    """One narration file from a page's segments (MP3 frames concatenate cleanly)"""
+    with tracing.span("media.write", kind="audio", segments=len(paths)), open(output_file, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                out.write(f.read())
+    return output_file
+
+async def _stream_page(
+    theme: str,
+    story,
+    voice: str,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    story_context: str = "",
+    tier: int = degradation.FULL,
+    http_request: Optional[Request] = None
+):
+    """
+    A page whose narration is pipelined with the story model, as JSON lines
+    
+    `story` is a StoryGenerator.stream_story() iterator. Each paragraph goes
+    to Polly as soon as the model has written it, so the first paragraph can
+    be playing while the rest is still being written. The stream carries:
+    - {"type": "text", "index", "text"} as each paragraph is written
+    - {"type": "audio", "index", "voice_file"} for each paragraph's narration, in order
+      (voice_file is empty if that paragraph's narration failed or was dropped)
+    - {"type": "page", "page"}: the StoryResponse, with the joined narration as voice_file
+    - {"type": "error", "status", "detail"} instead of the page, if the story fails
+      (the response is still a 200, so http_request.state.page_failed tells
+      idempotency.py not to replay it)
+    """
+    started = time.perf_counter()
+    route = usage.current_route.get()
+    page_id = new_media_id()
+    skipped = degradation.DegradationLadder.skipped_stages(tier)
+    for stage in skipped:
+        deadlines.drop_stage(stage, reason="load")
+    
+    events = asyncio.Queue()
+    segments = asyncio.Queue()  # narration tasks in paragraph order, then None
+    narrations = []
+    illustration = prefetch = None
+    
+    async def write():
+        nonlocal illustration, prefetch
+        index = 0
+        preview = None
+        try:
+            async for kind, value in story:
+                if kind == "preview":
+                    # Drawn from the first lines, alongside the rest of the writing and the narration
+                    if "illustration" not in skipped:
+                        preview = value
+                        illustration = asyncio.ensure_future(_illustrate(value, page_id))
+                    continue
+                if kind == "result":
+                    illustration = _checked_illustration(illustration, preview, value["story"])
+                    # Businesses overlap with the rest of the narration
+                    if latitude is not None and longitude is not None:
+                        business_context = f"{story_context}\n\n{value['story']}" if story_context else value["story"]
+                        prefetch = asyncio.ensure_future(
+                            _find_page_businesses(business_context, value.get("location", ""), latitude, longitude)
+                        )
+                    return value
+                events.put_nowait({'type': 'text', 'index': index, 'text': value})
+                if "narration" not in skipped:
+                    narration = asyncio.ensure_future(_narrate(value, voice, f"{page_id}-{index}"))
+                    narrations.append(narration)
+                    segments.put_nowait(narration)
+                index += 1
+        finally:
+            segments.put_nowait(None)
+    
+    async def speak():
+        files = []
+        while True:
+            narration = await segments.get()
+            if narration is None:
+                return files
+            voice_file = await narration
+            if voice_file and not any(files):
+                metrics.FIRST_AUDIO.observe(time.perf_counter() - started, route)
+            events.put_nowait({'type': 'audio', 'index': len(files), 'voice_file': voice_file})
+            files.append(voice_file)
+    
+    writer = asyncio.ensure_future(write())
+    speaker = asyncio.ensure_future(speak())
+    asyncio.gather(writer, speaker, return_exceptions=True).add_done_callback(lambda _: events.put_nowait(None))
+    finished = False
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield json.dumps(event) + "\n"
+        result = writer.result()
+        voice_files = [path for path in speaker.result() if path]
+        with tracing.span("page.media", page_id=page_id, tier=degradation.TIERS[tier], pipelined=True):
+            images = await illustration if illustration is not None else []
+            voice_file = ""
+            if voice_files:
+                voice_file = await asyncio.to_thread(_join_audio, voice_files, media_path("audio", page_id, "mp3"))
+        with tracing.span("page.businesses"):
+            businesses = await _collect_prefetch(prefetch)
+        finished = True
+        
+        page = StoryResponse(
+            theme=theme,
+            story=result["story"],
+            voice_file=voice_file,
+            images=images,
+            location=result.get("location", ""),
+            choices=result.get("choices", []),
+            businesses=[BusinessResponse(**business) for business in businesses],
+            dropped_stages=deadlines.dropped_stages(),
+            quality=degradation.TIERS[tier],
+            usage=result.get("usage")
+        )
+        yield json.dumps({'type': 'page', 'page': page.dict()}) + "\n"
+    except DeadlineExceeded:
+        deadlines.drop_stage("story")
+        _mark_failed(http_request)
+        yield json.dumps({'type': 'error', 'status': 504, 'detail': "Story generation ran out of time, please try again"}) + "\n"
+    except Exception as e:
+        _mark_failed(http_request)
+        yield json.dumps({'type': 'error', 'status': 500, 'detail': f"Story generation failed: {str(e)}"}) + "\n"
+    finally:
+        if not finished:
+            # Failed, or the reader left (see disconnect.py)
+            for task in [writer, speaker, illustration, prefetch] + narrations:
+                if task is not None and not task.done():
+                    task.cancel()
+
+def _mark_failed(http_request: Optional[Request]):
+    if http_request is not None:
+        http_request.state.page_failed = True
+
+async def _whole_page(build, http_request: Optional[Request] = None):
+    """A page built the usual way (baked or reused text), as a one-line page stream"""
+    try:
+        page = await build
+        yield json.dumps({'type': 'page', 'page': page.dict()}) + "\n"
+    except DeadlineExceeded:
+        deadlines.drop_stage("story")
+        _mark_failed(http_request)
+        yield json.dumps({'type': 'error', 'status': 504, 'detail': "Story generation ran out of time, please try again"}) + "\n"
+    except Exception as e:
+        _mark_failed(http_request)
+        yield json.dumps({'type': 'error', 'status': 500, 'detail': f"Story generation failed: {str(e)}"}) + "\n"
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -114,31 +558,13 @@ async def api_info():
         }
     }
 
-@app.get("/story_audio.mp3")
-async def get_audio():
-    """Serve the generated audio file"""
-    audio_path = "story_audio.mp3"
-    if os.path.exists(audio_path):
-        return FileResponse(audio_path, media_type="audio/mpeg")
-    else:
-        raise HTTPException(status_code=404, detail="Audio file not found")
-
-@app.get("/illustration_page_{page_num}.png")
-async def get_illustration(page_num: int):
-    """Serve the generated illustration image for a specific page"""
-    image_path = f"illustration_page_{page_num}.png"
-    if os.path.exists(image_path):
-        return FileResponse(image_path, media_type="image/png")
-    else:
-        raise HTTPException(status_code=404, detail="Image file not found")
-
 @app.post("/api/profile")
 async def save_profile(profile: ProfileData):
     """Save user profile data"""
     # Save to Pinecone
     try:
         from pinecone_service import save_profile_to_pinecone
-        await save_profile_to_pinecone(profile.dict())
+        await save_profile_to_pinecone(profile.dict(), await asyncio.to_thread(embed_text, profile_text(profile.dict())))
     except Exception as e:
         print(f"Error saving to Pinecone: {e}")
     
@@ -148,12 +574,17 @@ async def save_profile(profile: ProfileData):
 async def voice_demo(voice: str, text: str):
     """Generate voice demo"""
     try:
-        # Generate temp audio file
-        audio_file = generate_voice_with_polly(text, voice_id=voice, output_file="demo_audio.mp3")
+        # Generate temp audio file, removed once it has been sent
+        audio_file = await run_in_thread(
+            generate_voice_with_polly, text, voice_id=voice,
+            output_file=media_path("demo", new_media_id(), "mp3")
+        )
         if audio_file and os.path.exists(audio_file):
-            return FileResponse(audio_file, media_type="audio/mpeg")
+            return FileResponse(audio_file, media_type="audio/mpeg", background=BackgroundTask(os.remove, audio_file))
         else:
             raise HTTPException(status_code=500, detail="Voice demo generation failed")
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Voice demo ran out of time, please try again")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -161,13 +592,99 @@ async def voice_demo(voice: str, text: str):
 async def save_book(book: dict):
     """Save completed book"""
     try:
+        # Token and cost total from the usage each page came back with
+        book['usage'] = usage.book_total(book.get('pages') or [])
+        # Keep the full pages server-side so the library can be served from here
+        with tracing.span("book_store.save", pages=len(book.get('pages', []))):
+            await asyncio.to_thread(get_book_store().save, book)
+        
         from pinecone_service import save_book_to_pinecone
-        await save_book_to_pinecone(book)
+        vector = await asyncio.to_thread(embed_text, book_text(book))
+        await save_book_to_pinecone(book, vector)
+        
+        # Index locally too, so similarity queries work without Pinecone
+        await asyncio.to_thread(get_vector_store().upsert, f"book_{book['id']}", vector, {
+            "type": "book",
+            "book_id": str(book['id']),
+            "theme": book['theme'],
+            "user_name": book['userName'],
+            "pages_count": len(book['pages']),
+            "completed_at": book.get('completedAt')
+        })
         return {"status": "success", "message": "Book saved"}
     except Exception as e:
         print(f"Error saving book: {e}")
         return {"status": "error", "message": str(e)}
 
+@app.get("/api/library")
+async def get_library(
+    user: Optional[str] = None,
+    theme: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20
+):
+    """Newest-first, cursor-paginated list of saved books for a reader or theme"""
+    if user is None and theme is None:
+        raise HTTPException(status_code=400, detail="Provide a user or theme")
+    try:
+        return await asyncio.to_thread(
+            get_book_store().list_books,
+            user_name=user, theme=theme, cursor=cursor, limit=max(1, min(limit, 100))
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/api/books/{book_id}")
+async def get_book(book_id: str):
+    """Full saved book, all pages included"""
+    book = await asyncio.to_thread(get_book_store().get, book_id)
+    if book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return book
+
+@app.get("/api/books/{book_id}/similar")
+async def get_similar_books(book_id: str, k: int = 5):
+    """Books most similar to a saved book"""
+    # Brute-force search (or a first IVF build) and the store's file I/O stay off the event loop
+    results = await asyncio.to_thread(similar_books, book_id, k=k)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return [{"score": round(hit["score"], 4), **hit["metadata"]} for hit in results]
+
+@app.get("/api/readers/{user_name}/themes")
+async def get_reader_themes(user_name: str, k: int = 5):
+    """Themes this reader is likely to enjoy, based on their saved books"""
+    return await asyncio.to_thread(reader_themes, user_name, k=k)
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    if not Config.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/story-trees")
+async def story_trees():
+    """Pre-baked story trees this worker serves from"""
+    return get_story_trees().stats() if Config.STORY_TREES_ENABLED else []
+
+@app.get("/api/usage/summary")
+async def usage_summary():
+    """Story model tokens and estimated cost by route, model, age group and page, for this worker"""
+    return usage.SUMMARY.snapshot()
+
+@app.get("/debug/trace/{trace_id}", include_in_schema=False)
+async def get_trace(trace_id: str, format: str = "html", x_admin_token: Optional[str] = Header(None)):
+    """Waterfall (or raw spans with format=json) of a traced request; the ID is its X-Request-ID"""
+    if not tracing.authorized(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    spans = await asyncio.to_thread(tracing.get_exporter().find, trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found (requests are sampled; send X-Trace: 1 with the admin token)")
+    if format == "json":
+        return spans
+    return HTMLResponse(tracing.render_waterfall(trace_id, spans))
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
@@ -180,15 +697,22 @@ async def health_check():
     return HealthResponse(
         status="healthy" if all(services.values()) else "degraded",
         timestamp=datetime.now(),
-        services=services
+        services=services,
+        location_providers=location_service.get_provider_stats()
     )
 
 @app.get("/story/generate", response_model=StoryResponse)
-async def generate_story(theme: str = "kindness", voice: str = "Ivy", age: int = None):
+async def generate_story(
+    theme: str = "kindness",
+    voice: str = "Ivy",
+    age: int = None,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None
+):
     """Generate a story based on the provided theme"""
-    global page_counter
-    page_counter += 1  # Increment for each new story segment
-    
+    metrics.current_age.set(age)
+    usage.current_route.set("generate")
+    usage.current_page.set(1)
     try:
         # Validate theme
         if not theme or len(theme.strip()) < 2:
@@ -197,60 +721,184 @@ async def generate_story(theme: str = "kindness", voice: str = "Ivy", age: int =
                 detail="Theme must be at least 2 characters long"
             )
         
+        # Popular themes may be pre-baked: the whole page is served from the tree
+        if Config.STORY_TREES_ENABLED:
+            baked = get_story_trees().opening(theme, age)
+            metrics.STORY_TREE_PAGES.inc("generate", "hit" if baked else "miss")
+            if baked is not None:
+                return await _build_page(theme, baked, voice, latitude, longitude, baked=True)
+        
         # Create a prompt based on the theme
         prompt = f"An interactive adventure about {theme}"
         
-        # Generate story with choices
-        result = await story_generator.generate_story(
-            prompt=prompt,
-            max_length=1000,
-            temperature=0.7,
-            is_continuation=False,
-            age=age
-        )
-        
-        story_text = result["story"]
-        location = result.get("location", "")
-        choices = result.get("choices", [])
-        
-        # Generate voice narration with AWS Polly (child voice)
-        voice_file = ""
-        try:
-            result_file = generate_voice_with_polly(story_text, voice_id=voice)
-            if result_file:
-                voice_file = result_file
-        except Exception as e:
-            print(f"⚠️ Voice generation failed: {e}")
-        
-        # Generate illustration with Bedrock Titan (unique per page)
-        images = []
-        try:
-            image_prompt = f"Children's storybook illustration based on this story: {story_text[:200]}"
-            images = generate_images(image_prompt, page_number=page_counter)
-        except Exception as e:
-            print(f"⚠️ Image generation failed: {e}")
+        # Under heavy load the ladder picks a cheaper tier, down to reusing a recent opening
+        ladder = degradation.get_ladder()
+        tier = ladder.tier()
+        result = ladder.cached_opening(theme, age) if tier >= degradation.CACHED_ONLY else None
+        page_id = new_media_id()
+        illustration = None
+        if result is not None:
+            # Reused text costs nothing this time
+            result["usage"] = None
+        else:
+            # Generate story with choices; the illustration starts from its first lines
+            result, illustration = await _write_story(
+                story_generator.stream_story(
+                    prompt=prompt,
+                    max_length=1000,
+                    temperature=0.7,
+                    is_continuation=False,
+                    age=age,
+                    model_id=ladder.model_for(tier),
+                    preview_chars=ILLUSTRATION_PROMPT_CHARS
+                ),
+                page_id,
+                illustrate="illustration" not in degradation.DegradationLadder.skipped_stages(tier)
+            )
+            ladder.remember_opening(theme, age, result)
         
-        return StoryResponse(
-            theme=theme,
-            story=story_text,
-            voice_file=voice_file,
-            images=images,
-            location=location,
-            choices=choices
+        return await _build_page(
+            theme, result, voice, latitude, longitude, tier=tier, page_id=page_id, illustration=illustration
         )
         
+    except DeadlineExceeded:
+        deadlines.drop_stage("story")
+        raise HTTPException(status_code=504, detail="Story generation ran out of time, please try again")
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Story generation failed: {str(e)}"
         )
 
+async def _batch_page(entry: BatchEntry, coalescer: batch.Coalescer, tier: int) -> StoryResponse:
+    """One child's opening; identical prompts, narrations and illustrations are shared across the batch"""
+    deadlines.reset_dropped()
+    metrics.current_age.set(entry.age)
+    limits = batch.get_stage_limits()
+    ladder = degradation.get_ladder()
+    prompt_key = (entry.theme.strip().lower(), entry.age)
+    
+    async def write_story():
+        if Config.STORY_TREES_ENABLED:
+            baked = get_story_trees().opening(entry.theme, entry.age)
+            if baked is not None:
+                return baked, True
+        cached = ladder.cached_opening(entry.theme, entry.age) if tier >= degradation.CACHED_ONLY else None
+        if cached is not None:
+            cached["usage"] = None
+            return cached, False
+        async with limits.slot("llm"):
+            result = await story_generator.generate_story(
+                prompt=f"An interactive adventure about {entry.theme}",
+                max_length=1000,
+                temperature=0.7,
+                is_continuation=False,
+                age=entry.age,
+                model_id=ladder.model_for(tier)
+            )
+        ladder.remember_opening(entry.theme, entry.age, result)
+        return result, False
+    
+    (result, baked), dropped, shared = await coalescer.run("llm", prompt_key, write_story)
+    story_text = result["story"]
+    skipped = [] if baked else degradation.DegradationLadder.skipped_stages(tier)
+    for stage in skipped:
+        deadlines.drop_stage(stage, reason="load")
+    
+    async def narrate():
+        async with limits.slot("polly"):
+            return await _narrate(story_text, entry.voice, new_media_id())
+    
+    async def illustrate():
+        async with limits.slot("titan"):
+            return await _illustrate(story_text, new_media_id())
+    
+    async def no_media(value):
+        return value, [], False
+    
+    if baked and result.get("voice") == entry.voice:
+        narration = no_media(result["voice_file"])
+    elif "narration" in skipped:
+        narration = no_media("")
+    else:
+        narration = coalescer.run("polly", prompt_key + (entry.voice,), narrate)
+    if baked:
+        illustration = no_media(result.get("images", []))
+    elif "illustration" in skipped:
+        illustration = no_media([])
+    else:
+        illustration = coalescer.run("titan", prompt_key, illustrate)
+    (voice_file, voice_dropped, _), (images, image_dropped, _) = await asyncio.gather(narration, illustration)
+    
+    deadlines.add_dropped(dropped + voice_dropped + image_dropped)
+    return StoryResponse(
+        theme=entry.theme,
+        story=story_text,
+        voice_file=voice_file,
+        images=images,
+        location=result.get("location", ""),
+        choices=result.get("choices", []),
+        dropped_stages=deadlines.dropped_stages(),
+        quality=degradation.TIERS[tier],
+        # The call's cost is reported once, on the first child that shared it
+        usage=None if shared or baked else result.get("usage")
+    )
+
+async def _batch_entry(index: int, entry: BatchEntry, coalescer: batch.Coalescer, tier: int) -> dict:
+    line = {'index': index, 'child': entry.child}
+    try:
+        page = await _batch_page(entry, coalescer, tier)
+        line.update(status="ok", page=page.dict())
+    except DeadlineExceeded:
+        line.update(status="timeout", detail="Ran out of time for this story")
+    except Exception as e:
+        line.update(status="error", detail=str(e))
+    metrics.BATCH_ENTRIES.inc(line['status'])
+    return line
+
+@app.post("/story/batch")
+async def generate_batch(request: BatchRequest):
+    """
+    Story openings for a whole classroom in one call
+    
+    Streams one JSON line per child (index, child, status, page) as each
+    page is ready, then a summary line with done=true.
+    """
+    if not request.entries or len(request.entries) > Config.BATCH_MAX_ENTRIES:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {Config.BATCH_MAX_ENTRIES} entries")
+    if any(len(entry.theme.strip()) < 2 for entry in request.entries):
+        raise HTTPException(status_code=400, detail="Theme must be at least 2 characters long")
+    usage.current_route.set("batch")
+    usage.current_page.set(1)
+    tier = degradation.get_ladder().tier()
+    
+    async def lines():
+        coalescer = batch.Coalescer()
+        tasks = [
+            asyncio.create_task(_batch_entry(index, entry, coalescer, tier))
+            for index, entry in enumerate(request.entries)
+        ]
+        results = []
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                results.append(result)
+                yield json.dumps(result) + "\n"
+            yield json.dumps(batch.summarize(results)) + "\n"
+        finally:
+            # Stops the rest of the batch if the teacher's client went away
+            for task in tasks:
+                task.cancel()
+            coalescer.cancel()
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/story/continue", response_model=StoryResponse)
 async def continue_story(request: ContinueRequest):
     """Continue the story based on user's choice"""
-    global page_counter
-    page_counter += 1  # Increment for each continuation
-    
+    metrics.current_age.set(request.age)
+    usage.current_route.set("ending" if request.is_ending else "continue")
+    usage.current_page.set(request.page_index)
     try:
         # Validate request
         if not request.choice or len(request.choice.strip()) < 2:
@@ -259,63 +907,202 @@ async def continue_story(request: ContinueRequest):
                 detail="Choice must be provided"
             )
         
-        # Check if this is a happy ending request
+        # Served from a baked tree while the reader's path is still inside it
+        if Config.STORY_TREES_ENABLED:
+            baked = get_story_trees().next_page(
+                request.theme, request.age, request.story_context, request.choice, request.is_ending
+            )
+            metrics.STORY_TREE_PAGES.inc("ending" if request.is_ending else "continue", "hit" if baked else "miss")
+            if baked is not None:
+                return await _build_page(
+                    request.theme, baked, request.voice,
+                    request.latitude, request.longitude, story_context=request.story_context, baked=True
+                )
+        
+        ladder = degradation.get_ladder()
+        tier = ladder.tier()
+        page_id = new_media_id()
+        illustrate = "illustration" not in degradation.DegradationLadder.skipped_stages(tier)
+        
+        # Check if this is a happy ending request; either way the illustration starts from the first lines
         if request.is_ending:
             # Generate a happy ending
-            ending_prompt = f"{request.story_context}\n\nNow create a satisfying happy ending that wraps up the story beautifully. Make it heartwarming and conclusive with no more choices."
-            result = await story_generator.generate_story(
-                prompt=ending_prompt,
-                max_length=1000,
-                temperature=0.7,
-                is_continuation=False,
-                age=request.age
+            result, illustration = await _write_story(
+                story_generator.stream_story(
+                    prompt=ending_prompt(request.story_context),
+                    max_length=1000,
+                    temperature=0.7,
+                    is_continuation=False,
+                    age=request.age,
+                    model_id=ladder.model_for(tier),
+                    preview_chars=ILLUSTRATION_PROMPT_CHARS
+                ),
+                page_id,
+                illustrate
             )
-            story_text = result["story"]
-            choices = []  # No more choices after ending
+            result["choices"] = []  # No more choices after ending
         else:
             # Continue story based on choice
-            result = await story_generator.generate_story(
-                prompt=request.story_context,
-                max_length=1000,
-                temperature=0.7,
-                is_continuation=True,
-                previous_choice=request.choice,
-                age=request.age
+            result, illustration = await _write_story(
+                story_generator.stream_story(
+                    prompt=request.story_context,
+                    max_length=1000,
+                    temperature=0.7,
+                    is_continuation=True,
+                    previous_choice=request.choice,
+                    age=request.age,
+                    model_id=ladder.model_for(tier),
+                    preview_chars=ILLUSTRATION_PROMPT_CHARS
+                ),
+                page_id,
+                illustrate
             )
-            story_text = result["story"]
-            choices = result.get("choices", [])
-        
-        # Generate voice narration with AWS Polly
-        voice_file = ""
-        try:
-            result_file = generate_voice_with_polly(story_text, voice_id=request.voice)
-            if result_file:
-                voice_file = result_file
-        except Exception as e:
-            print(f"⚠️ Voice generation failed: {e}")
         
-        # Generate illustration with Bedrock Titan (unique per page)
-        images = []
-        try:
-            image_prompt = f"Children's storybook illustration based on this story: {story_text[:200]}"
-            images = generate_images(image_prompt, page_number=page_counter)
-        except Exception as e:
-            print(f"⚠️ Image generation failed: {e}")
-        
-        return StoryResponse(
-            theme=request.theme,
-            story=story_text,
-            voice_file=voice_file,
-            images=images,
-            choices=choices
+        return await _build_page(
+            request.theme, result, request.voice,
+            request.latitude, request.longitude, story_context=request.story_context, tier=tier,
+            page_id=page_id, illustration=illustration
         )
         
+    except DeadlineExceeded:
+        deadlines.drop_stage("story")
+        raise HTTPException(status_code=504, detail="Story continuation ran out of time, please try again")
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Story continuation failed: {str(e)}"
         )
 
+@app.get("/story/generate/stream")
+async def generate_story_stream(
+    http_request: Request,
+    theme: str = "kindness",
+    voice: str = "Ivy",
+    age: int = None,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None
+):
+    """
+    Like /story/generate, with narration pipelined per paragraph
+    
+    Streams JSON lines (see _stream_page). Baked and reused pages have no
+    model call to overlap with and come back as a single page line.
+    """
+    metrics.current_age.set(age)
+    usage.current_route.set("generate")
+    usage.current_page.set(1)
+    if not theme or len(theme.strip()) < 2:
+        raise HTTPException(
+            status_code=400, 
+            detail="Theme must be at least 2 characters long"
+        )
+    
+    if Config.STORY_TREES_ENABLED:
+        baked = get_story_trees().opening(theme, age)
+        metrics.STORY_TREE_PAGES.inc("generate", "hit" if baked else "miss")
+        if baked is not None:
+            return StreamingResponse(
+                _whole_page(_build_page(theme, baked, voice, latitude, longitude, baked=True), http_request),
+                media_type="application/x-ndjson"
+            )
+    
+    ladder = degradation.get_ladder()
+    tier = ladder.tier()
+    cached = ladder.cached_opening(theme, age) if tier >= degradation.CACHED_ONLY else None
+    if cached is not None:
+        cached["usage"] = None
+        return StreamingResponse(
+            _whole_page(_build_page(theme, cached, voice, latitude, longitude, tier=tier), http_request),
+            media_type="application/x-ndjson"
+        )
+    
+    async def story():
+        async for kind, value in story_generator.stream_story(
+            prompt=f"An interactive adventure about {theme}",
+            max_length=1000,
+            temperature=0.7,
+            is_continuation=False,
+            age=age,
+            model_id=ladder.model_for(tier),
+            min_chars=Config.NARRATION_SEGMENT_MIN_CHARS,
+            preview_chars=ILLUSTRATION_PROMPT_CHARS
+        ):
+            if kind == "result":
+                ladder.remember_opening(theme, age, value)
+            yield kind, value
+    
+    return StreamingResponse(
+        _stream_page(theme, story(), voice, latitude, longitude, tier=tier, http_request=http_request),
+        media_type="application/x-ndjson"
+    )
+
+@app.post("/story/continue/stream")
+async def continue_story_stream(request: ContinueRequest, http_request: Request):
+    """Like /story/continue, with narration pipelined per paragraph (see /story/generate/stream)"""
+    metrics.current_age.set(request.age)
+    usage.current_route.set("ending" if request.is_ending else "continue")
+    usage.current_page.set(request.page_index)
+    if not request.choice or len(request.choice.strip()) < 2:
+        raise HTTPException(
+            status_code=400, 
+            detail="Choice must be provided"
+        )
+    
+    if Config.STORY_TREES_ENABLED:
+        baked = get_story_trees().next_page(
+            request.theme, request.age, request.story_context, request.choice, request.is_ending
+        )
+        metrics.STORY_TREE_PAGES.inc("ending" if request.is_ending else "continue", "hit" if baked else "miss")
+        if baked is not None:
+            return StreamingResponse(
+                _whole_page(_build_page(
+                    request.theme, baked, request.voice,
+                    request.latitude, request.longitude, story_context=request.story_context, baked=True
+                ), http_request),
+                media_type="application/x-ndjson"
+            )
+    
+    ladder = degradation.get_ladder()
+    tier = ladder.tier()
+    if request.is_ending:
+        stream = story_generator.stream_story(
+            prompt=ending_prompt(request.story_context),
+            max_length=1000,
+            temperature=0.7,
+            is_continuation=False,
+            age=request.age,
+            model_id=ladder.model_for(tier),
+            min_chars=Config.NARRATION_SEGMENT_MIN_CHARS,
+            preview_chars=ILLUSTRATION_PROMPT_CHARS
+        )
+    else:
+        stream = story_generator.stream_story(
+            prompt=request.story_context,
+            max_length=1000,
+            temperature=0.7,
+            is_continuation=True,
+            previous_choice=request.choice,
+            age=request.age,
+            model_id=ladder.model_for(tier),
+            min_chars=Config.NARRATION_SEGMENT_MIN_CHARS,
+            preview_chars=ILLUSTRATION_PROMPT_CHARS
+        )
+    
+    async def story():
+        async for kind, value in stream:
+            if kind == "result" and request.is_ending:
+                value["choices"] = []  # No more choices after ending
+            yield kind, value
+    
+    return StreamingResponse(
+        _stream_page(
+            request.theme, story(), request.voice,
+            request.latitude, request.longitude, story_context=request.story_context, tier=tier,
+            http_request=http_request
+        ),
+        media_type="application/x-ndjson"
+    )
+
 @app.post("/location/nearby", response_model=List[BusinessResponse])
 async def get_nearby_businesses(request: LocationRequest):
     """Get nearby businesses based on user location"""
@@ -343,7 +1130,8 @@ async def get_story_related_businesses(request: StoryLocationRequest):
             story_context=request.story_context,
             latitude=request.latitude,
             longitude=request.longitude,
-            max_results=request.max_results
+            max_results=request.max_results,
+            radius=request.radius
         )
         
         return [BusinessResponse(**business) for business in businesses]
@@ -354,12 +1142,37 @@ async def get_story_related_businesses(request: StoryLocationRequest):
             detail=f"Failed to find story-related businesses: {str(e)}"
         )
 
+@app.post("/location/resolve", response_model=Optional[BusinessResponse])
+async def resolve_story_location(request: LocationResolveRequest):
+    """Match the story's LOCATION name to a real nearby business"""
+    try:
+        business = await location_service.resolve_story_location(
+            location=request.location,
+            latitude=request.latitude,
+            longitude=request.longitude,
+            radius=request.radius
+        )
+        
+        return BusinessResponse(**business) if business else None
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to resolve story location: {str(e)}"
+        )
+
+@app.get("/location/name-index/stats")
+async def name_index_stats():
+    """Lookup latency and match-quality metrics for the business name index"""
+    return location_service.name_index.stats()
+
 @app.get("/location/search")
 async def search_businesses_by_text(
     query: str,
     latitude: float,
     longitude: float,
-    max_results: int = 10
+    max_results: int = 10,
+    radius: int = 5000
 ):
     """Search for businesses by text query"""
     try:
@@ -367,7 +1180,8 @@ async def search_businesses_by_text(
             search_text=query,
             latitude=latitude,
             longitude=longitude,
-            max_results=max_results
+            max_results=max_results,
+            radius=radius
         )
         
         return [BusinessResponse(**business) for business in businesses]
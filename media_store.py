@@ -0,0 +1,53 @@
+# media_store.py
+"""
+Per-request output paths for generated audio and illustrations
+IDs are random, so any number of workers can write media side by side
+without a shared counter or colliding filenames
+"""
+
+import os
+import time
+import uuid
+import threading
+
+from config import Config
+
+# Titan accepts seeds in [0, 2147483646]
+_MAX_SEED = 2147483646
+
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def new_media_id() -> str:
+    """Collision-free identifier for one page's media"""
+    return uuid.uuid4().hex
+
+
+def seed_for(media_id: str) -> int:
+    """Stable image seed derived from a media ID"""
+    return int(media_id[:8], 16) % (_MAX_SEED + 1)
+
+
+def media_path(kind: str, media_id: str, extension: str) -> str:
+    """Relative path (also the URL path) for a new media file, e.g. media/audio_<id>.mp3"""
+    os.makedirs(Config.MEDIA_DIR, exist_ok=True)
+    _maybe_prune()
+    return f"{Config.MEDIA_DIR}/{kind}_{media_id}.{extension}"
+
+
+def _maybe_prune():
+    """Every few hundred files, delete media older than the retention window"""
+    global _writes
+    with _writes_lock:
+        _writes += 1
+        if _writes % 200:
+            return
+    cutoff = time.time() - Config.MEDIA_RETENTION_HOURS * 3600
+    try:
+        with os.scandir(Config.MEDIA_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+    except OSError as e:
+        print(f"⚠️ Media cleanup failed: {e}")
@@ -0,0 +1,339 @@
+# metrics.py
+"""
+Prometheus metrics without external dependencies
+Every thread records into its own shard (a plain dict only that thread
+writes), so recording takes no lock; /metrics sums the shards when scraped.
+"""
+
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+from tracing import span
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 30.0, 60.0)
+SIMILARITY_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.88, 0.9, 0.92, 0.95, 0.98, 0.99)
+TOKEN_BUCKETS = (50, 100, 200, 400, 600, 800, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000, 16000)
+
+# Polly voices offered by the app; anything else is labelled "other" to bound cardinality
+KNOWN_VOICES = frozenset({"Ivy", "Kevin", "Joanna", "Matthew", "Justin", "Salli", "Joey", "Kendra", "Kimberly", "Ruth", "Stephen"})
+
+# Reader age for the current request; copied into to_thread workers with the context
+current_age = contextvars.ContextVar("current_age", default=None)
+
+
+class _Registry:
+    def __init__(self):
+        self.metrics = []
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            # Only taken once per thread
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def collect(self, metric) -> Dict:
+        """Sum every thread's values for one metric"""
+        with self._lock:
+            shards = list(self._shards)
+        totals = {}
+        for shard in shards:
+            for labels, value in list(shard.get(metric.name, {}).items()):
+                if isinstance(value, list):
+                    total = totals.setdefault(labels, [0] * len(value))
+                    for i, v in enumerate(value):
+                        total[i] += v
+                else:
+                    totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+
+REGISTRY = _Registry()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        REGISTRY.metrics.append(self)
+
+    def _values(self) -> Dict:
+        shard = REGISTRY.shard()
+        values = shard.get(self.name)
+        if values is None:
+            values = shard[self.name] = {}
+        return values
+
+    def _format_labels(self, values, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(REGISTRY.collect(self).items()):
+            lines.extend(self._render_series(labels, value))
+        return lines
+
+    def _render_series(self, labels, value) -> List[str]:
+        return [f"{self.name}{self._format_labels(labels)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge built from per-thread deltas, so inc and dec may happen on different threads"""
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        values = self._values()
+        series = values.get(labels)
+        if series is None:
+            # One count per bucket (the last is +Inf), then sum
+            series = values[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def _render_series(self, labels, series) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+            cumulative += count
+            le = 'le="%s"' % ("+Inf" if bound == float("inf") else _number(bound))
+            lines.append(f"{self.name}_bucket{self._format_labels(labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._format_labels(labels)} {_number(series[-1])}")
+        lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+# Metric definitions
+HTTP_REQUESTS = Counter(
+    "bridgetales_http_requests_total", "HTTP requests by route, method and status", ["route", "method", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "bridgetales_http_request_duration_seconds", "HTTP request latency by route", ["route", "method"], HTTP_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge("bridgetales_http_requests_in_flight", "HTTP requests being served")
+STAGE_LATENCY = Histogram(
+    "bridgetales_stage_duration_seconds",
+    "Latency of provider calls (llm, polly, titan, location)",
+    ["stage", "provider", "model", "voice", "age_bucket"]
+)
+STAGE_IN_FLIGHT = Gauge("bridgetales_stage_in_flight", "Provider calls in progress", ["stage"])
+ERRORS = Counter("bridgetales_errors_total", "Exceptions by stage and class", ["stage", "exception"])
+DROPPED_STAGES = Counter(
+    "bridgetales_dropped_stages_total", "Page stages left out, for the request deadline or the load tier", ["stage", "reason"]
+)
+DEGRADATION_TIER = Gauge("bridgetales_degradation_tier", "Current page quality tier (0 = full, see degradation.TIERS)")
+DEGRADATION_TIER_SECONDS = Counter(
+    "bridgetales_degradation_tier_seconds_total", "Time spent in each page quality tier", ["tier"]
+)
+DEGRADATION_CHANGES = Counter("bridgetales_degradation_changes_total", "Page quality tier changes", ["direction"])
+ADMISSION_QUEUE = Gauge("bridgetales_admission_queue_length", "Requests waiting for admission", ["class"])
+ADMISSION_IN_FLIGHT = Gauge("bridgetales_admission_in_flight", "Admitted requests being served", ["class"])
+ADMISSION_SHED = Counter("bridgetales_admission_shed_total", "Requests rejected with 503", ["class", "reason"])
+ADMISSION_WAIT = Histogram(
+    "bridgetales_admission_wait_seconds", "Time spent queued before admission", ["class"], HTTP_BUCKETS
+)
+LLM_CALLS = Counter(
+    "bridgetales_llm_calls_total", "Story model calls with usage reported", ["route", "model", "age_bucket", "page"]
+)
+LLM_TOKENS = Histogram(
+    "bridgetales_llm_tokens",
+    "Tokens per story model call (kind: input, output, cached_input)",
+    ["route", "model", "age_bucket", "page", "kind"],
+    TOKEN_BUCKETS
+)
+LLM_COST = Counter("bridgetales_llm_cost_usd_total", "Estimated story model spend (see usage.MODEL_PRICES)", ["route", "model"])
+IDEMPOTENCY_REQUESTS = Counter(
+    "bridgetales_idempotency_requests_total",
+    "Requests with an Idempotency-Key (outcome: new, replayed, attached, mismatch, conflict, timeout)",
+    ["route", "outcome"]
+)
+STORY_TREE_PAGES = Counter(
+    "bridgetales_story_tree_pages_total", "Pages served from a baked story tree (hit) or generated live (miss)", ["route", "outcome"]
+)
+FIRST_AUDIO = Histogram(
+    "bridgetales_first_audio_seconds", "Time from a pipelined page request to its first narration segment", ["route"]
+)
+EARLY_ILLUSTRATION_REDRAWS = Counter(
+    "bridgetales_early_illustration_redraws_total",
+    "Illustrations started from the streamed story start and redrawn because the parsed story began differently"
+)
+BATCH_ENTRIES = Counter("bridgetales_batch_entries_total", "Classroom batch entries by outcome", ["status"])
+BATCH_COALESCED = Counter(
+    "bridgetales_batch_coalesced_total", "Batch entries that shared another entry's provider call", ["stage"]
+)
+ILLUSTRATION_CACHE_LOOKUPS = Counter(
+    "bridgetales_illustration_cache_lookups_total",
+    "Illustration cache lookups (outcome: hit, miss, variant = drawing another for a cached prompt, stale)",
+    ["age_bucket", "outcome"]
+)
+ILLUSTRATION_CACHE_SIMILARITY = Histogram(
+    "bridgetales_illustration_cache_similarity",
+    "Cosine similarity of the nearest cached illustration prompt at lookup",
+    ["age_bucket"],
+    SIMILARITY_BUCKETS
+)
+ILLUSTRATION_CACHE_ENTRIES = Gauge("bridgetales_illustration_cache_entries", "Prompts in the illustration cache")
+CLIENT_DISCONNECTS = Counter(
+    "bridgetales_client_disconnects_total",
+    "Clients that left before their response (outcome: cancelled, or shared with other waiters)",
+    ["route", "outcome"]
+)
+CANCELLED_WORK = Counter(
+    "bridgetales_cancelled_work_total", "Provider calls skipped or abandoned after the client left", ["stage", "state"]
+)
+RECLAIMED_SECONDS = Counter(
+    "bridgetales_reclaimed_seconds_total", "Estimated provider time not spent on skipped calls", ["stage"]
+)
+
+
+_stage_listeners = []
+_stage_guards = []
+
+
+def add_stage_listener(listener):
+    """Call listener(stage, elapsed) as provider calls start (elapsed None) and finish"""
+    _stage_listeners.append(listener)
+
+
+def add_stage_guard(guard):
+    """Call guard(stage) before a provider call starts; it may raise to skip the call"""
+    _stage_guards.append(guard)
+
+
+def age_bucket(age: Optional[int]) -> str:
+    """Coarse reader age group, to keep label cardinality low"""
+    if age is None:
+        return "unknown"
+    if age <= 5:
+        return "3-5"
+    if age <= 8:
+        return "6-8"
+    if age <= 12:
+        return "9-12"
+    return "13+"
+
+
+@contextmanager
+def observe_stage(stage: str, provider: str = "", model: str = "", voice: str = "", age: Optional[int] = None):
+    """
+    Time one provider call (and trace it, when the request is sampled)
+
+    Args:
+        stage: llm, polly, titan or location
+        provider: Service that handled it (bedrock, openai, aws, google)
+        model: Model ID, if any
+        voice: Polly voice, if any
+        age: Reader age (default: the current request's, see current_age)
+    """
+    bucket = age_bucket(age if age is not None else current_age.get())
+    if voice and voice not in KNOWN_VOICES:
+        voice = "other"
+    for guard in _stage_guards:
+        guard(stage)
+    STAGE_IN_FLIGHT.inc(stage)
+    for listener in _stage_listeners:
+        listener(stage, None)
+    start = time.perf_counter()
+    try:
+        # Every timed provider call is also a trace span
+        with span(stage, provider=provider, model=model, voice=voice, age_bucket=bucket):
+            yield
+    except Exception as e:
+        ERRORS.inc(stage, type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_IN_FLIGHT.dec(stage)
+        STAGE_LATENCY.observe(elapsed, stage, provider, model, voice, bucket)
+        for listener in _stage_listeners:
+            listener(stage, elapsed)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY.metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request count, latency and in-flight requests per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            ERRORS.inc("http", type(e).__name__)
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # Route template, not the raw path, so IDs don't explode the label set
+            route = scope.get("route")
+            path = getattr(route, "path", None) or ("static" if scope["path"].startswith(("/static", "/media")) else "unmatched")
+            method = scope["method"]
+            HTTP_LATENCY.observe(time.perf_counter() - start, path, method)
+            HTTP_REQUESTS.inc(path, method, str(status[0]))
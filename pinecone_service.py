@@ -1,23 +1,32 @@
 import os
 import json
+import time
+import atexit
+import shutil
+import threading
 from datetime import datetime
+from config import Config
+from clients import get_pinecone
+from embedding_service import embed_text, book_text, profile_text, EMBEDDING_DIM
 
-try:
-    from pinecone import Pinecone
-    from pinecone.core.grpc.protos.vector_service_pb2 import Vector
-except ImportError:
-    # Fallback for older versions
-    from pinecone import Pinecone
-
-# Initialize Pinecone
-pc = Pinecone(api_key="pcsk_6vhZMA_4Rh1K18qztL13jHvvmd8vUw7B2ahbWzh8qc7r6RtnwGh7PJf4eRuZxZH3zczQTL")
+# Pinecone client, constructed on first use (see clients.py)
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 
 # Index name
 INDEX_NAME = "bridgetales-users"
 
+# Index handle, resolved once per process
+_index = None
+_index_lock = threading.Lock()
+
 def get_or_create_index():
     """Get or create Pinecone index"""
+    if not PINECONE_API_KEY:
+        print("Pinecone index error: PINECONE_API_KEY is not set")
+        return None
     try:
+        pc = get_pinecone(PINECONE_API_KEY)
+        
         # List existing indexes
         existing_indexes = pc.list_indexes()
         index_names = [idx.name for idx in existing_indexes]
@@ -26,7 +35,7 @@ def get_or_create_index():
             # Create index if it doesn't exist
             pc.create_index(
                 name=INDEX_NAME,
-                dimension=384,  # Standard dimension for text embeddings
+                dimension=EMBEDDING_DIM,  # Matches embedding_service
                 metric='cosine',
                 spec={
                     "serverless": {
@@ -41,68 +50,290 @@ def get_or_create_index():
         print(f"Pinecone index error: {e}")
         return None
 
-async def save_profile_to_pinecone(profile_data):
-    """Save user profile to Pinecone"""
-    try:
-        index = get_or_create_index()
-        if not index:
-            return
+def get_index():
+    """Cached index handle; failed lookups are retried on the next call"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = get_or_create_index()
+    return _index
+
+def _upsert_batch(records):
+    """Upsert a batch of vector records to Pinecone"""
+    index = get_index()
+    if not index:
+        raise RuntimeError("Pinecone index unavailable")
+    index.upsert(vectors=records)
+
+class WriteBehindBuffer:
+    """
+    Batches upserts off the request path
+    
+    Every record is appended to an on-disk log before it is acknowledged, so
+    queued writes survive restarts. A background thread flushes every
+    `batch_size` records or `flush_interval_ms`, whichever comes first, and
+    keeps retrying with backoff while the vector store is unreachable.
+    
+    Each process logs to its own `<log_path>.<pid>` file and, on start,
+    adopts the logs of processes that are no longer running. Flushed records
+    are dropped from the front of the log by copying the rest out of the
+    lock, once they make up half of it (or all of it, by truncating).
+    """
+    
+    def __init__(self, log_path, upsert, batch_size=50, flush_interval_ms=500, max_backoff=30.0):
+        self.base_path = log_path
+        self.log_path = f"{log_path}.{os.getpid()}"
+        self.upsert = upsert
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_backoff = max_backoff
+        
+        self._pending = []  # (record, bytes in the log), oldest first
+        self._cond = threading.Condition()
+        self._closed = False
+        self._log_size = 0  # bytes in the log
+        self._flushed_bytes = 0  # leading bytes of the log already upserted
         
-        # Create a simple embedding (you can use actual embeddings later)
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        self._pending.extend(self._read_log(self.log_path))
+        claimed = self._claim_orphans()
+        if self._pending:
+            print(f"🔁 Replaying {len(self._pending)} queued Pinecone writes from {log_path}")
+        # Adopted records are safe in our own log before the orphans go away
+        self._rewrite_log()
+        for path in claimed:
+            os.remove(path)
+        
+        self._thread = threading.Thread(target=self._run, name="pinecone-write-behind", daemon=True)
+        self._thread.start()
+    
+    def _claim_orphans(self):
+        """Move logs left by dead processes into our pending queue; returns the claimed files"""
+        directory = os.path.dirname(self.base_path) or "."
+        prefix = os.path.basename(self.base_path)
+        claimed = []
+        for name in os.listdir(directory):
+            if name == prefix:
+                owner = None  # log from before per-process logs
+            elif name.startswith(prefix + ".") and name[len(prefix) + 1:].isdigit():
+                owner = int(name[len(prefix) + 1:])
+                if owner == os.getpid() or _process_alive(owner):
+                    continue
+            else:
+                continue
+            # Rename is atomic, so only one starting process can adopt each orphan
+            claim_path = f"{self.log_path}.claim{len(claimed)}"
+            try:
+                os.rename(os.path.join(directory, name), claim_path)
+            except FileNotFoundError:
+                continue
+            self._pending.extend(self._read_log(claim_path))
+            claimed.append(claim_path)
+        return claimed
+    
+    def _read_log(self, path):
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append((json.loads(line), 0))
+                except json.JSONDecodeError:
+                    # Torn final line from a crash mid-write
+                    print("⚠️ Skipping corrupt Pinecone log entry")
+        return records
+    
+    def enqueue(self, record):
+        """
+        Queue one vector record; returns without touching the network
+
+        The record is written through to the log (it survives the process
+        exiting), but not fsynced, so a machine crash can lose the last writes.
+        """
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._cond:
+            self._log.write(line)
+            self._log.flush()
+            self._log_size += len(line)
+            self._pending.append((record, len(line)))
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+    
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+    
+    def _run(self):
+        backoff = self.flush_interval
+        retrying = False
+        while True:
+            with self._cond:
+                # A retry has already waited out its backoff
+                if not retrying and not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(timeout=self.flush_interval)
+                if self._closed and not self._pending:
+                    return
+                batch = self._pending[:self.batch_size]
+            
+            if not batch:
+                continue
+            
+            try:
+                self.upsert([record for record, _ in batch])
+            except Exception as e:
+                print(f"⚠️ Pinecone batch upsert failed, will retry ({len(batch)} records): {e}")
+                backoff = min(backoff * 2, self.max_backoff)
+                retry_at = time.monotonic() + backoff
+                with self._cond:
+                    while not self._closed and time.monotonic() < retry_at:
+                        self._cond.wait(timeout=retry_at - time.monotonic())
+                    if self._closed:
+                        return
+                retrying = True
+                continue
+            
+            backoff = self.flush_interval
+            retrying = False
+            with self._cond:
+                del self._pending[:len(batch)]
+                self._flushed_bytes += sum(size for _, size in batch)
+                if not self._pending:
+                    # Nothing left to keep: O(1), under the lock
+                    self._log.truncate(0)
+                    self._log_size = self._flushed_bytes = 0
+                compact = self._flushed_bytes * 2 >= self._log_size > 0
+            if compact:
+                self._compact_log()
+            print(f"✅ Flushed {len(batch)} records to Pinecone")
+    
+    def _compact_log(self):
+        """Drop the flushed front of the log; the copy runs without blocking enqueue()"""
+        with self._cond:
+            start, end = self._flushed_bytes, self._log_size
+        tmp_path = f"{self.log_path}.tmp"
+        with open(self.log_path, "rb") as src, open(tmp_path, "wb") as out:
+            src.seek(start)
+            shutil.copyfileobj(src, out)
+            out.truncate(end - start)  # leave records appended meanwhile to the step below
+            with self._cond:
+                # Only the records appended during the copy are copied under the lock
+                src.seek(end)
+                out.seek(end - start)
+                out.write(src.read(self._log_size - end))
+                out.flush()
+                self._log.close()
+                os.replace(tmp_path, self.log_path)
+                self._log = open(self.log_path, "ab")
+                self._log_size -= start
+                self._flushed_bytes -= start
+    
+    def _rewrite_log(self):
+        """Replace the log with the pending records (at start, before the flush thread runs)"""
+        tmp_path = f"{self.log_path}.tmp"
+        pending = []
+        with open(tmp_path, "wb") as f:
+            for record, _ in self._pending:
+                line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+                f.write(line)
+                pending.append((record, len(line)))
+        os.replace(tmp_path, self.log_path)
+        self._pending = pending
+        self._log_size = sum(size for _, size in pending)
+        self._log = open(self.log_path, "ab")
+    
+    def close(self, timeout=5.0):
+        """Try to flush what is queued; anything left stays in the log for next start"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        with self._cond:
+            self._log.close()
+
+def _process_alive(pid):
+    if os.name == "nt":
+        # Signal 0 is CTRL_C_EVENT on Windows; never adopt another worker's log there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_write_buffer():
+    """Process-wide write-behind buffer, started on first use"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer(
+                    Config.PINECONE_WRITE_LOG,
+                    _upsert_batch,
+                    batch_size=Config.PINECONE_BATCH_SIZE,
+                    flush_interval_ms=Config.PINECONE_FLUSH_INTERVAL_MS
+                )
+                atexit.register(_buffer.close)
+    return _buffer
+
+async def save_profile_to_pinecone(profile_data, vector=None):
+    """Queue user profile for Pinecone"""
+    try:
         user_id = f"user_{profile_data['name'].lower().replace(' ', '_')}_{int(datetime.now().timestamp())}"
         
-        # Store profile with metadata
-        vector = [0.1] * 384  # Placeholder vector
+        if vector is None:
+            vector = embed_text(profile_text(profile_data))
         
-        index.upsert(
-            vectors=[{
-                "id": user_id,
-                "values": vector,
-                "metadata": {
-                    "type": "profile",
-                    "name": profile_data['name'],
-                    "age": profile_data['age'],
-                    "voice": profile_data['voice'],
-                    "created_at": datetime.now().isoformat()
-                }
-            }]
-        )
+        get_write_buffer().enqueue({
+            "id": user_id,
+            "values": [float(x) for x in vector],
+            "metadata": {
+                "type": "profile",
+                "name": profile_data['name'],
+                "age": profile_data['age'],
+                "voice": profile_data['voice'],
+                "created_at": datetime.now().isoformat()
+            }
+        })
         
-        print(f"✅ Profile saved to Pinecone: {user_id}")
+        print(f"✅ Profile queued for Pinecone: {user_id}")
     except Exception as e:
         print(f"❌ Error saving profile to Pinecone: {e}")
 
-async def save_book_to_pinecone(book_data):
-    """Save completed book to Pinecone"""
+async def save_book_to_pinecone(book_data, vector=None):
+    """Queue completed book for Pinecone"""
     try:
-        index = get_or_create_index()
-        if not index:
-            return
-        
         book_id = f"book_{book_data['id']}"
         
         # Create summary for embedding
         summary = f"Theme: {book_data['theme']}. Pages: {len(book_data['pages'])}. Completed by: {book_data['userName']}"
         
-        # Placeholder vector
-        vector = [0.1] * 384
+        if vector is None:
+            vector = embed_text(book_text(book_data))
         
-        index.upsert(
-            vectors=[{
-                "id": book_id,
-                "values": vector,
-                "metadata": {
-                    "type": "book",
-                    "theme": book_data['theme'],
-                    "pages_count": len(book_data['pages']),
-                    "user_name": book_data['userName'],
-                    "completed_at": book_data['completedAt'],
-                    "summary": summary
-                }
-            }]
-        )
+        get_write_buffer().enqueue({
+            "id": book_id,
+            "values": [float(x) for x in vector],
+            "metadata": {
+                "type": "book",
+                "theme": book_data['theme'],
+                "pages_count": len(book_data['pages']),
+                "user_name": book_data['userName'],
+                "completed_at": book_data['completedAt'],
+                "summary": summary
+            }
+        })
         
-        print(f"✅ Book saved to Pinecone: {book_id}")
+        print(f"✅ Book queued for Pinecone: {book_id}")
     except Exception as e:
         print(f"❌ Error saving book to Pinecone: {e}")
-
@@ -0,0 +1,148 @@
+# profiling.py
+"""
+Opt-in profiling for production workers
+- ProfilingMiddleware captures a cProfile of a request (X-Profile: 1 with
+  the admin token, or a random PROFILE_SAMPLE_RATE fraction) and writes it
+  to PROFILE_DIR as <request id>.prof plus a readable .txt summary
+- router exposes admin-token-guarded tracemalloc snapshots and diffs
+Nothing here is installed unless PROFILING_ENABLED is set.
+"""
+
+import io
+import os
+import asyncio
+import time
+import pstats
+import random
+import cProfile
+import secrets
+import threading
+import tracemalloc
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
+
+from config import Config
+from tracing import authorized, request_id
+
+# cProfile hooks the whole thread, so only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def _write_profile(profiler: cProfile.Profile, name: str, elapsed: float) -> str:
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(Config.PROFILE_DIR, f"{name}.prof")
+    profiler.dump_stats(path)
+
+    summary = io.StringIO()
+    summary.write(f"{name}: {elapsed * 1000:.1f} ms wall\n")
+    summary.write("Other requests served by this worker meanwhile are included; to_thread work is not.\n\n")
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+    with open(os.path.join(Config.PROFILE_DIR, f"{name}.txt"), "w", encoding="utf-8") as f:
+        f.write(summary.getvalue())
+    return path
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requested or sampled requests with cProfile"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        requested = headers.get(b"x-profile") == b"1" and authorized(
+            headers.get(b"x-admin-token", b"").decode("latin-1")
+        )
+        if not (requested or random.random() < Config.PROFILE_SAMPLE_RATE):
+            await self.app(scope, receive, send)
+            return
+        if not _profile_lock.acquire(blocking=False):
+            # Another request is being profiled on this worker
+            await self.app(scope, receive, send)
+            return
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request_id.get() or secrets.token_hex(8)}"
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                profiler.disable()
+        finally:
+            _profile_lock.release()
+        # pstats formatting and the file writes take a while; keep the event loop free
+        path = await asyncio.to_thread(_write_profile, profiler, name, time.perf_counter() - start)
+        print(f"🔬 Profiled {scope['method']} {scope['path']} -> {path}")
+
+
+router = APIRouter(prefix="/admin/tracemalloc", include_in_schema=False)
+_baseline = None
+
+
+def _require_admin(token: Optional[str]):
+    if not authorized(token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def _top_stats(stats, limit: int):
+    return [
+        {
+            'location': str(stat.traceback[0]) if stat.traceback else "?",
+            'size_kb': round(stat.size / 1024, 1),
+            'size_diff_kb': round(getattr(stat, 'size_diff', 0) / 1024, 1),
+            'count': stat.count,
+            'count_diff': getattr(stat, 'count_diff', 0)
+        }
+        for stat in stats[:limit]
+    ]
+
+
+@router.post("/start")
+async def start_tracemalloc(frames: int = 10, x_admin_token: Optional[str] = Header(None)):
+    """Start tracing allocations (slows allocation-heavy code while running)"""
+    _require_admin(x_admin_token)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return {'tracing': True, 'frames': tracemalloc.get_traceback_limit()}
+
+
+@router.post("/snapshot")
+async def take_snapshot(limit: int = 25, x_admin_token: Optional[str] = Header(None)):
+    """Take a snapshot, keep it as the baseline for /diff and return the largest allocation sites"""
+    global _baseline
+    _require_admin(x_admin_token)
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not running; POST /admin/tracemalloc/start first")
+    # Snapshots of a large heap take a while; keep the event loop free
+    _baseline = await asyncio.to_thread(tracemalloc.take_snapshot)
+    top = await asyncio.to_thread(lambda: _top_stats(_baseline.statistics("lineno"), limit))
+    current, peak = tracemalloc.get_traced_memory()
+    return {'traced_kb': round(current / 1024, 1), 'peak_kb': round(peak / 1024, 1), 'top': top}
+
+
+@router.get("/diff")
+async def diff_snapshot(limit: int = 25, x_admin_token: Optional[str] = Header(None)):
+    """Allocation growth since the baseline snapshot, largest first"""
+    _require_admin(x_admin_token)
+    if _baseline is None or not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="Take a baseline with POST /admin/tracemalloc/snapshot first")
+    snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+    top = await asyncio.to_thread(lambda: _top_stats(snapshot.compare_to(_baseline, "lineno"), limit))
+    return {'top': top}
+
+
+@router.post("/stop")
+async def stop_tracemalloc(x_admin_token: Optional[str] = Header(None)):
+    """Stop tracing and drop the baseline"""
+    global _baseline
+    _require_admin(x_admin_token)
+    tracemalloc.stop()
+    _baseline = None
+    return {'tracing': False}
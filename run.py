@@ -4,13 +4,25 @@ BridgeTales AI API Server
 Run this script to start the FastAPI server
 """
 
+import os
+import argparse
 import uvicorn
 from config import Config
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start the BridgeTales AI API server")
+    parser.add_argument("--workers", type=int, default=Config.WORKERS, help="Worker processes (default: WEB_CONCURRENCY or 1)")
+    args = parser.parse_args()
+    
     print("🚀 Starting BridgeTales AI API Server...")
     print(f"📍 Environment: {Config.ENVIRONMENT}")
     print(f"🌐 Host: {Config.API_HOST}:{Config.API_PORT}")
+    print(f"👷 Workers: {args.workers}")
+    
+    if args.workers > 1 and "STATE_BACKEND" not in os.environ:
+        # Workers inherit the environment, so they all agree on a shared backend
+        os.environ["STATE_BACKEND"] = "sqlite"
+        print("🗄️ Using SQLite shared state across workers (set STATE_BACKEND=redis for several hosts)")
     
     # Validate configuration
     if not Config.validate_config():
@@ -22,6 +34,8 @@ if __name__ == "__main__":
         "main:app",
         host=Config.API_HOST,
         port=Config.API_PORT,
-        reload=Config.ENVIRONMENT == "development",
+        # Reload mode only supports a single worker
+        reload=Config.ENVIRONMENT == "development" and args.workers == 1,
+        workers=args.workers,
         log_level=Config.LOG_LEVEL.lower()
     )
@@ -0,0 +1,152 @@
+"""
+Vectorized geo ranking for business search results
+Computes real distances for a whole batch at once, filters by radius and
+ranks by a combined distance/relevance score
+"""
+
+import numpy as np
+from typing import List, Dict, Optional
+
+EARTH_RADIUS_M = 6371008.8
+
+# Weight of proximity vs. provider relevance in the combined score
+DEFAULT_DISTANCE_WEIGHT = 0.6
+
+
+def haversine_distances(
+    latitude: float,
+    longitude: float,
+    latitudes: np.ndarray,
+    longitudes: np.ndarray
+) -> np.ndarray:
+    """
+    Great-circle distance in meters from one origin to many points
+
+    Args:
+        latitude: Origin latitude in degrees
+        longitude: Origin longitude in degrees
+        latitudes: Array of point latitudes in degrees
+        longitudes: Array of point longitudes in degrees
+
+    Returns:
+        float64 array of distances in meters (NaN where a coordinate is NaN)
+    """
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(longitudes, dtype=np.float64) - longitude)
+
+    a = np.sin(dlat * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon * 0.5) ** 2
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def rank_points(
+    latitude: float,
+    longitude: float,
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    relevance: Optional[np.ndarray] = None,
+    radius: Optional[float] = None,
+    max_results: Optional[int] = None,
+    distance_weight: float = DEFAULT_DISTANCE_WEIGHT
+):
+    """
+    Rank raw coordinate arrays (e.g. a loaded POI set) around an origin
+
+    Points with unknown distance (NaN) are never dropped by the radius
+    filter, but always rank after every point with a known distance.
+
+    Returns:
+        Tuple of (indices into the input arrays, distances in meters)
+    """
+    distances = haversine_distances(latitude, longitude, latitudes, longitudes)
+    count = distances.shape[0]
+    if count == 0:
+        return np.empty(0, dtype=np.int64), distances
+
+    if relevance is None:
+        # Providers return results best-first, so input order is relevance
+        relevance = 1.0 - np.arange(count, dtype=np.float64) / count
+    else:
+        relevance = np.asarray(relevance, dtype=np.float64)
+
+    return _rank_distances(distances, relevance, radius, max_results, distance_weight)
+
+
+def rank_businesses(
+    businesses: List[Dict],
+    latitude: float,
+    longitude: float,
+    radius: Optional[float] = None,
+    max_results: Optional[int] = None,
+    distance_weight: float = DEFAULT_DISTANCE_WEIGHT
+) -> List[Dict]:
+    """
+    Rank business dictionaries from any provider by distance and relevance
+
+    Real distances are computed from each business' coordinates and written
+    back into its 'distance' field. Businesses without coordinates keep the
+    distance the provider reported, if any.
+
+    Args:
+        businesses: Business dictionaries (AWS, Google, demo or merged)
+        latitude: User's latitude
+        longitude: User's longitude
+        radius: Drop businesses farther than this many meters
+        max_results: Maximum number of results to return
+        distance_weight: 0..1 share of proximity in the combined score
+
+    Returns:
+        New list of business dictionaries, best first
+    """
+    if not businesses:
+        return []
+
+    count = len(businesses)
+    latitudes = np.full(count, np.nan)
+    longitudes = np.full(count, np.nan)
+    reported = np.full(count, np.nan)
+    for i, business in enumerate(businesses):
+        lat = business.get('latitude')
+        lng = business.get('longitude')
+        if lat is not None and lng is not None:
+            latitudes[i] = lat
+            longitudes[i] = lng
+        elif business.get('distance') is not None:
+            reported[i] = business['distance']
+
+    distances = haversine_distances(latitude, longitude, latitudes, longitudes)
+    distances = np.where(np.isnan(distances), reported, distances)
+
+    relevance = 1.0 - np.arange(count, dtype=np.float64) / count
+    order, _ = _rank_distances(distances, relevance, radius, max_results, distance_weight)
+
+    ranked = []
+    for i in order:
+        business = dict(businesses[i])
+        if not np.isnan(distances[i]):
+            business['distance'] = round(float(distances[i]), 1)
+        ranked.append(business)
+    return ranked
+
+
+def _rank_distances(distances, relevance, radius, max_results, distance_weight):
+    """Shared scoring for precomputed distances"""
+    known = ~np.isnan(distances)
+    candidates = np.flatnonzero(known & (distances <= radius)) if radius else np.flatnonzero(known)
+
+    if candidates.size:
+        scale = float(radius) if radius else float(distances[candidates].max()) or 1.0
+        proximity = 1.0 - np.minimum(distances[candidates] / scale, 1.0)
+        score = distance_weight * proximity + (1.0 - distance_weight) * relevance[candidates]
+        order = candidates[np.argsort(-score, kind="stable")]
+    else:
+        order = candidates
+
+    unknown = np.flatnonzero(~known)
+    if unknown.size:
+        order = np.concatenate([order, unknown[np.argsort(-relevance[unknown], kind="stable")]])
+
+    if max_results is not None:
+        order = order[:max_results]
+    return order, distances
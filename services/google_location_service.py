@@ -3,13 +3,43 @@ Google Places API Location Service
 Alternative to AWS Location Service for local business discovery
 """
 
-import requests
 import json
+import asyncio
 from typing import List, Dict, Optional
 import os
+from config import Config
+from deadlines import run_in_thread, timeout
+
+def _http_get(url: str, params: Dict):
+    """requests.get; requests is imported on first use to keep startup fast"""
+    import requests
+    return requests.get(
+        url, params=params, timeout=(Config.PROVIDER_CONNECT_TIMEOUT, timeout(Config.PROVIDER_READ_TIMEOUT))
+    )
+
+if Config.CASSETTE_MODE in ("record", "replay"):
+    import cassette
+    _http_get = cassette.wrap_http_get(_http_get, "google.places")
+
+class GooglePlacesError(RuntimeError):
+    """Google Places answered with an error status (quota, denied request, ...)"""
+
+def _results(data: Dict) -> List[Dict]:
+    """Places from a search response; raises on anything but OK or ZERO_RESULTS"""
+    status = data.get('status')
+    if status == 'ZERO_RESULTS':
+        return []
+    if status != 'OK':
+        raise GooglePlacesError(f"{status}: {data.get('error_message', 'Unknown error')}")
+    return data.get('results', [])
 
 class GoogleLocationService:
-    """Google Places API integration for local business discovery"""
+    """
+    Google Places API integration for local business discovery
+
+    Searches raise on transport errors and error statuses, so LocationService
+    records the failure (cooldown, latency) instead of an empty success.
+    """
     
     def __init__(self):
         """Initialize Google Places API client"""
@@ -38,56 +68,50 @@ class GoogleLocationService:
             List of business information dictionaries
         """
         if not self.api_key:
-            print("⚠️ Google Places API key not found")
-            return []
-            
-        try:
-            # Prepare search parameters
-            params = {
-                'location': f"{latitude},{longitude}",
-                'radius': radius,
-                'key': self.api_key,
-                'type': business_type or 'establishment'
+            raise GooglePlacesError("Google Places API key not found")
+        
+        # Prepare search parameters
+        params = {
+            'location': f"{latitude},{longitude}",
+            'radius': radius,
+            'key': self.api_key,
+            'type': business_type or 'establishment'
+        }
+        
+        # Perform the search
+        response = await run_in_thread(_http_get, f"{self.base_url}/nearbysearch/json", params)
+        response.raise_for_status()
+        
+        # Extract and format business information
+        businesses = []
+        for place in _results(response.json())[:max_results]:
+            business_info = {
+                'name': place.get('name', 'Unknown'),
+                'address': place.get('vicinity', ''),
+                'phone': '',  # Will be filled by place details
+                'website': '',  # Will be filled by place details
+                'categories': [cat for cat in place.get('types', [])],
+                'latitude': place.get('geometry', {}).get('location', {}).get('lat'),
+                'longitude': place.get('geometry', {}).get('location', {}).get('lng'),
+                'distance': place.get('distance', 0),
+                'rating': place.get('rating', 0),
+                'place_id': place.get('place_id', '')
             }
             
-            # Perform the search
-            response = requests.get(f"{self.base_url}/nearbysearch/json", params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if data.get('status') != 'OK':
-                print(f"Google Places API error: {data.get('error_message', 'Unknown error')}")
-                return []
-            
-            # Extract and format business information
-            businesses = []
-            for place in data.get('results', [])[:max_results]:
-                business_info = {
-                    'name': place.get('name', 'Unknown'),
-                    'address': place.get('vicinity', ''),
-                    'phone': '',  # Will be filled by place details
-                    'website': '',  # Will be filled by place details
-                    'categories': [cat for cat in place.get('types', [])],
-                    'latitude': place.get('geometry', {}).get('location', {}).get('lat'),
-                    'longitude': place.get('geometry', {}).get('location', {}).get('lng'),
-                    'distance': place.get('distance', 0),
-                    'rating': place.get('rating', 0),
-                    'place_id': place.get('place_id', '')
-                }
-                
-                # Get additional details
-                if business_info['place_id']:
-                    details = await self._get_place_details(business_info['place_id'])
-                    business_info.update(details)
-                
-                businesses.append(business_info)
-            
-            return businesses
-            
-        except Exception as e:
-            print(f"Error searching nearby businesses: {e}")
-            return []
+            businesses.append(business_info)
+        
+        await self._add_place_details(businesses)
+        return businesses
+        
+    
+    async def _add_place_details(self, businesses: List[Dict]):
+        """Fetch phone/website for all businesses concurrently"""
+        with_ids = [business for business in businesses if business['place_id']]
+        details = await asyncio.gather(
+            *(self._get_place_details(business['place_id']) for business in with_ids)
+        )
+        for business, detail in zip(with_ids, details):
+            business.update(detail)
     
     async def _get_place_details(self, place_id: str) -> Dict:
         """Get detailed information about a place"""
@@ -98,7 +122,7 @@ class GoogleLocationService:
                 'key': self.api_key
             }
             
-            response = requests.get(f"{self.base_url}/details/json", params=params)
+            response = await run_in_thread(_http_get, f"{self.base_url}/details/json", params)
             response.raise_for_status()
             
             data = response.json()
@@ -121,7 +145,8 @@ class GoogleLocationService:
         search_text: str, 
         latitude: float, 
         longitude: float,
-        max_results: int = 10
+        max_results: int = 10,
+        radius: int = 5000
     ) -> List[Dict]:
         """
         Search for businesses by text query using Google Places API
@@ -131,61 +156,47 @@ class GoogleLocationService:
             latitude: User's latitude
             longitude: User's longitude
             max_results: Maximum number of results to return
+            radius: Location bias radius in meters
             
         Returns:
             List of business information dictionaries
         """
         if not self.api_key:
-            print("⚠️ Google Places API key not found")
-            return []
-            
-        try:
-            # Prepare search parameters
-            params = {
-                'query': search_text,
-                'location': f"{latitude},{longitude}",
-                'radius': 5000,
-                'key': self.api_key
+            raise GooglePlacesError("Google Places API key not found")
+        
+        # Prepare search parameters
+        params = {
+            'query': search_text,
+            'location': f"{latitude},{longitude}",
+            'radius': radius,
+            'key': self.api_key
+        }
+        
+        # Perform the search
+        response = await run_in_thread(_http_get, f"{self.base_url}/textsearch/json", params)
+        response.raise_for_status()
+        
+        # Extract and format business information
+        businesses = []
+        for place in _results(response.json())[:max_results]:
+            business_info = {
+                'name': place.get('name', 'Unknown'),
+                'address': place.get('formatted_address', ''),
+                'phone': '',
+                'website': '',
+                'categories': [cat for cat in place.get('types', [])],
+                'latitude': place.get('geometry', {}).get('location', {}).get('lat'),
+                'longitude': place.get('geometry', {}).get('location', {}).get('lng'),
+                'distance': 0,  # Filled in by LocationService ranking
+                'rating': place.get('rating', 0),
+                'place_id': place.get('place_id', '')
             }
             
-            # Perform the search
-            response = requests.get(f"{self.base_url}/textsearch/json", params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if data.get('status') != 'OK':
-                print(f"Google Places API error: {data.get('error_message', 'Unknown error')}")
-                return []
-            
-            # Extract and format business information
-            businesses = []
-            for place in data.get('results', [])[:max_results]:
-                business_info = {
-                    'name': place.get('name', 'Unknown'),
-                    'address': place.get('formatted_address', ''),
-                    'phone': '',
-                    'website': '',
-                    'categories': [cat for cat in place.get('types', [])],
-                    'latitude': place.get('geometry', {}).get('location', {}).get('lat'),
-                    'longitude': place.get('geometry', {}).get('location', {}).get('lng'),
-                    'distance': 0,  # Text search doesn't provide distance
-                    'rating': place.get('rating', 0),
-                    'place_id': place.get('place_id', '')
-                }
-                
-                # Get additional details
-                if business_info['place_id']:
-                    details = await self._get_place_details(business_info['place_id'])
-                    business_info.update(details)
-                
-                businesses.append(business_info)
-            
-            return businesses
-            
-        except Exception as e:
-            print(f"Error searching businesses by text: {e}")
-            return []
+            businesses.append(business_info)
+        
+        await self._add_place_details(businesses)
+        return businesses
+        
     
     async def check_google_places_connection(self) -> bool:
         """Check if Google Places API is accessible"""
@@ -199,7 +210,7 @@ class GoogleLocationService:
                 'key': self.api_key
             }
             
-            response = requests.get(f"{self.base_url}/textsearch/json", params=params)
+            response = await run_in_thread(_http_get, f"{self.base_url}/textsearch/json", params)
             return response.status_code == 200
             
         except Exception as e:
@@ -1,28 +1,120 @@
-import boto3
 import json
-from typing import List, Dict, Optional
+import time
+import heapq
+import asyncio
+from typing import List, Dict, Optional, Callable, Awaitable
 from config import Config
+from clients import get_aws_client
+from metrics import observe_stage
+from tracing import span
+from deadlines import run_in_thread, remaining, DeadlineExceeded
 from .google_location_service import GoogleLocationService
+from .geo_ranking import rank_businesses, haversine_distances
+from .name_index import BusinessNameIndex
+from shared_state import get_json, set_json
 
 PLACE_INDEX_NAME = "HackathonPlaceIndex"
+
+# Same-named results closer than this are treated as one business when merging
+DUPLICATE_DISTANCE_M = 75
+
+
+class ProviderStats:
+    """
+    Health and latency bookkeeping for one location provider
+    
+    Availability is also published to the shared state backend, so one
+    worker's health check or failure is seen by every other worker.
+    """
+    
+    def __init__(self, name: str, alpha: float = 0.3):
+        self.name = name
+        self.alpha = alpha
+        self.latency = None  # EWMA of successful call latency in seconds
+        self.available = None  # Result of the last health check or call
+        self.checked_at = 0.0
+        self.successes = 0
+        self.failures = 0
+    
+    def is_fresh(self) -> bool:
+        """Whether the last availability result can still be trusted"""
+        if self.available is not None:
+            ttl = Config.LOCATION_AVAILABILITY_TTL if self.available else Config.LOCATION_RETRY_AFTER
+            if time.monotonic() - self.checked_at < ttl:
+                return True
+        
+        # Another worker may have checked more recently
+        shared = get_json(f"location:available:{self.name}")
+        if shared is None:
+            return False
+        self.available = shared
+        self.checked_at = time.monotonic()
+        return True
+    
+    def in_cooldown(self) -> bool:
+        """Whether the provider recently failed and should be skipped"""
+        return self.available is False and self.is_fresh()
+    
+    def mark(self, available: bool):
+        if available != self.available or not available:
+            ttl = Config.LOCATION_AVAILABILITY_TTL if available else Config.LOCATION_RETRY_AFTER
+            set_json(f"location:available:{self.name}", available, ttl=ttl)
+        self.available = available
+        self.checked_at = time.monotonic()
+    
+    def record_success(self, seconds: float):
+        self.successes += 1
+        self.latency = seconds if self.latency is None else (
+            self.alpha * seconds + (1 - self.alpha) * self.latency
+        )
+        self.mark(True)
+    
+    def record_abandoned(self, seconds: float):
+        # An abandoned call took at least this long
+        self.latency = seconds if self.latency is None else max(self.latency, seconds)
+    
+    def record_failure(self, seconds: float):
+        self.failures += 1
+        self.record_abandoned(seconds)
+        self.mark(False)
+    
+    def to_dict(self) -> Dict:
+        return {
+            'available': self.available,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'successes': self.successes,
+            'failures': self.failures
+        }
+
+
 class LocationService:
     """AWS Location Service integration for local business discovery"""
     
     def __init__(self):
-        """Initialize AWS Location Service client"""
-        self.client = boto3.client(
-            'location',
-            region_name=Config.AWS_REGION,
-            aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY
-        )
-        
+        """Set up providers; the AWS Location client is built on first use"""
         # Place index name - you'll need to create this in AWS Console
         self.place_index_name = PLACE_INDEX_NAME
         
         # Initialize Google Places as fallback
         self.google_service = GoogleLocationService()
-        self.aws_available = None  # Will be set on first check
+        
+        # Availability is re-checked after a TTL, so a transient failure
+        # doesn't pin the process to one provider
+        self.provider_stats = {
+            "aws": ProviderStats("aws"),
+            "google": ProviderStats("google")
+        }
+        
+        # Names of every business providers have returned, for story LOCATION matching
+        self.name_index = BusinessNameIndex(
+            capacity=Config.NAME_INDEX_CAPACITY,
+            min_similarity=Config.NAME_INDEX_MIN_SIMILARITY
+        )
+    
+    @property
+    def client(self):
+        """AWS Location client (see clients.get_aws_client)"""
+        return get_aws_client('location', Config.AWS_REGION)
     
     async def search_nearby_businesses(
         self, 
@@ -45,14 +137,17 @@ class LocationService:
         Returns:
             List of business information dictionaries
         """
-        service = await self._get_available_service()
-        
-        if service == "aws":
-            return await self._search_aws_nearby(latitude, longitude, radius, categories, max_results)
-        elif service == "google":
-            return await self.google_service.search_nearby_businesses(latitude, longitude, radius, None, max_results)
-        else:
+        providers = {
+            "aws": lambda: self._search_aws_nearby(latitude, longitude, radius, categories, max_results),
+            "google": lambda: self.google_service.search_nearby_businesses(
+                latitude, longitude, radius, None, max_results
+            )
+        }
+        businesses = await self._search_providers(providers, latitude, longitude, radius, max_results)
+        if businesses is None:
             return await self._get_demo_businesses()
+        
+        return rank_businesses(businesses, latitude, longitude, radius=radius, max_results=max_results)
     
     async def _search_aws_nearby(
         self, 
@@ -75,8 +170,8 @@ class LocationService:
             if categories:
                 search_params['FilterCategories'] = categories
             
-            # Perform the search
-            response = self.client.search_place_index_for_position(**search_params)
+            # Perform the search off the event loop, within the request deadline
+            response = await run_in_thread(self.client.search_place_index_for_position, **search_params)
             
             # Extract and format business information
             businesses = []
@@ -98,14 +193,15 @@ class LocationService:
             
         except Exception as e:
             print(f"Error searching nearby businesses with AWS: {e}")
-            return []
+            raise
     
     async def search_businesses_by_text(
         self, 
         search_text: str, 
         latitude: float, 
         longitude: float,
-        max_results: int = 10
+        max_results: int = 10,
+        radius: int = 5000
     ) -> List[Dict]:
         """
         Search for businesses by text query using the best available service
@@ -115,18 +211,22 @@ class LocationService:
             latitude: User's latitude
             longitude: User's longitude
             max_results: Maximum number of results to return
+            radius: Only return businesses within this many meters
             
         Returns:
-            List of business information dictionaries
+            List of business information dictionaries, nearest/most relevant first
         """
-        service = await self._get_available_service()
-        
-        if service == "aws":
-            return await self._search_aws_text(search_text, latitude, longitude, max_results)
-        elif service == "google":
-            return await self.google_service.search_businesses_by_text(search_text, latitude, longitude, max_results)
-        else:
+        providers = {
+            "aws": lambda: self._search_aws_text(search_text, latitude, longitude, max_results),
+            "google": lambda: self.google_service.search_businesses_by_text(
+                search_text, latitude, longitude, max_results, radius
+            )
+        }
+        businesses = await self._search_providers(providers, latitude, longitude, radius, max_results)
+        if businesses is None:
             return await self._get_demo_businesses()
+        
+        return rank_businesses(businesses, latitude, longitude, radius=radius, max_results=max_results)
     
     async def _search_aws_text(
         self, 
@@ -145,8 +245,8 @@ class LocationService:
                 'MaxResults': max_results * 5  # Get many more results to filter for local only
             }
             
-            # Perform the search
-            response = self.client.search_place_index_for_text(**search_params)
+            # Perform the search off the event loop, within the request deadline
+            response = await run_in_thread(self.client.search_place_index_for_text, **search_params)
             
             # Extract and format business information - LOCAL BUSINESSES ONLY
             businesses = []
@@ -205,14 +305,15 @@ class LocationService:
             
         except Exception as e:
             print(f"Error searching businesses by text with AWS: {e}")
-            return []
+            raise
     
     async def find_story_related_businesses(
         self, 
         story_context: str, 
         latitude: float, 
         longitude: float,
-        max_results: int = 5
+        max_results: int = 5,
+        radius: int = 5000
     ) -> List[Dict]:
         """
         Find businesses related to story context using intelligent search
@@ -222,6 +323,7 @@ class LocationService:
             latitude: User's latitude
             longitude: User's longitude
             max_results: Maximum number of results to return
+            radius: Only return businesses within this many meters
             
         Returns:
             List of relevant business information dictionaries
@@ -235,18 +337,56 @@ class LocationService:
             # Search for each relevant term
             for term in search_terms[:3]:  # Limit to top 3 terms
                 businesses = await self.search_businesses_by_text(
-                    term, latitude, longitude, max_results=3
+                    term, latitude, longitude, max_results=3, radius=radius
                 )
                 all_businesses.extend(businesses)
             
-            # Remove duplicates and sort by relevance
+            # Remove duplicates and rank the merged set by distance/relevance
             unique_businesses = self._deduplicate_businesses(all_businesses)
-            return unique_businesses[:max_results]
+            return rank_businesses(
+                unique_businesses, latitude, longitude, radius=radius, max_results=max_results
+            )
             
         except Exception as e:
             print(f"Error finding story-related businesses: {e}")
             return await self._get_demo_businesses()
     
+    async def resolve_story_location(
+        self,
+        location: str,
+        latitude: float,
+        longitude: float,
+        radius: int = 5000
+    ) -> Optional[Dict]:
+        """
+        Resolve a story's LOCATION (e.g. "Sunny Side Cafe") to a real nearby business
+        
+        The name index is consulted first; providers are only queried when it
+        has no good match, and their results are indexed for next time.
+        
+        Args:
+            location: Place name extracted from the story
+            latitude: User's latitude
+            longitude: User's longitude
+            radius: Only match businesses within this many meters
+            
+        Returns:
+            Business information dictionary with 'match_score', or None
+        """
+        if not location or not location.strip():
+            return None
+        
+        match = self.name_index.match(location, latitude, longitude, radius, record_miss=False)
+        if match:
+            return match
+        
+        try:
+            await self.search_businesses_by_text(location, latitude, longitude, max_results=5, radius=radius)
+        except Exception as e:
+            # Still probe again below so the lookup's outcome is counted once
+            print(f"Error resolving story location: {e}")
+        return self.name_index.match(location, latitude, longitude, radius)
+    
     def _extract_search_terms(self, story_context: str) -> List[str]:
         """
         Extract relevant search terms from story context
@@ -294,33 +434,185 @@ class LocationService:
         
         return unique_businesses
     
+    async def _search_providers(
+        self,
+        providers: Dict[str, Callable[[], Awaitable[List[Dict]]]],
+        latitude: float,
+        longitude: float,
+        radius: int,
+        max_results: int
+    ) -> Optional[List[Dict]]:
+        """Run a search against the providers; None means none could answer"""
+        if Config.LOCATION_MULTI_PROVIDER:
+            return await self._race_providers(providers, latitude, longitude, radius, max_results)
+        
+        # Single-provider mode: fastest healthy provider first, fall through on failure
+        for name in self._provider_order():
+            if not await self._check_provider_availability(name):
+                continue
+            try:
+                return await self._timed_provider_call(name, providers[name])
+            except Exception as e:
+                print(f"⚠️ {name} location search failed, trying next provider: {e}")
+        
+        print("⚠️ No location services available, using demo data")
+        return None
+    
+    async def _race_providers(
+        self,
+        providers: Dict[str, Callable[[], Awaitable[List[Dict]]]],
+        latitude: float,
+        longitude: float,
+        radius: int,
+        max_results: int
+    ) -> Optional[List[Dict]]:
+        """
+        Query all usable providers concurrently and k-way merge by distance
+        
+        Returns as soon as enough unique results have arrived or the race
+        deadline passes. Providers still running at that point are abandoned
+        and charged the elapsed time as latency.
+        """
+        started = time.monotonic()
+        tasks = {}
+        for name in self._provider_order():
+            if self.provider_stats[name].in_cooldown():
+                continue
+            if name == "google" and not self.google_service.api_key:
+                continue
+            tasks[asyncio.create_task(self._timed_provider_call(name, providers[name]))] = name
+        
+        if not tasks:
+            print("⚠️ No location services available, using demo data")
+            return None
+        
+        results = {}
+        pending = set(tasks)
+        race_timeout = Config.LOCATION_RACE_TIMEOUT
+        left = remaining()
+        if left is not None:
+            race_timeout = max(0.0, min(race_timeout, left))
+        deadline = started + race_timeout
+        while pending:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.exception():
+                    results[tasks[task]] = task.result()
+            if len(self._merge_by_distance(results, latitude, longitude, radius)) >= max_results:
+                break
+        
+        # Cut short by the request's own deadline isn't the provider's fault
+        timed_out = time.monotonic() >= deadline and race_timeout >= Config.LOCATION_RACE_TIMEOUT
+        for task in pending:
+            task.cancel()
+            stats = self.provider_stats[tasks[task]]
+            if timed_out:
+                # Too slow to be useful: skip it until the retry window passes
+                stats.record_failure(time.monotonic() - started)
+                print(f"⏱️ {tasks[task]} location search timed out after {race_timeout:.1f}s")
+            else:
+                stats.record_abandoned(time.monotonic() - started)
+        
+        if not results:
+            print("⚠️ No location provider answered in time, using demo data")
+            return None
+        return self._merge_by_distance(results, latitude, longitude, radius)
+    
+    async def _timed_provider_call(self, name: str, call: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        """Run one provider call and record its latency and outcome"""
+        stats = self.provider_stats[name]
+        started = time.monotonic()
+        try:
+            with observe_stage("location", provider=name):
+                businesses = await call()
+        except DeadlineExceeded:
+            stats.record_abandoned(time.monotonic() - started)
+            raise
+        except Exception:
+            stats.record_failure(time.monotonic() - started)
+            raise
+        stats.record_success(time.monotonic() - started)
+        for business in businesses:
+            business.setdefault('provider', name)
+        self.name_index.add_all(businesses)
+        return businesses
+    
+    def _merge_by_distance(
+        self,
+        results: Dict[str, List[Dict]],
+        latitude: float,
+        longitude: float,
+        radius: int
+    ) -> List[Dict]:
+        """K-way merge per-provider results by distance, dropping duplicates"""
+        sorted_lists = [
+            rank_businesses(businesses, latitude, longitude, radius=radius, distance_weight=1.0)
+            for businesses in results.values()
+        ]
+        merged = []
+        # Unknown distances sort last; a business at 0.0 m is still the nearest
+        key = lambda b: float('inf') if b.get('distance') is None else b['distance']
+        for business in heapq.merge(*sorted_lists, key=key):
+            if not any(self._is_same_business(business, kept) for kept in merged):
+                merged.append(business)
+        return merged
+    
+    def _is_same_business(self, a: Dict, b: Dict) -> bool:
+        """Same name and (same address or within a few dozen meters)"""
+        if a.get('name', '').strip().lower() != b.get('name', '').strip().lower():
+            return False
+        if a.get('address') and a.get('address') == b.get('address'):
+            return True
+        points = (a.get('latitude'), a.get('longitude'), b.get('latitude'), b.get('longitude'))
+        if None in points:
+            return False
+        separation = haversine_distances(points[0], points[1], [points[2]], [points[3]])[0]
+        return separation <= DUPLICATE_DISTANCE_M
+    
+    def _provider_order(self) -> List[str]:
+        """Providers ordered by observed latency; unmeasured ones keep AWS-first order"""
+        default_order = list(self.provider_stats)
+        return sorted(
+            default_order,
+            key=lambda name: (
+                self.provider_stats[name].latency is None,
+                self.provider_stats[name].latency or 0.0,
+                default_order.index(name)
+            )
+        )
+    
+    async def _check_provider_availability(self, name: str) -> bool:
+        """Check (or reuse a recent check of) a provider's availability"""
+        stats = self.provider_stats[name]
+        if stats.is_fresh():
+            return stats.available
+        
+        with span(f"health.{name}") as probe:
+            if name == "aws":
+                available = await self._check_aws_availability()
+            else:
+                available = await self.google_service.check_google_places_connection()
+                if available:
+                    print("✅ Google Places API is available")
+            if probe:
+                probe.set("available", available)
+        stats.mark(available)
+        return available
+    
     async def _check_aws_availability(self) -> bool:
-        """Check if AWS Location Service is available"""
-        if self.aws_available is not None:
-            return self.aws_available
-            
+        """Probe AWS Location Service"""
         try:
             # Try to list place indexes (this is a lightweight operation)
-            self.client.list_place_indexes()
-            self.aws_available = True
+            await asyncio.to_thread(self.client.list_place_indexes)
             print("✅ AWS Location Service is available")
             return True
         except Exception as e:
             print(f"AWS Location Service not available: {e}")
-            self.aws_available = False
             return False
     
-    async def _get_available_service(self):
-        """Get the best available location service"""
-        if await self._check_aws_availability():
-            return "aws"
-        elif await self.google_service.check_google_places_connection():
-            print("✅ Using Google Places API as fallback")
-            return "google"
-        else:
-            print("⚠️ No location services available, using demo data")
-            return "demo"
-    
     async def _get_demo_businesses(self) -> List[Dict]:
         """Get demo businesses for testing"""
         return [
@@ -352,4 +644,11 @@ class LocationService:
     
     async def check_location_service_connection(self) -> bool:
         """Check if any location service is accessible"""
-        return await self._check_aws_availability() or await self.google_service.check_google_places_connection()
+        for name in self.provider_stats:
+            if await self._check_provider_availability(name):
+                return True
+        return False
+    
+    def get_provider_stats(self) -> Dict[str, Dict]:
+        """Per-provider availability and latency snapshot"""
+        return {name: stats.to_dict() for name, stats in self.provider_stats.items()}
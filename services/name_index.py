@@ -0,0 +1,206 @@
+"""
+Trigram index over business names seen in provider results
+Resolves a story's invented LOCATION (e.g. "Sunny Side Cafe") to the best
+matching real business nearby without another provider call
+"""
+
+import re
+import time
+import unicodedata
+from collections import OrderedDict, Counter
+from typing import List, Dict, Optional
+
+from .geo_ranking import haversine_distances
+
+# Words that carry no identity in a business name
+STOP_WORDS = {"the", "a", "an", "of", "and", "&"}
+
+# Upper bounds (inclusive) of the similarity histogram buckets
+SIMILARITY_BUCKETS = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, strip accents, drop punctuation and stop words"""
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    words = re.findall(r"[a-z0-9]+", ascii_name.lower())
+    return " ".join(word for word in words if word not in STOP_WORDS)
+
+
+def trigrams(text: str) -> set:
+    """Padded character trigrams of a normalized name"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class BusinessNameIndex:
+    """Bounded LRU trigram index of business names"""
+
+    def __init__(self, capacity: int = 5000, min_similarity: float = 0.45):
+        self.capacity = capacity
+        self.min_similarity = min_similarity
+        self._entries = OrderedDict()  # key -> (business, trigrams)
+        self._postings = {}  # trigram -> set of keys
+
+        # Metrics
+        self.lookups = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_lookup_seconds = 0.0
+        self.max_lookup_seconds = 0.0
+        self.similarity_histogram = [0] * len(SIMILARITY_BUCKETS)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, business: Dict):
+        """Index one business; re-adding refreshes it"""
+        name = normalize_name(business.get('name', ''))
+        if not name:
+            return
+
+        lat = business.get('latitude')
+        lng = business.get('longitude')
+        position = (round(lat, 4), round(lng, 4)) if lat is not None and lng is not None else business.get('address', '')
+        key = (name, position)
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._entries[key] = (dict(business), self._entries[key][1])
+            return
+
+        grams = trigrams(name)
+        self._entries[key] = (dict(business), grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+        while len(self._entries) > self.capacity:
+            self._evict_oldest()
+
+    def add_all(self, businesses: List[Dict]):
+        for business in businesses:
+            self.add(business)
+
+    def _evict_oldest(self):
+        key, (_, grams) = self._entries.popitem(last=False)
+        for gram in grams:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+        self.evictions += 1
+
+    def match(
+        self,
+        location: str,
+        latitude: Optional[float] = None,
+        longitude: Optional[float] = None,
+        radius: Optional[float] = None,
+        min_similarity: Optional[float] = None,
+        record_miss: bool = True
+    ) -> Optional[Dict]:
+        """
+        Find the indexed business whose name best matches `location`
+
+        Args:
+            location: Free-text place name, e.g. the story's LOCATION
+            latitude: User's latitude (enables the radius filter)
+            longitude: User's longitude
+            radius: Ignore businesses farther than this many meters
+            min_similarity: Minimum Dice similarity of name trigrams
+            record_miss: Count a miss in the stats; False for a probe the caller
+                retries after fetching more businesses, so only the outcome counts
+
+        Returns:
+            Copy of the best business with 'match_score' (and 'distance'), or None
+        """
+        started = time.perf_counter()
+        threshold = self.min_similarity if min_similarity is None else min_similarity
+
+        best = self._best_candidate(location, latitude, longitude, radius, threshold)
+        if best is None and not record_miss:
+            return None
+
+        elapsed = time.perf_counter() - started
+        self.lookups += 1
+        self.total_lookup_seconds += elapsed
+        self.max_lookup_seconds = max(self.max_lookup_seconds, elapsed)
+        if best is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._record_similarity(best['match_score'])
+        return best
+
+    def _best_candidate(self, location, latitude, longitude, radius, threshold) -> Optional[Dict]:
+        query = trigrams(normalize_name(location))
+        if len(query) <= 1:
+            return None
+
+        shared = Counter()
+        for gram in query:
+            shared.update(self._postings.get(gram, ()))
+
+        # Dice >= t implies common >= t * |query| / 2, which prunes most
+        # candidates that only share a generic word like "cafe"
+        floor = threshold * len(query) / 2
+        scored = []
+        for key, common in shared.items():
+            if common < floor:
+                continue
+            business, grams = self._entries[key]
+            similarity = 2.0 * common / (len(query) + len(grams))
+            if similarity >= threshold:
+                scored.append((similarity, business))
+        if not scored:
+            return None
+
+        distances = [None] * len(scored)
+        if latitude is not None and longitude is not None:
+            lats = [b.get('latitude') if b.get('latitude') is not None else float('nan') for _, b in scored]
+            lngs = [b.get('longitude') if b.get('longitude') is not None else float('nan') for _, b in scored]
+            computed = haversine_distances(latitude, longitude, lats, lngs)
+            distances = [None if d != d else float(d) for d in computed]
+
+        best = None
+        best_rank = None
+        for (similarity, business), distance in zip(scored, distances):
+            if radius and distance is not None and distance > radius:
+                continue
+            rank = (similarity, -(distance if distance is not None else float('inf')))
+            if best_rank is None or rank > best_rank:
+                best, best_rank = (business, similarity, distance), rank
+        if best is None:
+            return None
+
+        business, similarity, distance = best
+        result = dict(business)
+        result['match_score'] = round(similarity, 3)
+        if distance is not None:
+            result['distance'] = round(distance, 1)
+        return result
+
+    def _record_similarity(self, similarity: float):
+        for i, upper in enumerate(SIMILARITY_BUCKETS):
+            if similarity <= upper:
+                self.similarity_histogram[i] += 1
+                return
+
+    def stats(self) -> Dict:
+        """Lookup latency and match-quality metrics"""
+        return {
+            'size': len(self._entries),
+            'capacity': self.capacity,
+            'trigrams': len(self._postings),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            'evictions': self.evictions,
+            'avg_lookup_ms': round(self.total_lookup_seconds / self.lookups * 1000, 4) if self.lookups else 0.0,
+            'max_lookup_ms': round(self.max_lookup_seconds * 1000, 4),
+            'similarity_histogram': {
+                f"<={upper}": count for upper, count in zip(SIMILARITY_BUCKETS, self.similarity_histogram)
+            }
+        }
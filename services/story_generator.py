@@ -2,51 +2,137 @@ import os
 import json
 import asyncio
 from typing import Dict, Optional, List, Any
-import boto3
-import openai
-from botocore.exceptions import ClientError, NoCredentialsError
 import logging
+from clients import get_aws_client, get_openai
+from metrics import observe_stage
+from tracing import span
+from shared_state import get_json, set_json
+from config import Config
+from deadlines import run_in_thread, timeout, DeadlineExceeded
+from disconnect import RequestCancelled, cancelled
+import usage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How long a Bedrock availability probe is trusted, shared by all workers (seconds)
+BEDROCK_AVAILABLE_TTL = 300
+BEDROCK_UNAVAILABLE_TTL = 30
+
+def ending_prompt(story_context: str) -> str:
+    """Prompt for the happy ending of a story so far"""
+    return f"{story_context}\n\nNow create a satisfying happy ending that wraps up the story beautifully. Make it heartwarming and conclusive with no more choices."
+
+def group_paragraphs(paragraphs: List[str], min_chars: int, final: bool = True) -> List[List[str]]:
+    """
+    Paragraphs grouped for narration, each group at least min_chars long
+
+    Unless final, a short trailing group is left out (more text may join it).
+    """
+    groups, current = [], []
+    for paragraph in paragraphs:
+        current.append(paragraph)
+        if sum(len(p) for p in current) >= min_chars:
+            groups.append(current)
+            current = []
+    if current and final:
+        groups.append(current)
+    return groups
+
+class StoryParagraphs:
+    """Finished paragraphs of the STORY section of a response still being written"""
+    
+    def __init__(self, min_chars: int = 0):
+        self.min_chars = min_chars
+        self.text = ""
+        self._sent = 0  # paragraphs already handed out
+    
+    def feed(self, delta: str) -> List[str]:
+        """Add streamed text; returns the paragraphs it completed"""
+        self.text += delta
+        return self._ready(final=False)
+    
+    def finish(self) -> List[str]:
+        """The response is complete; returns the paragraphs still held back"""
+        return self._ready(final=True)
+    
+    def story(self, final: bool = False) -> Optional[str]:
+        """The STORY section written so far, or None while its start is still unknown"""
+        section, _ = self._section(final)
+        return None if section is None else section.lstrip()
+    
+    def _section(self, final: bool):
+        """(STORY section so far, whether it is complete)"""
+        marker = self.text.find("STORY:")
+        if marker >= 0:
+            start = marker + len("STORY:")
+        elif not final and "STORY:".startswith(self.text.lstrip()[:6]):
+            return None, False  # the marker may still be arriving
+        else:
+            start = 0
+        ends = [i for i in (self.text.find("LOCATION:", start), self.text.find("CHOICES:", start)) if i >= 0]
+        section = self.text[start:min(ends)] if ends else self.text[start:]
+        return section, final or bool(ends)
+    
+    def _ready(self, final: bool) -> List[str]:
+        section, closed = self._section(final)
+        if section is None:
+            return []
+        
+        paragraphs = [p.strip() for p in section.split("\n\n")]
+        if not closed:
+            paragraphs = paragraphs[:-1]  # the last one may not be finished
+        paragraphs = [p for p in paragraphs if p]
+        groups = group_paragraphs(paragraphs[self._sent:], self.min_chars, final=closed)
+        self._sent += sum(len(group) for group in groups)
+        return ["\n\n".join(group) for group in groups]
+
 class StoryGenerator:
     def __init__(self):
         self.aws_region = os.getenv("AWS_REGION", "us-east-2")
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         
-        # Initialize AWS Bedrock client (primary)
+        # Bedrock (primary) and OpenAI (optional backup) clients are built on first use
+        if not self.openai_api_key:
+            logger.info("ℹ️  OpenAI API key not found - using Bedrock only")
+    
+    @property
+    def bedrock_client(self):
+        """AWS Bedrock runtime client, or None if it can't be constructed"""
         try:
-            self.bedrock_client = boto3.client(
-                'bedrock-runtime',
-                region_name=self.aws_region
-            )
-            logger.info(f"✅ AWS Bedrock client initialized for region: {self.aws_region}")
+            return get_aws_client('bedrock-runtime', self.aws_region)
         except Exception as e:
             logger.error(f"❌ Failed to initialize AWS Bedrock client: {e}")
-            self.bedrock_client = None
-        
-        # Initialize OpenAI client (optional backup)
-        if self.openai_api_key:
-            openai.api_key = self.openai_api_key
-            logger.info("✅ OpenAI client initialized successfully")
-        else:
-            logger.info("ℹ️  OpenAI API key not found - using Bedrock only")
+            return None
     
     async def check_bedrock_connection(self) -> bool:
         """Check if AWS Bedrock connection is available"""
         try:
             if not self.bedrock_client:
-                return False
-            
-            # List available models to test connection
-            bedrock_client_list = boto3.client('bedrock', region_name=self.aws_region)
-            response = bedrock_client_list.list_foundation_models()
-            return True
+                available = False
+            else:
+                # List available models to test connection
+                bedrock_client_list = get_aws_client('bedrock', self.aws_region)
+                with span("health.bedrock"):
+                    await asyncio.to_thread(bedrock_client_list.list_foundation_models)
+                available = True
         except Exception as e:
             logger.error(f"Bedrock connection check failed: {e}")
-            return False
+            available = False
+        
+        set_json(
+            "bedrock:available", available,
+            ttl=BEDROCK_AVAILABLE_TTL if available else BEDROCK_UNAVAILABLE_TTL
+        )
+        return available
+    
+    async def is_bedrock_available(self) -> bool:
+        """Recent probe result shared across workers, probing only when it has expired"""
+        cached = get_json("bedrock:available")
+        if cached is not None:
+            return cached
+        return await self.check_bedrock_connection()
     
     async def check_openai_connection(self) -> bool:
         """Check if OpenAI connection is available"""
@@ -55,11 +141,12 @@ class StoryGenerator:
                 return False
             
             # Test with a simple completion
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": "Hello"}],
-                max_tokens=5
-            )
+            with span("health.openai"):
+                response = await get_openai().ChatCompletion.acreate(
+                    model="gpt-3.5-turbo",
+                    messages=[{"role": "user", "content": "Hello"}],
+                    max_tokens=5
+                )
             return True
         except Exception as e:
             logger.error(f"OpenAI connection check failed: {e}")
@@ -259,58 +346,151 @@ class StoryGenerator:
             "choices": choices
         }
     
+    @staticmethod
+    def _bedrock_body(full_prompt: str, max_length: int, temperature: float) -> Dict[str, Any]:
+        return {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_length,
+            "temperature": temperature,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": full_prompt
+                }
+            ]
+        }
+    
     async def _generate_with_bedrock(self, prompt: str, max_length: int, 
                                    temperature: float, genre: Optional[str] = None,
                                    characters: Optional[List[str]] = None,
                                    setting: Optional[str] = None,
                                    is_continuation: bool = False,
                                    previous_choice: Optional[str] = None,
-                                   age: Optional[int] = None) -> Dict[str, Any]:
+                                   age: Optional[int] = None,
+                                   model_id: Optional[str] = None) -> Dict[str, Any]:
         """Generate story using AWS Bedrock"""
         try:
-            # Use Claude model (adjust model ID as needed)
-            model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
+            # Claude model from config unless the caller picked one (e.g. the lite model under load)
+            model_id = model_id or Config.BEDROCK_MODEL_ID
             
             full_prompt = self._build_bedrock_prompt(
                 prompt, genre, characters, setting, 
                 is_continuation, previous_choice, age
             )
             
-            body = {
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": max_length,
-                "temperature": temperature,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": full_prompt
-                    }
-                ]
-            }
+            body = self._bedrock_body(full_prompt, max_length, temperature)
             
-            response = self.bedrock_client.invoke_model(
-                modelId=model_id,
-                body=json.dumps(body),
-                contentType='application/json'
-            )
+            def invoke():
+                response = self.bedrock_client.invoke_model(
+                    modelId=model_id,
+                    body=json.dumps(body),
+                    contentType='application/json'
+                )
+                return json.loads(response['body'].read())
             
-            response_body = json.loads(response['body'].read())
+            # Off the event loop, and no longer than the request has left
+            with observe_stage("llm", provider="bedrock", model=model_id, age=age):
+                response_body = await run_in_thread(invoke)
+                tokens = response_body.get('usage') or {}
+                call_usage = usage.record(
+                    model_id,
+                    tokens.get('input_tokens', 0),
+                    tokens.get('output_tokens', 0),
+                    tokens.get('cache_read_input_tokens', 0),
+                    age=age
+                )
             full_text = response_body['content'][0]['text']
             
             # Parse story and choices
-            parsed = self._parse_story_and_choices(full_text)
+            with span("llm.parse", chars=len(full_text)):
+                parsed = self._parse_story_and_choices(full_text)
             
             return {
                 "story": parsed["story"],
                 "location": parsed.get("location", ""),
                 "choices": parsed["choices"],
-                "model_used": f"Bedrock-{model_id}"
+                "model_used": f"Bedrock-{model_id}",
+                "usage": call_usage
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Bedrock generation failed: {e}")
             raise Exception(f"Bedrock story generation failed: {str(e)}")
     
+    async def _stream_with_bedrock(self, prompt: str, max_length: int, temperature: float,
+                                   on_event, is_continuation: bool = False,
+                                   previous_choice: Optional[str] = None,
+                                   age: Optional[int] = None,
+                                   model_id: Optional[str] = None,
+                                   min_chars: int = 0,
+                                   preview_chars: int = 0) -> Dict[str, Any]:
+        """Generate story with a streamed Bedrock response, calling on_event(kind, value) as stream_story yields them"""
+        model_id = model_id or Config.BEDROCK_MODEL_ID
+        full_prompt = self._build_bedrock_prompt(prompt, None, None, None, is_continuation, previous_choice, age)
+        body = self._bedrock_body(full_prompt, max_length, temperature)
+        loop = asyncio.get_running_loop()
+        paragraphs = StoryParagraphs(min_chars)
+        previewed = False
+        
+        def preview(final: bool = False):
+            nonlocal previewed
+            story = paragraphs.story(final)
+            if story is not None and (len(story) >= preview_chars or final):
+                previewed = True
+                loop.call_soon_threadsafe(on_event, "preview", story[:preview_chars])
+        
+        def read():
+            response = self.bedrock_client.invoke_model_with_response_stream(
+                modelId=model_id,
+                body=json.dumps(body),
+                contentType='application/json'
+            )
+            tokens = {}
+            stream = response['body']
+            for event in stream:
+                if cancelled():
+                    stream.close()
+                    raise RequestCancelled("Story stream abandoned, the client disconnected")
+                if 'chunk' not in event:
+                    raise RuntimeError(f"Bedrock stream error: {', '.join(event)}")
+                chunk = json.loads(event['chunk']['bytes'])
+                if chunk.get('type') == 'content_block_delta':
+                    for paragraph in paragraphs.feed(chunk['delta'].get('text', '')):
+                        loop.call_soon_threadsafe(on_event, "paragraph", paragraph)
+                    if not previewed:
+                        preview()
+                elif chunk.get('type') == 'message_start':
+                    tokens.update(chunk['message'].get('usage') or {})
+                elif chunk.get('type') == 'message_delta':
+                    tokens.update(chunk.get('usage') or {})
+            if not previewed:
+                preview(final=True)
+            for paragraph in paragraphs.finish():
+                loop.call_soon_threadsafe(on_event, "paragraph", paragraph)
+            return tokens
+        
+        with observe_stage("llm", provider="bedrock", model=model_id, age=age):
+            tokens = await run_in_thread(read)
+            call_usage = usage.record(
+                model_id,
+                tokens.get('input_tokens', 0),
+                tokens.get('output_tokens', 0),
+                tokens.get('cache_read_input_tokens', 0),
+                age=age
+            )
+        
+        with span("llm.parse", chars=len(paragraphs.text)):
+            parsed = self._parse_story_and_choices(paragraphs.text)
+        return {
+            "story": parsed["story"],
+            "location": parsed.get("location", ""),
+            "choices": parsed["choices"],
+            "model_used": f"Bedrock-{model_id}",
+            "usage": call_usage
+        }
+    
     async def _generate_with_openai(self, prompt: str, max_length: int, 
                                   temperature: float, genre: Optional[str] = None,
                                   characters: Optional[List[str]] = None,
@@ -319,20 +499,31 @@ class StoryGenerator:
         try:
             messages = self._build_openai_prompt(prompt, genre, characters, setting)
             
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=max_length,
-                temperature=temperature
-            )
+            with observe_stage("llm", provider="openai", model="gpt-3.5-turbo"):
+                response = await get_openai().ChatCompletion.acreate(
+                    model="gpt-3.5-turbo",
+                    messages=messages,
+                    max_tokens=max_length,
+                    temperature=temperature,
+                    request_timeout=timeout(Config.PROVIDER_READ_TIMEOUT)
+                )
+                tokens = response.get("usage") or {}
+                call_usage = usage.record(
+                    "gpt-3.5-turbo",
+                    tokens.get("prompt_tokens", 0),
+                    tokens.get("completion_tokens", 0)
+                )
             
             story = response.choices[0].message.content
             
             return {
                 "story": story,
-                "model_used": "OpenAI-GPT-3.5-Turbo"
+                "model_used": "OpenAI-GPT-3.5-Turbo",
+                "usage": call_usage
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"OpenAI generation failed: {e}")
             raise Exception(f"OpenAI story generation failed: {str(e)}")
@@ -343,17 +534,25 @@ class StoryGenerator:
                            setting: Optional[str] = None,
                            is_continuation: bool = False,
                            previous_choice: Optional[str] = None,
-                           age: Optional[int] = None) -> Dict[str, Any]:
-        """Generate a story using the best available service"""
+                           age: Optional[int] = None,
+                           model_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate a story using the best available service
+        
+        model_id selects the Bedrock model (default: BEDROCK_MODEL_ID).
+        """
         
         # Try Bedrock first (primary)
-        if self.bedrock_client and await self.check_bedrock_connection():
+        if self.bedrock_client and await self.is_bedrock_available():
             try:
                 logger.info("🚀 Generating story with AWS Bedrock")
                 return await self._generate_with_bedrock(
                     prompt, max_length, temperature, genre, characters, setting,
-                    is_continuation, previous_choice, age
+                    is_continuation, previous_choice, age, model_id
                 )
+            except DeadlineExceeded:
+                # No time left for a fallback either
+                raise
             except Exception as e:
                 logger.warning(f"⚠️  Bedrock failed: {e}")
                 
@@ -382,3 +581,63 @@ class StoryGenerator:
                     logger.error(f"❌ OpenAI also failed: {e}")
         
         raise Exception("❌ All AI services are unavailable. Please check your AWS Bedrock configuration.")
+    
+    async def stream_story(self, prompt: str, max_length: int = 1000,
+                           temperature: float = 0.7,
+                           is_continuation: bool = False,
+                           previous_choice: Optional[str] = None,
+                           age: Optional[int] = None,
+                           model_id: Optional[str] = None,
+                           min_chars: int = 0,
+                           preview_chars: int = 200):
+        """
+        Generate a story, yielding its parts as soon as they are written
+        
+        Yields ("preview", text) once, with the first preview_chars of the
+        story (e.g. to start its illustration early); ("paragraph", text) for
+        each finished paragraph (short ones are joined until min_chars); then
+        ("result", result) as generate_story returns it. If Bedrock can't
+        stream, the story is generated whole (with generate_story's
+        fallbacks) and its parts follow at once.
+        """
+        if self.bedrock_client and await self.is_bedrock_available():
+            logger.info("🚀 Streaming story from AWS Bedrock")
+            events = asyncio.Queue()
+            # Its own task, so the llm stage and span end with the model call, not with our reader
+            writer = asyncio.ensure_future(self._stream_with_bedrock(
+                prompt, max_length, temperature, lambda kind, value: events.put_nowait((kind, value)),
+                is_continuation, previous_choice, age, model_id, min_chars, preview_chars
+            ))
+            writer.add_done_callback(lambda _: events.put_nowait(None))
+            sent = 0
+            result = None
+            try:
+                while True:
+                    event = await events.get()
+                    if event is None:
+                        break
+                    sent += 1
+                    yield event
+                result = writer.result()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                # Parts already handed out can't be taken back
+                if sent:
+                    raise
+                logger.warning(f"⚠️  Bedrock streaming failed: {e}")
+            finally:
+                writer.cancel()
+            if result is not None:
+                yield "result", result
+                return
+        
+        result = await self.generate_story(
+            prompt, max_length, temperature, is_continuation=is_continuation,
+            previous_choice=previous_choice, age=age, model_id=model_id
+        )
+        yield "preview", result["story"][:preview_chars]
+        story_paragraphs = [p.strip() for p in result["story"].split("\n\n") if p.strip()]
+        for group in group_paragraphs(story_paragraphs, min_chars):
+            yield "paragraph", "\n\n".join(group)
+        yield "result", result
@@ -0,0 +1,250 @@
+# shared_state.py
+"""
+Pluggable key/value state shared between workers
+- memory: in-process (default, single worker)
+- sqlite: a local SQLite file in WAL mode, shared by every worker on the box
+- redis:  anything that speaks the Redis protocol (GET/SET/DEL/INCR)
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from urllib.parse import urlparse
+from typing import Any, Optional
+
+from config import Config
+
+
+class InProcessStateBackend:
+    """Dictionary with per-key expiry; only visible to this process"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._live(key) or 0) + 1
+            expires_at = self._data.get(key, (None, None))[1]
+            self._data[key] = (str(value), expires_at)
+            return value
+
+
+class SQLiteStateBackend:
+    """Key/value table in a SQLite file; safe across processes on one machine"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else None)
+        )
+
+    def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else None)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def incr(self, key: str) -> int:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, '0', NULL) ON CONFLICT(key) DO NOTHING",
+                (key,)
+            )
+            conn.execute("UPDATE kv SET value = CAST(value AS INTEGER) + 1 WHERE key = ?", (key,))
+            value = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return int(value)
+
+
+class RedisStateBackend:
+    """Minimal RESP client: one connection per thread, no external dependency"""
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", str(self.db))
+        return conn
+
+    def _command(self, *args) -> Any:
+        sock, reader = self._connection()
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        try:
+            sock.sendall(b"".join(parts))
+            return self._read_reply(reader)
+        except (OSError, ConnectionError):
+            # Drop the broken connection so the next call reconnects
+            self._local.conn = None
+            raise
+
+    def _read_reply(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Redis error: {body.decode()}")
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)[:-2]
+            return data.decode("utf-8")
+        if kind == b"*":
+            return [self._read_reply(reader) for _ in range(int(body))]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def get(self, key: str) -> Optional[str]:
+        return self._command("GET", key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        if ttl:
+            self._command("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            self._command("SET", key, value)
+
+    def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        if ttl:
+            return self._command("SET", key, value, "NX", "PX", int(ttl * 1000)) == "OK"
+        return self._command("SET", key, value, "NX") == "OK"
+
+    def delete(self, key: str):
+        self._command("DEL", key)
+
+    def incr(self, key: str) -> int:
+        return self._command("INCR", key)
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_state():
+    """Process-wide state backend chosen by STATE_BACKEND"""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                backend = Config.STATE_BACKEND.lower()
+                if backend == "sqlite":
+                    _state = SQLiteStateBackend(Config.STATE_SQLITE_PATH)
+                elif backend == "redis":
+                    _state = RedisStateBackend(Config.REDIS_URL)
+                else:
+                    _state = InProcessStateBackend()
+    return _state
+
+
+def get_json(key: str) -> Any:
+    """Decode a JSON value; None when missing or the backend is unreachable"""
+    try:
+        value = get_state().get(key)
+    except Exception as e:
+        print(f"⚠️ Shared state read failed for {key}: {e}")
+        return None
+    return json.loads(value) if value is not None else None
+
+
+def set_json(key: str, value: Any, ttl: Optional[float] = None):
+    """Store a JSON value; failures are logged, not raised"""
+    try:
+        get_state().set(key, json.dumps(value), ttl)
+    except Exception as e:
+        print(f"⚠️ Shared state write failed for {key}: {e}")
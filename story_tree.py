@@ -0,0 +1,206 @@
+# story_tree.py
+"""
+Pre-generated story trees for popular themes
+bake_stories.py writes one tree per (theme, age group): the opening, the
+pages behind every choice down to a fixed depth, and optionally a happy
+ending under each page, all with narration and illustrations. While the
+reader's path stays inside a tree, /story/generate and /story/continue serve
+its pages with no provider calls. Once it leaves the tree, pages are
+generated live as usual.
+
+On disk, <STORY_TREE_DIR>/<theme>.<age group>.tree is one zlib-compressed
+JSON document. Its media lives in <STORY_TREE_DIR>/media/, outside the
+pruned MEDIA_DIR. While a tree is being baked, finished pages are appended
+to a .journal file next to it, so an interrupted bake resumes where it
+stopped.
+"""
+
+import os
+import re
+import json
+import zlib
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+from metrics import age_bucket
+
+FORMAT_VERSION = 1
+ROOT = "r"
+ENDING = "e"
+
+# Representative reader age used when baking for each age group
+BUCKET_AGES = {"3-5": 4, "6-8": 7, "9-12": 10, "13+": 13, "unknown": None}
+
+
+def normalize(text: str) -> str:
+    """Whitespace- and case-insensitive form used to match reader paths"""
+    return " ".join((text or "").split()).lower()
+
+
+def slug(theme: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", normalize(theme)).strip("-") or "theme"
+
+
+def tree_path(directory: str, theme: str, bucket: str) -> str:
+    return os.path.join(directory, f"{slug(theme)}.{bucket}.tree")
+
+
+def child_id(parent_id: str, index: int) -> str:
+    return f"{parent_id}.{index}"
+
+
+def ending_id(parent_id: str) -> str:
+    return f"{parent_id}.{ENDING}"
+
+
+def depth_of(node_id: str) -> int:
+    return node_id.count(".")
+
+
+def path_context(nodes: Dict[str, Dict], node_id: str) -> str:
+    """Story so far at a node, joined like the frontend's story_context"""
+    parts = node_id.split(".")
+    return "\n\n".join(nodes[".".join(parts[:i])]['story'] for i in range(1, len(parts) + 1))
+
+
+def write_tree(path: str, tree: Dict):
+    """Atomically replace a tree file"""
+    data = zlib.compress(json.dumps(tree, separators=(",", ":")).encode("utf-8"), 9)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_tree(path: str) -> Dict:
+    with open(path, "rb") as f:
+        tree = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+    if tree.get('format') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported story tree format {tree.get('format')!r}")
+    return tree
+
+
+def read_journal(path: str) -> Dict[str, Dict]:
+    """Pages baked so far; a torn last line from an interrupted bake is ignored"""
+    nodes = {}
+    if not os.path.exists(path):
+        return nodes
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                node = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            nodes[node['id']] = node
+    return nodes
+
+
+class StoryTrees:
+    """In-memory index of every baked tree, for serving reader paths"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._roots = {}  # (theme, age group) -> tree
+        # (theme, age group, normalized story so far) -> node, for continue requests
+        self._by_context = {}
+        self.load()
+
+    def load(self):
+        roots, by_context = {}, {}
+        paths = []
+        if os.path.isdir(self.directory):
+            paths = sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".tree"))
+        for path in paths:
+            try:
+                tree = read_tree(path)
+            except (OSError, ValueError, zlib.error) as e:
+                print(f"⚠️ Skipping story tree {path}: {e}")
+                continue
+            key = (normalize(tree['theme']), tree['age_bucket'])
+            roots[key] = tree
+            nodes = tree['nodes']
+            for node_id in nodes:
+                if not node_id.endswith(f".{ENDING}"):
+                    by_context[key + (hashlib.sha1(normalize(path_context(nodes, node_id)).encode()).hexdigest(),)] = node_id
+        self._roots, self._by_context = roots, by_context
+        if roots:
+            pages = sum(len(tree['nodes']) for tree in roots.values())
+            print(f"🌳 Loaded {len(roots)} story trees ({pages} pages) from {self.directory}")
+
+    def _tree(self, theme: str, age: Optional[int]) -> Optional[Dict]:
+        return self._roots.get((normalize(theme), age_bucket(age)))
+
+    def opening(self, theme: str, age: Optional[int]) -> Optional[Dict]:
+        tree = self._tree(theme, age)
+        if tree is None:
+            return None
+        return self._page(tree, ROOT)
+
+    def next_page(self, theme: str, age: Optional[int], story_context: str, choice: str,
+                  is_ending: bool = False) -> Optional[Dict]:
+        """The baked page after `choice` (or the ending), if the reader's path so far is in the tree"""
+        tree = self._tree(theme, age)
+        if tree is None:
+            return None
+        digest = hashlib.sha1(normalize(story_context).encode()).hexdigest()
+        node_id = self._by_context.get((normalize(theme), tree['age_bucket'], digest))
+        if node_id is None:
+            return None
+        if is_ending:
+            return self._page(tree, ending_id(node_id))
+        wanted = normalize(choice)
+        for index, text in enumerate(tree['nodes'][node_id].get('choices') or []):
+            if normalize(text) == wanted:
+                return self._page(tree, child_id(node_id, index))
+        return None
+
+    @staticmethod
+    def _page(tree: Dict, node_id: str) -> Optional[Dict]:
+        node = tree['nodes'].get(node_id)
+        if node is None:
+            return None
+        page = dict(node)
+        page['voice'] = tree.get('voice')
+        return page
+
+    def stats(self) -> List[Dict]:
+        return [
+            {'theme': tree['theme'], 'age_bucket': tree['age_bucket'], 'depth': tree['depth'], 'pages': len(tree['nodes'])}
+            for tree in self._roots.values()
+        ]
+
+
+_trees = None
+_trees_lock = threading.Lock()
+
+
+def get_story_trees() -> StoryTrees:
+    global _trees
+    if _trees is None:
+        with _trees_lock:
+            if _trees is None:
+                _trees = StoryTrees(Config.STORY_TREE_DIR)
+    return _trees
+
+
+def count_pages(choices_per_page: int, depth: int, endings: bool) -> int:
+    """Upper bound on pages in a full tree, for progress reporting"""
+    pages = sum(choices_per_page ** level for level in range(depth + 1))
+    return pages * 2 if endings else pages
+
+
+def missing_children(nodes: Dict[str, Dict], node_id: str, depth: int, endings: bool) -> Iterable[str]:
+    """IDs under a baked page that still need baking"""
+    node = nodes[node_id]
+    if node.get('ending'):
+        return []
+    wanted = []
+    if depth_of(node_id) < depth:
+        wanted += [child_id(node_id, i) for i in range(len(node.get('choices') or []))]
+    if endings:
+        wanted.append(ending_id(node_id))
+    return [i for i in wanted if i not in nodes]
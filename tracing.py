@@ -0,0 +1,248 @@
+# tracing.py
+"""
+Lightweight per-request tracing
+The middleware gives every request an ID (X-Request-ID, generated when
+absent) and, for sampled requests, opens a root span. X-Trace: 1 forces a
+trace only alongside a valid X-Admin-Token. span() nests under
+whatever span is current in the context, including work run in to_thread,
+and each finished span is appended to a rotating JSON-lines file in an
+OTLP-like shape. Unsampled requests cost one context variable lookup per span.
+"""
+
+import os
+import glob
+import json
+import time
+import random
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from config import Config
+
+# ID of the request being served (set for every request, sampled or not)
+request_id = contextvars.ContextVar("request_id", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def authorized(token: Optional[str]) -> bool:
+    """Whether token is the admin token (admin features are off when ADMIN_TOKEN is unset)"""
+    return bool(Config.ADMIN_TOKEN) and token is not None and secrets.compare_digest(token, Config.ADMIN_TOKEN)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, attributes: Dict):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key: str, value):
+        """Attach an attribute after the span started"""
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        data = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'attributes': self.attributes
+        }
+        if self.error:
+            data['status'] = {'code': 'ERROR', 'message': self.error}
+        return data
+
+
+class RotatingJsonlExporter:
+    """Appends finished spans to `<path>.<pid>.jsonl`, rotating at `max_bytes`"""
+
+    def __init__(self, path: str, max_bytes: int = 10 << 20, backups: int = 3):
+        self.path = f"{path}.{os.getpid()}.jsonl"
+        self.pattern = f"{path}.*.jsonl*"
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def find(self, trace_id: str) -> List[Dict]:
+        """Every exported span of one trace, from all workers' files"""
+        needle = f'"traceId":"{trace_id}"'
+        spans = []
+        with self._lock:
+            self._file.flush()
+        for path in glob.glob(self.pattern):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if needle in line:
+                            spans.append(json.loads(line))
+            except (OSError, json.JSONDecodeError):
+                continue
+        return sorted(spans, key=lambda span: span['startTimeUnixNano'])
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> RotatingJsonlExporter:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = RotatingJsonlExporter(Config.TRACE_PATH, max_bytes=Config.TRACE_MAX_BYTES)
+    return _exporter
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a block as a child of the current span
+
+    Yields the Span, or None when the request isn't sampled.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    current = Span(parent.trace_id, parent.span_id, name, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        get_exporter().export(current)
+
+
+def annotate(**attributes):
+    """Attach attributes to the current span, if the request is sampled"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+class TracingMiddleware:
+    """ASGI middleware assigning request IDs and opening a root span for sampled requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        incoming = headers.get(b"x-request-id", b"").decode("latin-1")[:64]
+        rid = incoming or secrets.token_hex(16)
+        forced = headers.get(b"x-trace") == b"1" and authorized(headers.get(b"x-admin-token", b"").decode("latin-1"))
+        sampled = forced or random.random() < Config.TRACE_SAMPLE_RATE
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+                if root is not None:
+                    root.set("http.status_code", message["status"])
+            await send(message)
+
+        rid_token = request_id.set(rid)
+        root = None
+        if sampled:
+            root = Span(rid, None, f'{scope["method"]} {scope["path"]}', {'http.method': scope["method"]})
+        span_token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            if root is not None:
+                root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(span_token)
+            request_id.reset(rid_token)
+            if root is not None:
+                route = scope.get("route")
+                if route is not None:
+                    root.set("http.route", route.path)
+                root.end_ns = time.time_ns()
+                get_exporter().export(root)
+
+
+def render_waterfall(trace_id: str, spans: List[Dict]) -> str:
+    """HTML waterfall of a trace's spans, indented by depth"""
+    start = min(s['startTimeUnixNano'] for s in spans)
+    end = max(s['endTimeUnixNano'] or s['startTimeUnixNano'] for s in spans)
+    total = max(end - start, 1)
+
+    depth = {}
+    by_id = {s['spanId']: s for s in spans}
+
+    def depth_of(s):
+        if s['spanId'] not in depth:
+            parent = by_id.get(s.get('parentSpanId'))
+            depth[s['spanId']] = 0 if parent is None else depth_of(parent) + 1
+        return depth[s['spanId']]
+
+    rows = []
+    for s in spans:
+        offset = (s['startTimeUnixNano'] - start) / total * 100
+        duration_ns = (s['endTimeUnixNano'] or s['startTimeUnixNano']) - s['startTimeUnixNano']
+        width = max(duration_ns / total * 100, 0.3)
+        color = "#e5534b" if s.get('status') else "#4a90d9"
+        attributes = ", ".join(f"{k}={v}" for k, v in s['attributes'].items())
+        label = _html(f"{s['name']} — {duration_ns / 1e6:.1f} ms")
+        rows.append(
+            f'<div class="row"><div class="name" style="padding-left:{depth_of(s) * 16}px" '
+            f'title="{_html(attributes)}">{label}</div>'
+            f'<div class="track"><div class="bar" style="left:{offset:.2f}%;width:{width:.2f}%;background:{color}"></div></div></div>'
+        )
+
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Trace {_html(trace_id)}</title>
+<style>
+body {{ font-family: sans-serif; margin: 20px; }}
+.row {{ display: flex; align-items: center; height: 24px; }}
+.name {{ width: 420px; font-size: 13px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }}
+.track {{ position: relative; flex: 1; height: 14px; background: #f2f2f2; }}
+.bar {{ position: absolute; height: 14px; border-radius: 2px; }}
+</style></head><body>
+<h2>Trace {_html(trace_id)} — {total / 1e6:.1f} ms, {len(spans)} spans</h2>
+{"".join(rows)}
+</body></html>"""
+
+
+def _html(text: str) -> str:
+    return str(text).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
@@ -0,0 +1,147 @@
+# usage.py
+"""
+Token and cost accounting for story model calls
+Every LLM response's usage (input, output and, where the provider reports
+it, cached input tokens) is recorded against the route, model, reader age
+group and page number of the request that made it:
+- on the call's trace span
+- in the bridgetales_llm_* metrics
+- in a per-worker summary served by /api/usage/summary
+
+Pages carry their usage back to the client, and /api/save-book stores the
+book's total, so prompt growth over long books can be read from saved books.
+"""
+
+import threading
+import contextvars
+from typing import Dict, Iterable, Optional
+
+from metrics import LLM_TOKENS, LLM_COST, LLM_CALLS, age_bucket, current_age
+from tracing import annotate
+
+# USD per 1,000 tokens: (input, output, cached input). Models not listed are counted at zero cost.
+MODEL_PRICES = {
+    'anthropic.claude-3-sonnet-20240229-v1:0': (0.003, 0.015, 0.0003),
+    'anthropic.claude-3-5-sonnet-20240620-v1:0': (0.003, 0.015, 0.0003),
+    'anthropic.claude-3-haiku-20240307-v1:0': (0.00025, 0.00125, 0.000025),
+    'gpt-3.5-turbo': (0.0005, 0.0015, 0.0005)
+}
+
+# Route and page number of the current request, set by the page endpoints
+current_route = contextvars.ContextVar("current_route", default="other")
+current_page = contextvars.ContextVar("current_page", default=None)
+
+
+def page_bucket(page: Optional[int]) -> str:
+    """Page number group: each of the first five pages, then 6-10 and 11+"""
+    if page is None or page < 1:
+        return "unknown"
+    if page <= 5:
+        return str(page)
+    if page <= 10:
+        return "6-10"
+    return "11+"
+
+
+def cost_of(model: str, input_tokens: int, output_tokens: int, cached_input_tokens: int = 0) -> float:
+    input_price, output_price, cached_price = MODEL_PRICES.get(model, (0.0, 0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price + cached_input_tokens * cached_price) / 1000
+
+
+class UsageSummary:
+    """Running totals per (route, model, age group, page group) for one worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def add(self, key, input_tokens: int, output_tokens: int, cached_input_tokens: int, cost: float):
+        with self._lock:
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = self._totals[key] = [0, 0, 0, 0, 0.0]
+            totals[0] += 1
+            totals[1] += input_tokens
+            totals[2] += output_tokens
+            totals[3] += cached_input_tokens
+            totals[4] += cost
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            items = sorted(self._totals.items())
+        groups = []
+        overall = {'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cached_input_tokens': 0, 'cost_usd': 0.0}
+        for (route, model, age, page), (calls, input_tokens, output_tokens, cached, cost) in items:
+            groups.append({
+                'route': route,
+                'model': model,
+                'age_bucket': age,
+                'page': page,
+                'calls': calls,
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'cached_input_tokens': cached,
+                'avg_input_tokens': round(input_tokens / calls, 1),
+                'avg_output_tokens': round(output_tokens / calls, 1),
+                'cost_usd': round(cost, 6)
+            })
+            overall['calls'] += calls
+            overall['input_tokens'] += input_tokens
+            overall['output_tokens'] += output_tokens
+            overall['cached_input_tokens'] += cached
+            overall['cost_usd'] += cost
+        overall['cost_usd'] = round(overall['cost_usd'], 6)
+        return {'total': overall, 'groups': groups}
+
+
+SUMMARY = UsageSummary()
+
+
+def record(model: str, input_tokens: int, output_tokens: int, cached_input_tokens: int = 0,
+           age: Optional[int] = None) -> Dict:
+    """
+    Account one model call and return its usage for the page response
+
+    Call it inside the call's observe_stage block so the usage lands on its span.
+    """
+    route = current_route.get()
+    page = page_bucket(current_page.get())
+    bucket = age_bucket(age if age is not None else current_age.get())
+    cost = cost_of(model, input_tokens, output_tokens, cached_input_tokens)
+
+    LLM_CALLS.inc(route, model, bucket, page)
+    LLM_TOKENS.observe(input_tokens, route, model, bucket, page, "input")
+    LLM_TOKENS.observe(output_tokens, route, model, bucket, page, "output")
+    if cached_input_tokens:
+        LLM_TOKENS.observe(cached_input_tokens, route, model, bucket, page, "cached_input")
+    LLM_COST.inc(route, model, amount=cost)
+    SUMMARY.add((route, model, bucket, page), input_tokens, output_tokens, cached_input_tokens, cost)
+    annotate(input_tokens=input_tokens, output_tokens=output_tokens,
+             cached_input_tokens=cached_input_tokens, cost_usd=round(cost, 6), page=page)
+
+    return {
+        'model': model,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cached_input_tokens': cached_input_tokens,
+        'cost_usd': round(cost, 6)
+    }
+
+
+def book_total(pages: Iterable[Dict]) -> Dict:
+    """Sum of the usage of a book's pages (pages without usage count as zero)"""
+    total = {'pages': 0, 'input_tokens': 0, 'output_tokens': 0, 'cached_input_tokens': 0, 'cost_usd': 0.0}
+    for page in pages:
+        usage = page.get('usage') if isinstance(page, dict) else None
+        if not isinstance(usage, dict):
+            continue
+        total['pages'] += 1
+        for key in ('input_tokens', 'output_tokens', 'cached_input_tokens'):
+            value = usage.get(key)
+            if isinstance(value, (int, float)) and value >= 0:
+                total[key] += int(value)
+        cost = usage.get('cost_usd')
+        if isinstance(cost, (int, float)) and cost >= 0:
+            total['cost_usd'] += cost
+    total['cost_usd'] = round(total['cost_usd'], 6)
+    return total
@@ -0,0 +1,429 @@
+# vector_store.py
+"""
+Local vector store for book and profile similarity
+A stand-in for Pinecone that needs no network: a float32 matrix (in memory,
+or memory-mapped from disk) searched by brute force, switching to an IVF
+(inverted file) index once the collection is large. BoundedVectorIndex is
+the in-memory variant with a fixed capacity, for caches.
+"""
+
+import os
+import json
+import atexit
+import threading
+import numpy as np
+from typing import List, Dict, Optional, Callable, Tuple
+
+from config import Config
+from embedding_service import EMBEDDING_DIM
+
+try:
+    import fcntl
+except ImportError:  # Windows: single worker only
+    fcntl = None
+
+
+class VectorIndex:
+    """In-memory cosine-similarity index over L2-normalised float32 vectors"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, ivf_threshold: int = 50000, nprobe: int = 8):
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+
+        self._lock = threading.RLock()
+        self._vectors = np.zeros((1024, dim), dtype=np.float32)
+        self._count = 0
+        self._ids = []  # row -> id
+        self._rows = {}  # id -> row
+        self._metadata = []  # row -> metadata dict
+
+        # IVF state, built lazily once the index is large enough
+        self._centroids = None
+        self._lists = None
+        self._ivf_built_at = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    # Storage hooks, overridden by the memory-mapped store
+    def _ensure_capacity(self, rows: int):
+        if rows > self._vectors.shape[0]:
+            grown = np.zeros((max(rows, self._vectors.shape[0] * 2), self.dim), dtype=np.float32)
+            grown[:self._count] = self._vectors[:self._count]
+            self._vectors = grown
+
+    def _on_upsert(self, item_id: str, row: int, metadata: Dict):
+        pass
+
+    def upsert(self, item_id: str, vector: np.ndarray, metadata: Optional[Dict] = None):
+        """Insert or replace one vector"""
+        self.upsert_batch([item_id], np.asarray(vector, dtype=np.float32)[None, :], [metadata or {}])
+
+    def upsert_batch(self, ids: List[str], vectors: np.ndarray, metadatas: List[Dict]):
+        """Insert or replace a batch of vectors"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._ensure_capacity(self._count + len(ids))
+            for item_id, vector, metadata in zip(ids, vectors, metadatas):
+                row = self._rows.get(item_id)
+                if row is None:
+                    row = self._count
+                    self._count += 1
+                    self._rows[item_id] = row
+                    self._ids.append(item_id)
+                    self._metadata.append(metadata)
+                    self._assign_to_ivf(row, vector)
+                else:
+                    self._metadata[row] = metadata
+                self._vectors[row] = vector
+                self._on_upsert(item_id, row, metadata)
+
+    def get(self, item_id: str) -> Optional[Tuple[np.ndarray, Dict]]:
+        """Vector and metadata for an id"""
+        row = self._rows.get(item_id)
+        if row is None:
+            return None
+        return np.array(self._vectors[row]), self._metadata[row]
+
+    def rows_where(self, where: Callable[[Dict], bool]) -> List[int]:
+        return [row for row in range(self._count) if where(self._metadata[row])]
+
+    def vectors_for_rows(self, rows: List[int]) -> np.ndarray:
+        return np.array(self._vectors[rows])
+
+    def search(
+        self,
+        vector: np.ndarray,
+        k: int = 10,
+        where: Optional[Callable[[Dict], bool]] = None,
+        exclude_ids: Optional[set] = None
+    ) -> List[Dict]:
+        """
+        Nearest neighbours by cosine similarity
+
+        Args:
+            vector: Query vector (normalised)
+            k: Number of results
+            where: Optional metadata filter
+            exclude_ids: Ids to leave out of the results
+
+        Returns:
+            List of {'id', 'score', 'metadata'} dictionaries, best first
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if self._count == 0 or k <= 0:
+                return []
+            self._maybe_build_ivf()
+            candidates = self._ivf_candidates(query)
+            if candidates is None:
+                scores = self._vectors[:self._count] @ query
+                candidates = np.arange(self._count)
+            else:
+                scores = self._vectors[candidates] @ query
+
+            # Over-fetch so filtering still leaves k results in the common case
+            wanted = k + (len(exclude_ids) if exclude_ids else 0)
+            fetch = min(len(scores), wanted * 4 if where else wanted)
+            results = []
+            while True:
+                top = np.argpartition(-scores, fetch - 1)[:fetch] if fetch < len(scores) else np.arange(len(scores))
+                top = top[np.argsort(-scores[top], kind="stable")]
+                results = []
+                for i in top:
+                    row = int(candidates[i])
+                    item_id = self._ids[row]
+                    if exclude_ids and item_id in exclude_ids:
+                        continue
+                    if where and not where(self._metadata[row]):
+                        continue
+                    results.append({'id': item_id, 'score': float(scores[i]), 'metadata': self._metadata[row]})
+                    if len(results) >= k:
+                        return results
+                if fetch >= len(scores):
+                    return results
+                fetch = min(len(scores), fetch * 4)
+
+    # IVF
+    def _maybe_build_ivf(self):
+        """(Re)build the coarse quantizer when the index has doubled since the last build"""
+        if self._count < self.ivf_threshold:
+            return
+        if self._centroids is not None and self._count < 2 * self._ivf_built_at:
+            return
+        self.build_ivf()
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 8, seed: int = 0):
+        """Spherical k-means over a sample, then assign every vector to its nearest centroid"""
+        with self._lock:
+            count = self._count
+            nlist = nlist or max(8, int(np.sqrt(count)))
+            rng = np.random.default_rng(seed)
+            sample_size = min(count, nlist * 64)
+            sample = np.array(self._vectors[rng.choice(count, sample_size, replace=False)])
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, sample)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                # Keep the old centroid for clusters that went empty
+                centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+            assignment = np.empty(count, dtype=np.int64)
+            for start in range(0, count, 65536):
+                block = self._vectors[start:min(start + 65536, count)]
+                assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind="stable")
+            bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+
+            self._centroids = centroids.astype(np.float32)
+            self._lists = [order[bounds[c]:bounds[c + 1]].tolist() for c in range(nlist)]
+            self._ivf_built_at = count
+
+    def _assign_to_ivf(self, row: int, vector: np.ndarray):
+        if self._centroids is not None:
+            self._lists[int(np.argmax(self._centroids @ vector))].append(row)
+
+    def _ivf_candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        if self._centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self._lists))
+        probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([np.asarray(self._lists[c], dtype=np.int64) for c in probe])
+        return candidates if len(candidates) else None
+
+
+class BoundedVectorIndex(VectorIndex):
+    """VectorIndex of at most `capacity` vectors; past that, each insert replaces the oldest"""
+
+    def __init__(self, capacity: int, dim: int = EMBEDDING_DIM, **kwargs):
+        super().__init__(dim=dim, **kwargs)
+        self.capacity = capacity
+        # Allocated once, so memory doesn't grow with use
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._oldest = 0  # row replaced by the next insert once full
+        self._list_of = np.full(capacity, -1, dtype=np.int64)  # row -> IVF list
+        self._replaced_since_build = 0
+
+    def _ensure_capacity(self, rows: int):
+        pass
+
+    def upsert_batch(self, ids: List[str], vectors: np.ndarray, metadatas: List[Dict]) -> List[Tuple[str, Dict]]:
+        """Insert or replace a batch of vectors; returns the (id, metadata) of entries evicted for room"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        evicted = []
+        with self._lock:
+            for item_id, vector, metadata in zip(ids, vectors, metadatas):
+                row = self._rows.get(item_id)
+                if row is None:
+                    if self._count < self.capacity:
+                        row = self._count
+                        self._count += 1
+                        self._ids.append(item_id)
+                        self._metadata.append(metadata)
+                    else:
+                        row = self._oldest
+                        self._oldest = (row + 1) % self.capacity
+                        evicted.append((self._ids[row], self._metadata[row]))
+                        del self._rows[self._ids[row]]
+                        self._ids[row] = item_id
+                        self._metadata[row] = metadata
+                        self._replaced_since_build += 1
+                    self._rows[item_id] = row
+                else:
+                    self._metadata[row] = metadata
+                self._vectors[row] = vector
+                self._assign_to_ivf(row, vector)
+        return evicted
+
+    def _maybe_build_ivf(self):
+        # The collection stops growing at capacity, so also rebuild once it has turned over
+        if self._centroids is not None and self._replaced_since_build >= self._count:
+            self.build_ivf()
+            return
+        super()._maybe_build_ivf()
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 8, seed: int = 0):
+        with self._lock:
+            super().build_ivf(nlist, iterations, seed)
+            self._list_of[:] = -1
+            for c, rows in enumerate(self._lists):
+                self._list_of[rows] = c
+            self._replaced_since_build = 0
+
+    def _assign_to_ivf(self, row: int, vector: np.ndarray):
+        """Put a new or replaced row in the list of its nearest centroid"""
+        if self._centroids is None:
+            return
+        nearest = int(np.argmax(self._centroids @ vector))
+        previous = int(self._list_of[row])
+        if previous == nearest:
+            return
+        if previous >= 0:
+            self._lists[previous].remove(row)
+        self._lists[nearest].append(row)
+        self._list_of[row] = nearest
+
+
+class LocalVectorStore(VectorIndex):
+    """
+    VectorIndex persisted to disk
+
+    Vectors live in a memory-mapped float32 file (`<path>.f32`); ids and
+    metadata in an append-only JSON-lines file (`<path>.jsonl`) where the
+    last entry for an id wins. Writers from several processes serialise on
+    a file lock and each process replays entries the others appended.
+    """
+
+    def __init__(self, path: str, dim: int = EMBEDDING_DIM, **kwargs):
+        super().__init__(dim=dim, **kwargs)
+        self.path = path
+        self._matrix_path = f"{path}.f32"
+        self._meta_path = f"{path}.jsonl"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._meta_offset = 0
+        self._meta_log = open(self._meta_path, "a+b")
+        self._load_metadata()
+        existing_rows = os.path.getsize(self._matrix_path) // (4 * dim) if os.path.exists(self._matrix_path) else 0
+        self._open_matrix(max(existing_rows, self._count, 1024))
+
+    def _load_metadata(self):
+        """Replay metadata entries appended since the last call (by any process)"""
+        self._meta_log.seek(self._meta_offset)
+        data = self._meta_log.read()
+        # A line without its newline is still being written by another process
+        complete = data[:data.rfind(b"\n") + 1]
+        self._meta_offset += len(complete)
+        new_rows = []
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            row = entry['row']
+            while len(self._ids) <= row:
+                self._ids.append(None)
+                self._metadata.append({})
+                new_rows.append(len(self._ids) - 1)
+            self._ids[row] = entry['id']
+            self._metadata[row] = entry.get('metadata', {})
+            self._rows[entry['id']] = row
+        self._count = len(self._ids)
+        return new_rows
+
+    def _catch_up(self):
+        if os.path.getsize(self._meta_path) <= self._meta_offset:
+            return
+        new_rows = self._load_metadata()
+        if self._count > self._vectors.shape[0] or os.path.getsize(self._matrix_path) > self._vectors.nbytes:
+            self._open_matrix(max(self._count, os.path.getsize(self._matrix_path) // (4 * self.dim)))
+        for row in new_rows:
+            self._assign_to_ivf(row, self._vectors[row])
+
+    def upsert_batch(self, ids: List[str], vectors: np.ndarray, metadatas: List[Dict]):
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._meta_log.fileno(), fcntl.LOCK_EX)
+            try:
+                self._catch_up()
+                super().upsert_batch(ids, vectors, metadatas)
+                self._meta_log.flush()
+                self._meta_offset = self._meta_log.tell()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._meta_log.fileno(), fcntl.LOCK_UN)
+
+    def search(self, vector: np.ndarray, k: int = 10, where=None, exclude_ids=None) -> List[Dict]:
+        with self._lock:
+            self._catch_up()
+            return super().search(vector, k=k, where=where, exclude_ids=exclude_ids)
+
+    def get(self, item_id: str) -> Optional[Tuple[np.ndarray, Dict]]:
+        with self._lock:
+            self._catch_up()
+            return super().get(item_id)
+
+    def rows_where(self, where: Callable[[Dict], bool]) -> List[int]:
+        with self._lock:
+            self._catch_up()
+            return super().rows_where(where)
+
+    def _open_matrix(self, rows: int):
+        mode = "r+" if os.path.exists(self._matrix_path) else "w+"
+        if mode == "r+" and os.path.getsize(self._matrix_path) < rows * 4 * self.dim:
+            with open(self._matrix_path, "r+b") as f:
+                f.truncate(rows * 4 * self.dim)
+        self._vectors = np.memmap(self._matrix_path, dtype=np.float32, mode=mode, shape=(rows, self.dim))
+
+    def _ensure_capacity(self, rows: int):
+        if rows > self._vectors.shape[0]:
+            self._vectors.flush()
+            self._open_matrix(max(rows, self._vectors.shape[0] * 2))
+
+    def _on_upsert(self, item_id: str, row: int, metadata: Dict):
+        self._meta_log.write((json.dumps({'id': item_id, 'row': row, 'metadata': metadata}) + "\n").encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            self._vectors.flush()
+            self._meta_log.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> LocalVectorStore:
+    """Process-wide local vector store, opened on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LocalVectorStore(Config.VECTOR_STORE_PATH)
+                atexit.register(_store.close)
+    return _store
+
+
+def similar_books(book_id: str, k: int = 5) -> Optional[List[Dict]]:
+    """Books most similar to `book_id`; None if the book isn't indexed"""
+    store = get_vector_store()
+    item = store.get(f"book_{book_id}")
+    if item is None:
+        return None
+    vector, _ = item
+    return store.search(
+        vector, k=k,
+        where=lambda meta: meta.get('type') == 'book',
+        exclude_ids={f"book_{book_id}"}
+    )
+
+
+def reader_themes(user_name: str, k: int = 5) -> List[Dict]:
+    """
+    Themes a reader is likely to enjoy
+
+    Averages the reader's own book vectors and scores the themes of the
+    nearest books to that centroid.
+    """
+    store = get_vector_store()
+    rows = store.rows_where(lambda meta: meta.get('type') == 'book' and meta.get('user_name') == user_name)
+    if not rows:
+        return []
+
+    centroid = store.vectors_for_rows(rows).mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    if norm == 0:
+        return []
+    neighbours = store.search(centroid / norm, k=50, where=lambda meta: meta.get('type') == 'book')
+
+    scores = {}
+    for hit in neighbours:
+        theme = hit['metadata'].get('theme')
+        if theme and hit['score'] > 0:
+            scores[theme] = scores.get(theme, 0.0) + hit['score']
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [{'theme': theme, 'score': round(score, 4)} for theme, score in ranked]
@@ -1,10 +1,16 @@
 # voice_service.py
 import os
-import boto3
+from clients import get_aws_client
+from metrics import observe_stage
+from tracing import span
+from disconnect import read_stream
 
 def generate_voice_with_polly(text: str, voice_id: str = "Ivy", output_file: str = "story_audio.mp3") -> str:
     """Synthesize 'text' to MP3 via Amazon Polly and return the local file path.
     
+    Pass a per-request output_file (see media_store.media_path) when requests
+    can run concurrently; the default path is shared.
+    
     Child-friendly voices:
     - Ivy: Young female child voice (US English) - DEFAULT
     - Kevin: Young male child voice (US English)
@@ -12,30 +18,27 @@ def generate_voice_with_polly(text: str, voice_id: str = "Ivy", output_file: str
     - Matthew: Adult male (US English)
     """
     try:
-        polly = boto3.client(
-            "polly",
-            region_name=os.getenv("AWS_REGION", "us-east-1"),
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        )
+        polly = get_aws_client("polly", os.getenv("AWS_REGION", "us-east-1"))
 
         # Basic safety: Polly max text length ~3000 chars; truncate if huge.
         safe_text = text[:2800]
 
-        resp = polly.synthesize_speech(
-            Text=safe_text,
-            OutputFormat="mp3",
-            VoiceId=voice_id,
-            Engine="neural"  # Neural engine for more natural voice
-        )
-
-        out_path = output_file
-        with open(out_path, "wb") as f:
+        with observe_stage("polly", provider="aws", voice=voice_id):
+            resp = polly.synthesize_speech(
+                Text=safe_text,
+                OutputFormat="mp3",
+                VoiceId=voice_id,
+                Engine="neural"  # Neural engine for more natural voice
+            )
             audio_stream = resp.get("AudioStream")
-            if audio_stream:
-                f.write(audio_stream.read())
-            else:
+            if not audio_stream:
                 raise RuntimeError("Polly returned no AudioStream.")
+            # Stops reading if the reader has gone away
+            audio = read_stream(audio_stream)
+
+        out_path = output_file
+        with span("media.write", kind="audio", bytes=len(audio)), open(out_path, "wb") as f:
+            f.write(audio)
         
         print(f"✅ Voice narration saved with {voice_id} voice")
         return out_path